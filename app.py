@@ -1,20 +1,22 @@
 # pyright: reportGeneralTypeIssues=false, reportMissingImports=false, reportMissingModuleSource=false, reportUnknownMemberType=false, reportUnknownArgumentType=false, reportUnknownVariableType=false, reportUnknownParameterType=false, reportAttributeAccessIssue=false
 import os
-from typing import Any, cast
+from typing import Any, NamedTuple, cast
 import uuid
 import json
 import io
 import base64
 import time
 from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, get_flashed_messages, Response
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, get_flashed_messages, Response, g, has_request_context, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from azure.identity import DefaultAzureCredential
 from azure.core.credentials import AzureKeyCredential
 from openai import AzureOpenAI
 from werkzeug.utils import secure_filename
 import hashlib
+import sqlite3
 import shutil
 from sqlalchemy import text, inspect as sa_inspect
 from sqlalchemy.exc import IntegrityError
@@ -30,6 +32,30 @@ from PIL import Image
 import numpy as np
 from azure.core.credentials import AzureKeyCredential
 import logger  # Importar el módulo de logging
+from vectorstore_cache import VectorStoreCache
+from faiss_storage import (compact_segments, convert_legacy_store, has_components, has_store, iter_store_paths,
+                           load_store, save_store, set_index_policy, store_components, write_segment)
+from index_factory import IndexPolicy
+from store_compactor import LOCK_FILE as STORE_LOCK_FILE, StoreCompactor
+from user_index import CHAT_SCOPE, KB_SCOPE, UserVectorIndex
+from chunk_filter import ChunkFilterStats, filter_chunks
+from file_artifacts import FileArtifactStore
+from near_duplicates import MinHasher, diff_chunks, signature_similarity
+from progress_store import ProgressStore
+from upload_events import StreamLimiter, job_progress_ids, upload_event_stream
+from chat_history import build_history_window, summary_prompt
+from chat_repository import BufferedChatRepository, ChatRepository
+from chunked_uploads import (
+    ChunkedUploadStore,
+    UploadOffsetError,
+    UploadSessionError,
+    UploadSessionNotFound,
+    write_stream,
+)
+from job_queue import JOB_CANCELLED, JOB_COMPLETED, JobCancelled, JobQueue, bind_current_job, check_cancelled
+from rag_pipeline.batching import TokenBatcher, load_encoding
+from rag_pipeline.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag_pipeline.rate_limit import is_rate_limit_error, retry_after_seconds
 
 # Cargar variables de entorno
 logger.info("Iniciando carga de variables de entorno", "app.warmup")
@@ -90,13 +116,16 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(VECTORDB_DIR, exist_ok=True)
 KNOWLEDGE_BASE_DIR = os.path.join(VECTORDB_DIR, 'knowledge_bases')
 os.makedirs(KNOWLEDGE_BASE_DIR, exist_ok=True)
+# JSON de chats ya incorporados a la base de datos (ver migrate_json_chats_to_database)
+CHAT_JSON_ARCHIVE_DIR = os.path.join(DATA_DIR, 'json_archive')
 os.makedirs(INSTANCE_DIR, exist_ok=True)
 logger.info(f"Directorios configurados: DATA_DIR={DATA_DIR}, UPLOAD_DIR={UPLOAD_DIR}, VECTORDB_DIR={VECTORDB_DIR}, INSTANCE_DIR={INSTANCE_DIR}", "app.warmup")
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_DIR
 logger.info(f"Carpeta de uploads configurada: {app.config['UPLOAD_FOLDER']}", "app.warmup")
 
-app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # 64MB max upload
+# Tamaño máximo de una petición; los archivos mayores se suben por partes (/api/upload/sessions)
+app.config['MAX_CONTENT_LENGTH'] = max(1, _env_int("UPLOAD_MAX_REQUEST_MB", 64)) * 1024 * 1024
 logger.info(f"Tamaño máximo de upload configurado: {app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)}MB", "app.warmup")
 
 # Mensaje de sistema por defecto utilizado en toda la aplicación
@@ -110,6 +139,10 @@ MAX_RAG_TOP_K = max(DEFAULT_RAG_TOP_K, _env_int("RAG_TOP_K_MAX", 20))
 DEFAULT_TEMPERATURE = min(max(_env_float("TEMPERATURE_DEFAULT", 1.0), 0.0), 2.0)
 DEFAULT_HISTORY_LIMIT = max(1, _env_int("MESSAGE_HISTORY_DEFAULT", 10))
 MAX_HISTORY_LIMIT = max(DEFAULT_HISTORY_LIMIT, _env_int("MESSAGE_HISTORY_MAX", 50))
+# Presupuesto de tokens del historial que se envía al modelo; lo que no cabe se resume
+HISTORY_MAX_TOKENS = max(256, _env_int("HISTORY_MAX_TOKENS", 8000))
+HISTORY_SUMMARY_MAX_TOKENS = max(0, _env_int("HISTORY_SUMMARY_MAX_TOKENS", 600))
+HISTORY_TOKEN_ENCODING = os.environ.get('HISTORY_TOKEN_ENCODING', 'cl100k_base')
 
 # Modificar la URL de la base de datos para usar la ruta absoluta en INSTANCE_DIR
 database_path = os.path.abspath(os.path.join(INSTANCE_DIR, 'mar-ia-jose.db'))
@@ -266,92 +299,369 @@ def get_openai_client(model_id=None):
 # Inicializar cliente predeterminado de Azure OpenAI
 client = get_openai_client()
 
+# Caché persistente de embeddings por (deployment, hash del texto), compartida por
+# todas las rutas de ingesta y por todos los procesos
+EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(VECTORDB_DIR, 'embedding_cache.sqlite3'))
+EMBEDDING_CACHE_MAX_BYTES = max(0, _env_int("EMBEDDING_CACHE_MAX_MB", 2048)) * 1024 * 1024
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES)
+logger.info(f"Caché de embeddings en {EMBEDDING_CACHE_PATH} ({EMBEDDING_CACHE_MAX_BYTES / (1024 * 1024)}MB)", "app.warmup")
+
 # Inicializar embeddings para RAG
-embeddings = AzureOpenAIEmbeddings(
-    azure_deployment=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
-    api_key=AZURE_OPENAI_EMBEDDING_APIKEY,
-    azure_endpoint=AZURE_OPENAI_EMBEDDING_ENDPOINT,
-    api_version=AZURE_OPENAI_EMBEDDING_API,
+embeddings = CachedEmbeddings(
+    AzureOpenAIEmbeddings(
+        azure_deployment=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+        api_key=AZURE_OPENAI_EMBEDDING_APIKEY,
+        azure_endpoint=AZURE_OPENAI_EMBEDDING_ENDPOINT,
+        api_version=AZURE_OPENAI_EMBEDDING_API,
+    ),
+    embedding_cache,
+    namespace=AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
 )
 
 
-EMBEDDING_PROGRESS = {}
-EMBEDDING_PROGRESS_LOCK = Lock()
+# Caché de bases vectoriales cargadas, compartida por todas las peticiones del proceso
+VECTORSTORE_CACHE_MAX_BYTES = max(0, _env_int("VECTORSTORE_CACHE_MAX_MB", 512)) * 1024 * 1024
+vectorstore_cache = VectorStoreCache(VECTORSTORE_CACHE_MAX_BYTES)
+logger.info(f"Caché de bases vectoriales configurada: {VECTORSTORE_CACHE_MAX_BYTES / (1024 * 1024)}MB", "app.warmup")
 
+# Índice aproximado (HNSW / IVF-PQ) para las bases grandes; ver index_factory
+VECTORSTORE_INDEX_POLICY = IndexPolicy.from_env()
+set_index_policy(VECTORSTORE_INDEX_POLICY)
+logger.info(
+    f"Política de índices: {VECTORSTORE_INDEX_POLICY.mode}, plano hasta {VECTORSTORE_INDEX_POLICY.flat_max_vectors} vectores",
+    "app.warmup",
+)
 
-def set_embedding_progress(progress_id: str | None, **updates):
-    if not progress_id:
-        return
-    with EMBEDDING_PROGRESS_LOCK:
-        state = EMBEDDING_PROGRESS.get(progress_id)
-        if not state:
-            state = {
-                'created_at': datetime.utcnow().isoformat()
-            }
-        state.update(updates)
-        state['updated_at'] = datetime.utcnow().isoformat()
-        EMBEDDING_PROGRESS[progress_id] = state
-
-
-def is_rate_limit_error(exc):
-    """Detecta si la excepción proviene de un límite de peticiones (HTTP 429)."""
-    status_code = getattr(exc, 'status_code', None)
-    if status_code == 429:
-        return True
-    http_status = getattr(exc, 'http_status', None)
-    if http_status == 429:
-        return True
-    error_code = getattr(getattr(exc, 'error', None), 'code', None)
-    if error_code in (429, '429'):
-        return True
-    message = str(exc).lower()
-    return '429' in message or 'rate limit' in message
+# Las subidas a una base existente escriben un segmento delta; al llegar a este
+# número de segmentos la base se compacta en segundo plano
+VECTORSTORE_SEGMENT_THRESHOLD = max(1, _env_int("VECTORSTORE_SEGMENT_THRESHOLD", 8))
+store_compactor = StoreCompactor(
+    embeddings,
+    threshold=VECTORSTORE_SEGMENT_THRESHOLD,
+    on_compacted=vectorstore_cache.invalidate,
+)
 
+# Modo de almacenamiento vectorial:
+# - "per_chat": una carpeta FAISS por chat; guardar una base RAG copia la carpeta.
+# - "per_user": un índice por usuario con etiquetas de chat y base RAG (ver
+#   user_index); guardar una base RAG solo escribe etiquetas.
+VECTOR_STORAGE_MODE = 'per_user' if os.environ.get('VECTOR_STORAGE_MODE', 'per_chat').strip().lower() == 'per_user' else 'per_chat'
+USER_INDEX_DIR = os.path.join(VECTORDB_DIR, 'user_indexes')
+USER_INDEXES = {}
+USER_INDEXES_LOCK = Lock()
+logger.info(f"Almacenamiento vectorial en modo {VECTOR_STORAGE_MODE}", "app.warmup")
+
+
+# Pool acotado para buscar en varias bases vectoriales en paralelo
+RAG_SEARCH_MAX_WORKERS = max(1, _env_int("RAG_SEARCH_MAX_WORKERS", 4))
+RAG_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=RAG_SEARCH_MAX_WORKERS, thread_name_prefix="rag-search")
+
+# Pool para ampliar en segundo plano las bases RAG anexadas tras una subida
+KNOWLEDGE_BASE_WRITE_WORKERS = max(1, _env_int("KNOWLEDGE_BASE_WRITE_WORKERS", 4))
+KNOWLEDGE_BASE_WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=KNOWLEDGE_BASE_WRITE_WORKERS, thread_name_prefix="kb-write")
+
+# Cola persistente de subidas (ver job_queue): la petición devuelve el id del
+# trabajo y los hilos de trabajo procesan el archivo. INGEST_WORKERS=0 deja este
+# proceso solo encolando (otro proceso con hilos de trabajo vacía la cola)
+INGEST_JOBS_DB = os.environ.get('INGEST_JOBS_DB', os.path.join(INSTANCE_DIR, 'ingest_jobs.sqlite3'))
+INGEST_WORKERS = max(0, _env_int("INGEST_WORKERS", 2))
+INGEST_MAX_JOBS_PER_USER = max(1, _env_int("INGEST_MAX_JOBS_PER_USER", 1))
+INGEST_MAX_ATTEMPTS = max(1, _env_int("INGEST_MAX_ATTEMPTS", 3))
+INGEST_PENDING_DIR = os.path.join(UPLOAD_DIR, '.pending')
+# Subidas de varios archivos: hilos para cargar y trocear en paralelo y máximo de archivos por lote
+INGEST_PARSE_WORKERS = max(1, _env_int("INGEST_PARSE_WORKERS", 4))
+UPLOAD_BATCH_MAX_FILES = max(1, _env_int("UPLOAD_BATCH_MAX_FILES", 20))
+
+# Subidas por partes reanudables (ver chunked_uploads): tamaño de cada parte,
+# tamaño máximo del archivo completo y caducidad de las sesiones sin actividad
+UPLOAD_CHUNK_SIZE_MB = max(1, _env_int("UPLOAD_CHUNK_SIZE_MB", 8))
+UPLOAD_MAX_FILE_MB = max(1, _env_int("UPLOAD_MAX_FILE_MB", 1024))
+UPLOAD_SESSION_TTL_SECONDS = max(60, _env_int("UPLOAD_SESSION_TTL_SECONDS", 86400))
+# Repositorio con escritura inmediata para los hilos de la cola y las migraciones;
+# las peticiones usan el suyo (ver get_chat_repository)
+chat_repository = ChatRepository()
+
+
+def get_chat_repository():
+    """Repositorio de chats de la petición en curso (fuera de una petición, el compartido).
+
+    Lee cada chat una sola vez por petición y acumula los cambios, que
+    ``flush_chat_repository`` escribe al terminar solo si algo cambió.
+    """
+    if not has_request_context():
+        return chat_repository
+    if 'chat_repository' not in g:
+        g.chat_repository = BufferedChatRepository()
+    return g.chat_repository
+
+
+@app.after_request
+def flush_chat_repository(response):
+    """Escribe los cambios de chats de la petición con una sola confirmación."""
+    repository = g.pop('chat_repository', None)
+    if repository is None:
+        return response
+    if response.status_code >= 500:
+        repository.discard()
+        return response
+    repository.flush()
+    logger.debug(f"E/S de chats en {request.method} {request.path}: {repository.stats()}", "app.flush_chat_repository")
+    return response
+
+upload_sessions = ChunkedUploadStore(
+    os.path.join(UPLOAD_DIR, '.sessions'),
+    max_size=UPLOAD_MAX_FILE_MB * 1024 * 1024,
+    ttl=UPLOAD_SESSION_TTL_SECONDS,
+)
+ingest_queue = JobQueue(
+    INGEST_JOBS_DB,
+    workers=INGEST_WORKERS,
+    per_user_limit=INGEST_MAX_JOBS_PER_USER,
+    max_attempts=INGEST_MAX_ATTEMPTS,
+    logger=logger,
+)
+logger.info(
+    f"Cola de subidas en {INGEST_JOBS_DB}: {INGEST_WORKERS} hilos, {INGEST_MAX_JOBS_PER_USER} trabajos por usuario",
+    "app.warmup",
+)
 
-def build_vectorstore_with_retry(chunks, embedding_client, *, base_delay=10, max_delay=30, progress_id=None):
-    """Crea la base vectorial aplicando reintentos con backoff ante errores 429."""
-    attempt = 0
-    last_exc = None
-    set_embedding_progress(progress_id, status="starting", attempt=0, waiting_seconds=0, completed=False)
-    while True:
-        attempt += 1
-        try:
-            set_embedding_progress(progress_id, status="processing", attempt=attempt, waiting_seconds=0, completed=False)
-            vectorstore = FAISS.from_documents(chunks, embedding_client)
-            set_embedding_progress(progress_id, status="completed", attempt=attempt, waiting_seconds=0, completed=True)
-            return vectorstore
-        except Exception as exc:
-            last_exc = exc
-            if not is_rate_limit_error(exc):
-                set_embedding_progress(
-                    progress_id,
-                    status="failed",
-                    attempt=attempt,
-                    waiting_seconds=0,
-                    completed=True,
-                    error=str(exc)
-                )
-                break
 
-            wait_time = min(base_delay * (2 ** (attempt - 1)), max_delay)
-            logger.warning(
-                f"Límite de peticiones al generar embeddings (intento {attempt}). Reintentando en {wait_time} segundos.",
-                "app.build_vectorstore_with_retry"
+def user_index_enabled():
+    return VECTOR_STORAGE_MODE == 'per_user'
+
+
+def _user_index_relpath(user_id):
+    return os.path.join('user_indexes', str(user_id))
+
+
+def get_user_vector_index(user_id):
+    """Índice vectorial único del usuario (uno por proceso, compartido entre hilos)."""
+    key = str(user_id)
+    with USER_INDEXES_LOCK:
+        index = USER_INDEXES.get(key)
+        if index is None:
+            index = UserVectorIndex(
+                os.path.join(VECTORDB_DIR, _user_index_relpath(key)),
+                segment_threshold=VECTORSTORE_SEGMENT_THRESHOLD,
+                schedule_compaction=lambda user_index: store_compactor.schedule(user_index.path, user_index.compact),
             )
+            USER_INDEXES[key] = index
+        return index
+
+
+def _is_user_index_kb(kb):
+    """Indica si la base RAG vive como etiquetas en el índice del usuario."""
+    return os.path.normpath(kb.vectorstore_path or '') == os.path.normpath(_user_index_relpath(kb.user_id))
+
+
+def load_vectorstore(store_path):
+    """Carga una base FAISS desde disco (copia propia en memoria, apta para modificarla)."""
+    return load_store(store_path, embeddings, writable=True)
+
+
+def load_vectorstore_readonly(store_path):
+    """Abre una base FAISS de solo lectura: índice mapeado en memoria y docstore perezoso."""
+    return load_store(store_path, embeddings)
+
+
+def load_vectorstore_cached(store_path):
+    """Obtiene una base FAISS de solo lectura reutilizando la caché del proceso."""
+    return vectorstore_cache.get(store_path, load_vectorstore_readonly)
+
+
+# Progreso de las subidas en SQLite para que cualquier proceso pueda consultarlo
+# (ver progress_store); las entradas terminadas caducan a los
+# UPLOAD_PROGRESS_TTL_SECONDS y las abandonadas a los UPLOAD_PROGRESS_ACTIVE_TTL_SECONDS
+UPLOAD_PROGRESS_DB = os.environ.get('UPLOAD_PROGRESS_DB', os.path.join(INSTANCE_DIR, 'upload_progress.sqlite3'))
+upload_progress = ProgressStore(
+    UPLOAD_PROGRESS_DB,
+    ttl=max(1, _env_int("UPLOAD_PROGRESS_TTL_SECONDS", 3600)),
+    active_ttl=max(1, _env_int("UPLOAD_PROGRESS_ACTIVE_TTL_SECONDS", 86400)),
+)
+# Ids de progreso por consulta en la lectura por lotes
+UPLOAD_PROGRESS_MAX_IDS = 100
+
+# Flujo SSE de progreso (/api/upload/events): intervalo de comprobación en el
+# servidor, duración máxima de cada conexión y cierre tras un rato sin trabajos
+UPLOAD_EVENTS_INTERVAL_SECONDS = max(0.1, _env_float("UPLOAD_EVENTS_INTERVAL_SECONDS", 0.5))
+UPLOAD_EVENTS_MAX_SECONDS = max(10, _env_int("UPLOAD_EVENTS_MAX_SECONDS", 300))
+UPLOAD_EVENTS_IDLE_SECONDS = max(1, _env_int("UPLOAD_EVENTS_IDLE_SECONDS", 15))
+# Cada flujo SSE ocupa un hilo WSGI mientras dura: se limitan los simultáneos
+# por proceso y el resto de clientes vuelve al sondeo
+upload_event_streams = StreamLimiter(_env_int("UPLOAD_EVENTS_MAX_STREAMS", 5))
+
+
+def set_embedding_progress(progress_id: str | list | None, **updates):
+    """Actualiza el progreso de una subida; con una lista de ids, el de todas (subidas por lotes)."""
+    progress_ids = [progress_id] if isinstance(progress_id, str) else [pid for pid in progress_id or [] if pid]
+    if not progress_ids:
+        return
+    try:
+        upload_progress.update_many(progress_ids, **updates)
+    except sqlite3.Error as exc:
+        # El progreso es informativo: un fallo al guardarlo no debe interrumpir la subida
+        logger.warning(f"No se pudo guardar el progreso {progress_id}: {exc}", "app.set_embedding_progress")
+
+
+EMBEDDING_BATCH_SIZE = max(1, _env_int("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_MAX_RETRIES = max(1, _env_int("EMBEDDING_MAX_RETRIES", 8))
+CHUNK_FILTER_MIN_CHARS = max(0, _env_int("CHUNK_FILTER_MIN_CHARS", 20))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+EMBEDDING_BATCH_MAX_TOKENS = max(1, _env_int("EMBEDDING_BATCH_MAX_TOKENS", 16000))
+EMBEDDING_MAX_INPUT_TOKENS = max(1, _env_int("EMBEDDING_MAX_INPUT_TOKENS", 8191))
+
+# Empaquetado de peticiones de embeddings por tokens reales (tiktoken): cada lote
+# llega hasta EMBEDDING_BATCH_MAX_TOKENS y los textos que superan el límite del
+# modelo se trocean y promedian (o se truncan) en lugar de hacer fallar el lote
+embedding_batcher = TokenBatcher(
+    max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+    max_input_tokens=EMBEDDING_MAX_INPUT_TOKENS,
+    max_batch_size=EMBEDDING_BATCH_SIZE,
+    oversize='truncate' if os.environ.get('EMBEDDING_OVERSIZE_STRATEGY', 'split').lower() == 'truncate' else 'split',
+    encoding_name=os.environ.get('EMBEDDING_TOKEN_ENCODING', 'cl100k_base'),
+)
+if embedding_batcher.encoding is None:
+    logger.warning("Codificación de tiktoken no disponible; se estiman los tokens por longitud de texto", "app.warmup")
+
+# Fragmentos y vectores de cada archivo procesado, reutilizables al subirlo a otro chat.
+# La huella invalida los artefactos si cambia el modelo de embeddings o el troceado
+FILE_ARTIFACTS_DIR = os.environ.get('FILE_ARTIFACTS_DIR', os.path.join(VECTORDB_DIR, 'file_artifacts'))
+file_artifacts = FileArtifactStore(
+    FILE_ARTIFACTS_DIR,
+    embeddings,
+    fingerprint={
+        "embedding_deployment": AZURE_OPENAI_EMBEDDING_DEPLOYMENT,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunk_filter_min_chars": CHUNK_FILTER_MIN_CHARS,
+        "max_input_tokens": EMBEDDING_MAX_INPUT_TOKENS,
+        "oversize": embedding_batcher.oversize,
+    },
+)
+
+# Revisiones de documentos ya subidos: similitud MinHash mínima para reutilizar los
+# vectores de los fragmentos que no cambian
+NEAR_DUPLICATE_THRESHOLD = min(max(_env_float("NEAR_DUPLICATE_THRESHOLD", 0.5), 0.0), 1.0)
+NEAR_DUPLICATE_MAX_CANDIDATES = max(0, _env_int("NEAR_DUPLICATE_MAX_CANDIDATES", 500))
+minhasher = MinHasher()
+
+
+def embed_texts_in_batches(texts, embedding_client, *, batcher=None, base_delay=10, max_delay=30,
+                           max_retries=None, progress_id=None):
+    """Genera embeddings lote a lote conservando cada lote terminado.
+
+    Los lotes se forman por número de tokens con ``embedding_batcher``; los
+    textos troceados por superar el límite del modelo se recomponen al final.
+
+    Ante un 429 solo se reintenta el lote fallido, esperando lo indicado por
+    Retry-After o, en su defecto, con backoff exponencial. Con la caché
+    persistente de embeddings cada lote terminado queda además guardado en disco,
+    por lo que un reintento completo de la subida tampoco repite esos lotes.
+    """
+    batcher = batcher or embedding_batcher
+    max_retries = max_retries or EMBEDDING_MAX_RETRIES
+    plan = batcher.plan(texts)
+    batch_vectors_list = []
+    total_batches = len(plan.batches)
+
+    for batch_number in range(1, total_batches + 1):
+        check_cancelled()
+        batch = plan.batch_texts(batch_number - 1)
+        attempt = 0
+        while True:
+            attempt += 1
             set_embedding_progress(
                 progress_id,
-                status="rate_limited",
+                status="processing",
                 attempt=attempt,
-                waiting_seconds=wait_time,
-                completed=False
+                waiting_seconds=0,
+                completed=False,
+                batch=batch_number,
+                total_batches=total_batches,
+                embedded_chunks=plan.inputs_before(batch_number - 1),
+                total_chunks=len(texts)
             )
-            time.sleep(wait_time)
-            set_embedding_progress(progress_id, status="reintentando", attempt=attempt, waiting_seconds=0, completed=False)
+            try:
+                batch_vectors = embedding_client.embed_documents(batch)
+                break
+            except Exception as exc:
+                if not is_rate_limit_error(exc) or attempt >= max_retries:
+                    set_embedding_progress(
+                        progress_id,
+                        status="failed",
+                        attempt=attempt,
+                        waiting_seconds=0,
+                        completed=True,
+                        error=str(exc)
+                    )
+                    raise
+
+                retry_after = retry_after_seconds(exc)
+                if retry_after is not None:
+                    wait_time = min(retry_after, max_delay * 4)
+                else:
+                    wait_time = min(base_delay * (2 ** (attempt - 1)), max_delay)
+                logger.warning(
+                    f"Límite de peticiones en el lote {batch_number}/{total_batches} (intento {attempt}). "
+                    f"Reintentando el lote en {wait_time:.1f} segundos.",
+                    "app.embed_texts_in_batches"
+                )
+                set_embedding_progress(
+                    progress_id,
+                    status="rate_limited",
+                    attempt=attempt,
+                    waiting_seconds=round(wait_time),
+                    completed=False
+                )
+                time.sleep(wait_time)
+                set_embedding_progress(progress_id, status="reintentando", attempt=attempt, waiting_seconds=0, completed=False)
 
-    if last_exc is None:
-        raise RuntimeError("No se pudo construir la base vectorial por un motivo desconocido.")
+        batch_vectors_list.append(batch_vectors)
 
-    raise last_exc
+    return plan.assemble(batch_vectors_list)
+
+
+def embed_chunks_with_retry(chunks, embedding_client, *, base_delay=10, max_delay=30, progress_id=None):
+    """Genera los embeddings de ``chunks`` por lotes con reintentos por lote ante errores 429."""
+    set_embedding_progress(progress_id, status="starting", attempt=0, waiting_seconds=0, completed=False)
+    texts = [chunk.page_content for chunk in chunks]
+    vectors = embed_texts_in_batches(
+        texts,
+        embedding_client,
+        base_delay=base_delay,
+        max_delay=max_delay,
+        progress_id=progress_id,
+    )
+    set_embedding_progress(progress_id, status="completed", attempt=None, waiting_seconds=0, completed=True,
+                           embedded_chunks=len(texts))
+    return vectors
+
+
+def build_vectorstore_with_retry(chunks, embedding_client, *, base_delay=10, max_delay=30, progress_id=None):
+    """Crea la base vectorial generando embeddings por lotes con reintentos por lote ante errores 429.
+
+    El índice FAISS solo se monta cuando todos los lotes han terminado.
+    """
+    vectors = embed_chunks_with_retry(
+        chunks,
+        embedding_client,
+        base_delay=base_delay,
+        max_delay=max_delay,
+        progress_id=progress_id,
+    )
+    return vectorstore_from_vectors(chunks, vectors, embedding_client)
+
+
+def vectorstore_from_vectors(chunks, vectors, embedding_client=None):
+    """Monta una base FAISS en memoria con embeddings ya calculados (sin llamadas a Azure)."""
+    ids = [chunk.id for chunk in chunks] if any(getattr(chunk, 'id', None) for chunk in chunks) else None
+    return FAISS.from_embeddings(
+        list(zip([chunk.page_content for chunk in chunks], vectors)),
+        embedding_client or embeddings,
+        metadatas=[chunk.metadata for chunk in chunks],
+        ids=ids,
+    )
 
 
 def get_user_id():
@@ -392,20 +702,16 @@ def _resolve_float_setting(value, default, minimum=None, maximum=None, precision
 def save_chat_history(user_id, messages, system_message=None, title=None, file_hashes=None,
                       rag_top_k=None, temperature=None, message_history_limit=None,
                       attached_bases=None):
-    """Guarda el historial de chat y sus parámetros en un archivo JSON."""
+    """Guarda el historial de chat y sus parámetros (tablas ``Chat`` y ``Message``).
+
+    Solo se escriben los mensajes nuevos de ``messages``; con ``messages=None``
+    se actualiza únicamente la cabecera (título, mensaje de sistema, archivos...).
+    """
     chat_id = session.get('chat_id', str(uuid.uuid4()))
     session['chat_id'] = chat_id
     logger.debug(f"Guardando historial de chat para usuario {user_id}, chat_id: {chat_id}", "app.save_chat_history")
 
-    filename = os.path.join(DATA_DIR, f"{user_id}_{chat_id}.json")
-
-    existing_data = {}
-    if os.path.exists(filename):
-        try:
-            with open(filename, 'r', encoding='utf-8') as existing_file:
-                existing_data = json.load(existing_file)
-        except Exception as exc:  # pragma: no cover - resiliencia adicional
-            logger.warning(f"No se pudo leer historial previo para {chat_id}: {exc}", "app.save_chat_history")
+    existing_data = get_chat_repository().get(user_id, chat_id, with_messages=False) or {}
 
     # Determinar el título del chat
     if not title and messages:
@@ -413,13 +719,19 @@ def save_chat_history(user_id, messages, system_message=None, title=None, file_h
         preview = messages[0]['content'][:50] + '...' if messages else 'Chat vacío'
         title = preview
 
-    # Asegurar un título por defecto
-    if not title:
+    # Asegurar un título por defecto (al guardar solo la cabecera se conserva el que hubiera)
+    if not title and messages is None:
+        title = existing_data.get('title')
+    elif not title:
         title = 'Nueva conversación'
 
-    # Usar los file_hashes y knowledge bases proporcionados o los de la sesión actual
+    # Usar los file_hashes y knowledge bases proporcionados o los de la sesión actual.
+    # Los trabajos de la cola de subidas añaden archivos directamente al chat
+    # guardado, así que la lista de la sesión se completa con la guardada
     if file_hashes is None:
-        file_hashes = session.get('file_hashes', [])
+        file_hashes = list(session.get('file_hashes', []))
+        file_hashes += [h for h in existing_data.get('file_hashes', []) if h not in file_hashes]
+        session['file_hashes'] = file_hashes
     if attached_bases is None:
         attached_bases = session.get('attached_bases', [])
 
@@ -446,21 +758,20 @@ def save_chat_history(user_id, messages, system_message=None, title=None, file_h
         maximum=MAX_HISTORY_LIMIT
     )
 
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump({
-            'chat_id': chat_id,
-            'timestamp': datetime.now().isoformat(),
-            'messages': messages,
-            'system_message': system_message,
-            'title': title,
-            'file_hashes': file_hashes,
-            'rag_top_k': resolved_top_k,
-            'temperature': resolved_temperature,
-            'message_history_limit': resolved_history_limit,
-            'attached_bases': attached_bases
-        }, f, ensure_ascii=False, indent=2)
+    chat_data = {
+        'system_message': system_message,
+        'title': title,
+        'file_hashes': file_hashes,
+        'rag_top_k': resolved_top_k,
+        'temperature': resolved_temperature,
+        'message_history_limit': resolved_history_limit,
+        'attached_bases': attached_bases
+    }
+    if messages is not None:
+        chat_data['messages'] = messages
+    get_chat_repository().save(user_id, chat_id, chat_data)
     
-    logger.info(f"Chat guardado: {title[:30]}... (ID: {chat_id})", "app.save_chat_history")
+    logger.info(f"Chat guardado: {(title or '')[:30]}... (ID: {chat_id})", "app.save_chat_history")
     session['attached_bases'] = attached_bases
     return chat_id
 
@@ -502,42 +813,44 @@ def create_new_chat_session(user_id, system_message=None, title=None):
 
 
 def load_chat_history(user_id, chat_id=None):
-    """Carga el historial de chat desde un archivo JSON"""
-    if chat_id:
-        filename = os.path.join(DATA_DIR, f"{user_id}_{chat_id}.json")
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                session['chat_id'] = chat_id
-                return data['messages']
-
-    # Si no hay chat_id o no existe el archivo, devolver una lista vacía
+    """Carga los mensajes de un chat"""
+    repository = get_chat_repository()
+    if chat_id and repository.exists(user_id, chat_id):
+        session['chat_id'] = chat_id
+        return repository.messages(chat_id)
+
+    # Si no hay chat_id o no existe el chat, devolver una lista vacía
     return []
 
-def get_chat_data(user_id, chat_id):
-    """Obtiene todos los datos de un chat específico"""
-    if chat_id:
-        filename = os.path.join(DATA_DIR, f"{user_id}_{chat_id}.json")
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                logger.debug(f"Cargando datos de chat: {chat_id}", "app.get_chat_data")
-                data = json.load(f)
-
-            if not isinstance(data, dict):
-                data = {}
-
-            data['messages'] = data.get('messages', [])
-            data['system_message'] = data.get('system_message')
-            data['title'] = data.get('title')
-            data['file_hashes'] = data.get('file_hashes', [])
-            data['attached_bases'] = data.get('attached_bases', [])
-            data['rag_top_k'] = _resolve_int_setting(data.get('rag_top_k'), DEFAULT_RAG_TOP_K, minimum=1, maximum=MAX_RAG_TOP_K)
-            data['temperature'] = _resolve_float_setting(data.get('temperature'), DEFAULT_TEMPERATURE, minimum=0.0, maximum=2.0, precision=1)
-            data['message_history_limit'] = _resolve_int_setting(data.get('message_history_limit'), DEFAULT_HISTORY_LIMIT, minimum=1, maximum=MAX_HISTORY_LIMIT)
-
-            session['attached_bases'] = data['attached_bases']
+def read_chat_data(user_id, chat_id, with_messages=True):
+    """Lee los datos de un chat sin tocar la sesión (usable fuera de una petición).
 
-            return data
+    Devuelve None si el chat no existe. Con ``with_messages=False`` solo se lee
+    la cabecera y ``messages`` no aparece en el resultado.
+    """
+    data = get_chat_repository().get(user_id, chat_id, with_messages=with_messages)
+    if data is None:
+        return None
+    logger.debug(f"Cargando datos de chat: {chat_id}", "app.get_chat_data")
+
+    if with_messages:
+        data['messages'] = data.get('messages', [])
+    data['system_message'] = data.get('system_message')
+    data['title'] = data.get('title')
+    data['file_hashes'] = data.get('file_hashes', [])
+    data['attached_bases'] = data.get('attached_bases', [])
+    data['rag_top_k'] = _resolve_int_setting(data.get('rag_top_k'), DEFAULT_RAG_TOP_K, minimum=1, maximum=MAX_RAG_TOP_K)
+    data['temperature'] = _resolve_float_setting(data.get('temperature'), DEFAULT_TEMPERATURE, minimum=0.0, maximum=2.0, precision=1)
+    data['message_history_limit'] = _resolve_int_setting(data.get('message_history_limit'), DEFAULT_HISTORY_LIMIT, minimum=1, maximum=MAX_HISTORY_LIMIT)
+    return data
+
+
+def get_chat_data(user_id, chat_id, with_messages=True):
+    """Obtiene todos los datos de un chat específico"""
+    data = read_chat_data(user_id, chat_id, with_messages=with_messages)
+    if data is not None:
+        session['attached_bases'] = data['attached_bases']
+        return data
     logger.debug(f"No se encontró chat con ID: {chat_id}", "app.get_chat_data")
     session['attached_bases'] = []
     return {
@@ -552,26 +865,31 @@ def get_chat_data(user_id, chat_id):
         "timestamp": None
     }
 
+
+CHAT_FILE_LOCK = Lock()
+
+
+def add_files_to_chat(user_id, chat_id, file_hashes):
+    """Añade ``file_hashes`` a los archivos del chat sin usar la sesión (solo se escribe la cabecera).
+
+    La usan los trabajos de la cola de subidas; la sesión del usuario se
+    sincroniza al consultar el estado del trabajo (ver ``get_job``).
+    """
+    with CHAT_FILE_LOCK:
+        data = chat_repository.get(user_id, chat_id, with_messages=False)
+        if data is None:
+            raise ValueError(f"El chat {chat_id} ya no existe")
+        new_hashes = [h for h in dict.fromkeys(file_hashes) if h not in data['file_hashes']]
+        if not new_hashes:
+            return data
+        data = chat_repository.update_header(user_id, chat_id, file_hashes=data['file_hashes'] + new_hashes)
+    logger.debug(f"Chat {chat_id} actualizado con {len(new_hashes)} archivos nuevos", "app.add_files_to_chat")
+    return data
+
+
 def get_user_chats(user_id):
-    """Obtiene la lista de chats del usuario"""
-    chats = []
-    for filename in os.listdir(DATA_DIR):
-        if filename.startswith(f"{user_id}_") and filename.endswith('.json'):
-            chat_id = filename.replace(f"{user_id}_", "").replace('.json', "")
-            with open(os.path.join(DATA_DIR, filename), 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Usar el título personalizado si existe, de lo contrario usar el primer mensaje
-                preview = data.get('title') or (data['messages'][0]['content'][:50] + '...' if data['messages'] else 'Chat vacío')
-                chats.append({
-                    'id': chat_id,
-                    'timestamp': data.get('timestamp', ''),
-                    'preview': preview,
-                    'system_message': data.get('system_message')
-                })
-
-    # Ordenar por timestamp, más reciente primero
-    chats.sort(key=lambda x: x['timestamp'], reverse=True)
-    return chats
+    """Obtiene la lista de chats del usuario (el más reciente primero)"""
+    return get_chat_repository().list_chats(user_id)
 
 
 def _persist_attached_bases(user_id, chat_id, chat_data, attached_bases):
@@ -579,7 +897,7 @@ def _persist_attached_bases(user_id, chat_id, chat_data, attached_bases):
 
     chat_id = save_chat_history(
         user_id,
-        chat_data.get('messages', []),
+        None,
         chat_data.get('system_message'),
         chat_data.get('title'),
         chat_data.get('file_hashes', []),
@@ -708,6 +1026,169 @@ def ensure_user_type_consistency():
         db.session.rollback()
 
 
+def ensure_file_catalog_columns():
+    """Añade a la tabla de archivos las columnas nuevas del modelo ``File`` (bases creadas antes)."""
+    try:
+        inspector = sa_inspect(db.engine)
+        file_table_name = File.__tablename__
+        column_names = {column['name'] for column in inspector.get_columns(file_table_name)}
+
+        new_columns = {
+            'sha256': 'VARCHAR(64)',
+            'stored_path': 'VARCHAR(512)',
+            'size': 'BIGINT',
+            'mtime': 'FLOAT',
+        }
+        with db.engine.begin() as connection:
+            for column_name, column_type in new_columns.items():
+                if column_name not in column_names:
+                    logger.info(f"Añadiendo columna {column_name} a la tabla de archivos", "app.ensure_file_catalog_columns")
+                    connection.execute(text(f"ALTER TABLE {file_table_name} ADD COLUMN {column_name} {column_type}"))
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{file_table_name}_sha256 ON {file_table_name} (sha256)"
+            ))
+    except Exception as exc:
+        logger.error(f"No se pudo actualizar la tabla de archivos: {exc}", "app.ensure_file_catalog_columns")
+        db.session.rollback()
+
+
+def ensure_chat_table_columns():
+    """Añade a las tablas de chats y mensajes las columnas e índices nuevos (bases creadas antes)."""
+    try:
+        inspector = sa_inspect(db.engine)
+        new_columns = {
+            Chat.__tablename__: {
+                'file_hashes': 'TEXT',
+                'attached_bases': 'TEXT',
+                'rag_top_k': 'INTEGER',
+                'temperature': 'FLOAT',
+                'message_history_limit': 'INTEGER',
+                'history_summary': 'TEXT',
+                'history_summary_upto': 'INTEGER NOT NULL DEFAULT 0',
+            },
+            Message.__tablename__: {
+                'content_type': "VARCHAR(10) NOT NULL DEFAULT 'text'",
+            },
+        }
+        with db.engine.begin() as connection:
+            for table_name, columns in new_columns.items():
+                column_names = {column['name'] for column in inspector.get_columns(table_name)}
+                for column_name, column_type in columns.items():
+                    if column_name not in column_names:
+                        logger.info(f"Añadiendo columna {column_name} a la tabla {table_name}", "app.ensure_chat_table_columns")
+                        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}"))
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_chat_user_updated ON {Chat.__tablename__} (user_id, updated_at)"
+            ))
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_message_chat_id ON {Message.__tablename__} (chat_id, id)"
+            ))
+    except Exception as exc:
+        logger.error(f"No se pudieron actualizar las tablas de chats: {exc}", "app.ensure_chat_table_columns")
+        db.session.rollback()
+
+
+def migrate_json_chats_to_database():
+    """Pasa los chats guardados como JSON en DATA_DIR a las tablas ``Chat`` y ``Message``.
+
+    Cada JSON incorporado se mueve a ``CHAT_JSON_ARCHIVE_DIR``, así que la
+    migración se hace una sola vez por archivo y no cuesta nada en los
+    arranques siguientes.
+    """
+    migrated = 0
+    for filename in sorted(os.listdir(DATA_DIR)):
+        path = os.path.join(DATA_DIR, filename)
+        if not filename.endswith('.json') or '_' not in filename or not os.path.isfile(path):
+            continue
+        try:
+            chat_repository.import_json_file(path)
+            os.makedirs(CHAT_JSON_ARCHIVE_DIR, exist_ok=True)
+            os.replace(path, os.path.join(CHAT_JSON_ARCHIVE_DIR, filename))
+            migrated += 1
+        except Exception as exc:
+            db.session.rollback()
+            logger.error(f"No se pudo migrar el chat {filename}: {exc}", "app.migrate_json_chats_to_database")
+    if migrated:
+        logger.info(f"Chats migrados a la base de datos: {migrated}", "app.migrate_json_chats_to_database")
+
+
+def _catalog_stat(file_path):
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+
+def _catalog_file(row, file_path):
+    """Apunta la entrada ``row`` del catálogo a ``file_path`` (tamaño y fecha actuales)."""
+    row.stored_path = os.path.relpath(file_path, app.config['UPLOAD_FOLDER'])
+    row.filename = os.path.basename(file_path)
+    row.size, row.mtime = _catalog_stat(file_path)
+
+
+def catalog_file_path(row):
+    """Ruta del archivo de una entrada del catálogo, o None si ya no está o lo sustituyó otro."""
+    if not row.stored_path:
+        return None
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], row.stored_path)
+    try:
+        size, mtime = _catalog_stat(file_path)
+    except OSError:
+        return None
+    if size != row.size or mtime != row.mtime:
+        return None
+    return file_path
+
+
+def catalog_files(file_hashes):
+    """Archivos del catálogo para ``file_hashes`` (en ese orden) con el formato de ``/api/files``."""
+    rows = {row.file_hash: row for row in File.query.filter(File.file_hash.in_(list(file_hashes)))} if file_hashes else {}
+    files = []
+    for file_hash in file_hashes:
+        row = rows.get(file_hash)
+        if row is None or catalog_file_path(row) is None:
+            continue
+        files.append({
+            "id": file_hash,
+            "name": row.filename,
+            "date": datetime.fromtimestamp(row.mtime).isoformat()
+        })
+    return files
+
+
+def backfill_file_catalog():
+    """Rellena el catálogo de archivos a partir de la carpeta de uploads (una sola vez).
+
+    Cada archivo se lee una vez para calcular su hash; los que no tenían fila en
+    ``File`` (subidas anónimas o anteriores al registro) se añaden sin usuario.
+    """
+    marker = os.path.join(INSTANCE_DIR, '.file_catalog_backfilled')
+    if os.path.exists(marker):
+        return
+    try:
+        rows = {row.file_hash: row for row in File.query.all()}
+        cataloged = 0
+        for filename in sorted(os.listdir(app.config['UPLOAD_FOLDER'])):
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            if not os.path.isfile(file_path):
+                continue
+            file_hash = file_md5(file_path)
+            row = rows.get(file_hash)
+            if row is None:
+                rows[file_hash] = row = File(id=str(uuid.uuid4()), user_id=None, filename=filename, file_hash=file_hash)
+                db.session.add(row)
+            elif row.stored_path and catalog_file_path(row) is not None:
+                continue
+            _catalog_file(row, file_path)
+            cataloged += 1
+        db.session.commit()
+        with open(marker, 'w', encoding='utf-8') as f:
+            f.write(f"Catálogo de archivos completado: {datetime.now().isoformat()}\n")
+            f.write(f"Archivos catalogados: {cataloged}\n")
+        logger.info(f"Catálogo de archivos completado: {cataloged} archivos", "app.backfill_file_catalog")
+    except Exception as exc:
+        logger.error(f"No se pudo completar el catálogo de archivos: {exc}", "app.backfill_file_catalog")
+        db.session.rollback()
+
+
 def migrate_vectorstores_to_chat_system():
     """Migra las bases vectoriales existentes del sistema por archivo al sistema por chat"""
     try:
@@ -752,7 +1233,7 @@ def migrate_vectorstores_to_chat_system():
                         if os.path.exists(old_db_path):
                             try:
                                 # Cargar la base vectorial antigua
-                                vectorstore = FAISS.load_local(old_db_path, embeddings, allow_dangerous_deserialization=True)
+                                vectorstore = load_vectorstore(old_db_path)
                                 
                                 # Obtener todos los documentos
                                 docs = list(vectorstore.docstore._dict.values())  # type: ignore[attr-defined]
@@ -776,7 +1257,7 @@ def migrate_vectorstores_to_chat_system():
                         os.makedirs(chat_db_path, exist_ok=True)
                         
                         new_vectorstore = build_vectorstore_with_retry(all_chunks, embeddings)
-                        new_vectorstore.save_local(chat_db_path)
+                        save_store(new_vectorstore, chat_db_path)
                         
                         logger.info(f"Chat {chat_id} migrado con {len(all_chunks)} chunks de {len(valid_file_hashes)} archivos", "app.migrate_vectorstores")
                         migrated_count += 1
@@ -809,6 +1290,72 @@ def migrate_vectorstores_to_chat_system():
         logger.error(f"Error durante la migración de bases vectoriales: {str(e)}", "app.migrate_vectorstores")
 
 
+def convert_legacy_vectorstores():
+    """Convierte las bases guardadas con ``index.pkl`` al formato mapeable (``docstore.sqlite3``)."""
+    converted = 0
+    for store_path in list(iter_store_paths(VECTORDB_DIR)):
+        try:
+            if convert_legacy_store(store_path, embeddings):
+                vectorstore_cache.invalidate(store_path)
+                converted += 1
+        except Exception as exc:
+            logger.warning(f"No se pudo convertir la base vectorial {store_path}: {exc}", "app.convert_legacy_vectorstores")
+    if converted:
+        logger.info(f"Bases vectoriales convertidas al formato sin pickle: {converted}", "app.convert_legacy_vectorstores")
+
+
+def _import_store_into_user_index(store_path, user_id, scope):
+    """Incorpora una carpeta FAISS (con sus segmentos) al índice del usuario."""
+    with store_compactor.locked(store_path):
+        store_compactor.compact(store_path)
+        return get_user_vector_index(user_id).import_vectorstore(load_vectorstore(store_path), [scope])
+
+
+def migrate_vectorstores_to_user_indexes():
+    """En modo por usuario, pasa las bases por chat y las bases RAG copiadas al índice de su usuario.
+
+    Los vectores se leen de los índices existentes, sin llamadas a Azure, y las
+    copias guardadas como base RAG comparten ids con su chat, por lo que solo
+    añaden etiquetas. Cada carpeta se elimina tras incorporarla: la migración se
+    puede repetir en cada arranque sin coste.
+    """
+    if not user_index_enabled():
+        return
+
+    migrated = 0
+    for user_id, chat_id in chat_repository.chat_ids():
+        chat_db_path = os.path.join(VECTORDB_DIR, chat_id)
+        if not has_components(chat_db_path):
+            continue
+        try:
+            _import_store_into_user_index(chat_db_path, user_id, (CHAT_SCOPE, chat_id))
+            shutil.rmtree(chat_db_path, ignore_errors=True)
+            vectorstore_cache.invalidate(chat_db_path)
+            migrated += 1
+        except Exception as exc:
+            logger.warning(f"No se pudo migrar la base vectorial del chat {chat_id}: {exc}", "app.migrate_vectorstores_to_user_indexes")
+
+    for kb in KnowledgeBase.query.all():
+        if _is_user_index_kb(kb):
+            continue
+        kb_path = _resolve_vectorstore_path(kb.vectorstore_path)
+        if not kb_path or not has_components(kb_path):
+            continue
+        try:
+            _import_store_into_user_index(kb_path, kb.user_id, (KB_SCOPE, kb.id))
+            kb.vectorstore_path = _user_index_relpath(kb.user_id)
+            db.session.commit()
+            shutil.rmtree(kb_path, ignore_errors=True)
+            vectorstore_cache.invalidate(kb_path)
+            migrated += 1
+        except Exception as exc:
+            db.session.rollback()
+            logger.warning(f"No se pudo migrar la base RAG '{kb.name}' ({kb.id}): {exc}", "app.migrate_vectorstores_to_user_indexes")
+
+    if migrated:
+        logger.info(f"Bases vectoriales incorporadas a índices por usuario: {migrated}", "app.migrate_vectorstores_to_user_indexes")
+
+
 def cleanup_old_vectorstores():
     """Limpia las bases vectoriales antiguas (solo por hash de archivo) después de la migración.
     
@@ -997,25 +1544,147 @@ def extract_images_from_pdf(file_path):
     doc.close()
     return image_texts
 
-def process_file_for_chat(file_path, chat_id, process_mode="full", progress_id=None):
-    """Procesa un archivo para RAG y lo añade a la base vectorial del chat específico
-    
-    Args:
-        file_path: Ruta al archivo a procesar
-        chat_id: ID del chat al que pertenece el archivo
-        process_mode: "full" (texto + OCR por imagen), "text_only" (solo texto), "ocr_only" (OCR consolidado por página con imágenes).
-        progress_id: ID para seguimiento del progreso
-    
+class ProcessedFile(NamedTuple):
+    """Resultado de ``process_file_for_chat``."""
+
+    file_hash: str
+    num_chunks: int
+    chunks: list
+    filter_stats: ChunkFilterStats
+    vectors: Any
+    reused: bool = False
+    embeddings_reused: int = 0
+    diff_ratio: float | None = None
+    near_duplicate_of: str | None = None
+
+
+class PreparedFile(NamedTuple):
+    """Archivo cargado y troceado a la espera de embeddings (ver ``prepare_file_for_chat``)."""
+
+    file_path: str
+    file_hash: str
+    process_mode: str
+    chunks: list
+    filter_stats: ChunkFilterStats
+    pending: list  # fragmentos que necesitan embeddings
+    vectors: Any = None  # todos los vectores si se reutiliza un artefacto
+    diff: Any = None  # ChunkDiff respecto a la versión anterior del documento
+    signature: list | None = None
+    near_duplicate_of: str | None = None
+
+
+def file_md5(file_path, block_size=1024 * 1024):
+    """Hash MD5 del archivo leído por bloques (identifica el archivo en ``File`` y en los metadatos)."""
+    digest = hashlib.md5()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _prepare_from_artifact(file_path, file_hash, process_mode, user_id, progress_id):
+    """Fragmentos y vectores ya calculados del archivo, si hay artefacto utilizable.
+
+    Devuelve un ``PreparedFile`` sin fragmentos pendientes o None.
+    """
+    try:
+        artifact = file_artifacts.load(file_hash, process_mode)
+    except Exception as exc:
+        logger.warning(f"No se pudo leer el artefacto del archivo {file_hash}: {exc}", "app.process_file_for_chat")
+        return None
+    if artifact is None:
+        return None
+
+    filename = os.path.basename(file_path)
+    keep_ids = user_index_enabled() and user_id is not None
+    for chunk in artifact.chunks:
+        chunk.metadata['source'] = file_path
+        chunk.metadata['filename'] = filename
+        if not keep_ids:
+            # En el índice por usuario el mismo id enlaza el vector existente; en las
+            # bases por chat se usan ids nuevos para poder subir el archivo dos veces
+            chunk.id = str(uuid.uuid4())
+
+    filter_stats = ChunkFilterStats.from_dict(artifact.meta.get('stats', {}))
+    set_embedding_progress(progress_id, status="reusing", attempt=0, waiting_seconds=0, completed=False,
+                           chunk_filter=filter_stats.as_dict(), embeddings_saved=filter_stats.embeddings_saved)
+    logger.info(
+        f"Archivo {filename} ya procesado ({process_mode}): {len(artifact.chunks)} fragmentos reutilizados sin llamadas a Azure",
+        "app.process_file_for_chat",
+    )
+    return PreparedFile(file_path, file_hash, process_mode, artifact.chunks, filter_stats, [], vectors=artifact.vectors,
+                        near_duplicate_of=file_hash)
+
+
+def _find_near_duplicate(user_id, file_hash, process_mode, signature):
+    """Archivo del usuario más parecido a ``signature`` por encima del umbral.
+
+    Devuelve ``(artefacto, similitud)`` o ``(None, 0.0)``. Solo se consideran los
+    archivos del usuario con artefacto del mismo ``process_mode`` y pipeline.
+    """
+    if user_id is None or not NEAR_DUPLICATE_MAX_CANDIDATES:
+        return None, 0.0
+    try:
+        candidates = [
+            row.file_hash
+            for row in File.query.filter(File.user_id == user_id, File.file_hash != file_hash)
+            .order_by(File.created_at.desc())
+            .limit(NEAR_DUPLICATE_MAX_CANDIDATES)
+        ]
+    except Exception as exc:
+        logger.warning(f"No se pudieron obtener los archivos del usuario {user_id}: {exc}", "app.find_near_duplicate")
+        return None, 0.0
+
+    best_hash, best_similarity = None, 0.0
+    for candidate in candidates:
+        meta = file_artifacts.read_meta(candidate, process_mode)
+        if not meta or not meta.get('minhash'):
+            continue
+        similarity = signature_similarity(signature, meta['minhash'])
+        if similarity > best_similarity:
+            best_hash, best_similarity = candidate, similarity
+
+    if best_hash is None or best_similarity < NEAR_DUPLICATE_THRESHOLD:
+        return None, 0.0
+    try:
+        return file_artifacts.load(best_hash, process_mode), best_similarity
+    except Exception as exc:
+        logger.warning(f"No se pudo leer el artefacto del archivo {best_hash}: {exc}", "app.find_near_duplicate")
+        return None, 0.0
+
+
+def _save_file_artifact(file_hash, process_mode, chunks, vectors, filter_stats, signature=None):
+    try:
+        file_artifacts.save(file_hash, process_mode, vectorstore_from_vectors(chunks, vectors), filter_stats.as_dict(),
+                            signature=signature)
+    except Exception as exc:
+        logger.warning(f"No se pudo guardar el artefacto del archivo {file_hash}: {exc}", "app.process_file_for_chat")
+
+
+def prepare_file_for_chat(file_path, process_mode="full", progress_id=None, user_id=None, file_hash=None):
+    """Carga, trocea y filtra un archivo y decide qué fragmentos necesitan embeddings.
+
+    No genera embeddings ni escribe en ninguna base: así una subida por lotes
+    prepara varios archivos en paralelo y los vectoriza en una sola pasada. Si el
+    archivo ya se procesó con el mismo ``process_mode`` se reutiliza su artefacto
+    (sin cargarlo); si es una revisión de otro archivo del usuario (similitud
+    MinHash), solo quedan pendientes los fragmentos cuyo texto cambió.
+
     Returns:
-        tuple: (file_hash, num_chunks) - hash del archivo y número de fragmentos procesados
+        PreparedFile: fragmentos, estadísticas del filtro y fragmentos pendientes
     """
     file_extension = os.path.splitext(file_path)[1].lower()
-    logger.info(f"Procesando archivo para chat {chat_id}: {os.path.basename(file_path)} ({file_extension})", "app.process_file_for_chat")
+    logger.info(f"Preparando archivo: {os.path.basename(file_path)} ({file_extension})", "app.process_file_for_chat")
 
     process_mode = process_mode or "full"
     if process_mode not in {"full", "text_only", "ocr_only"}:
         process_mode = "full"
 
+    file_hash = file_hash or file_md5(file_path)
+    reused = _prepare_from_artifact(file_path, file_hash, process_mode, user_id, progress_id)
+    if reused is not None:
+        return reused
+
     image_texts: list[str] = []
     page_ocr_texts: list[tuple[int, str]] = []  # (page_index, text)
     if file_extension == '.pdf':
@@ -1040,6 +1709,7 @@ def process_file_for_chat(file_path, chat_id, process_mode="full", progress_id=N
                     logger.warning("No hay modelo configurado para OCR de imágenes (ocr_only)", "app.process_file_for_chat")
                 else:
                     for page_idx, page in enumerate(doc):
+                        check_cancelled()
                         images = page.get_images(full=True)
                         if not images:
                             continue
@@ -1188,8 +1858,8 @@ def process_file_for_chat(file_path, chat_id, process_mode="full", progress_id=N
 
         # Dividir documentos en chunks
         text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
         )
         chunks = text_splitter.split_documents(documents)
         set_embedding_progress(progress_id, status="chunking", attempt=0, waiting_seconds=0, completed=False)
@@ -1200,30 +1870,127 @@ def process_file_for_chat(file_path, chat_id, process_mode="full", progress_id=N
                 "El archivo no contiene texto extraíble. Instala PyMuPDF para OCR o proporciona un PDF con texto seleccionable."
             )
 
-        # Añadir hash del archivo a los metadatos de cada chunk para poder identificarlo después
-        file_hash = hashlib.md5(open(file_path, 'rb').read()).hexdigest()
+        # Descartar duplicados, fragmentos sin contenido útil y marcadores de error antes de vectorizar
+        chunks, filter_stats = filter_chunks(chunks, min_chars=CHUNK_FILTER_MIN_CHARS)
+        if filter_stats.embeddings_saved:
+            logger.info(
+                f"Filtro de fragmentos: {filter_stats.kept}/{filter_stats.total} conservados "
+                f"({filter_stats.duplicates} duplicados, {filter_stats.low_information} sin información, "
+                f"{filter_stats.error_placeholders} errores de OCR)",
+                "app.process_file_for_chat"
+            )
+        set_embedding_progress(progress_id, chunk_filter=filter_stats.as_dict(),
+                               embeddings_saved=filter_stats.embeddings_saved)
+        if not chunks:
+            raise ValueError("El archivo solo contiene fragmentos vacíos o errores de procesamiento de imágenes.")
+
+        # Añadir hash del archivo a los metadatos de cada chunk para poder identificarlo después;
+        # los ids fijos se comparten con el artefacto del archivo
         filename = os.path.basename(file_path)
         for chunk in chunks:
             chunk.metadata['file_hash'] = file_hash
             chunk.metadata['filename'] = filename
+            chunk.id = chunk.id or str(uuid.uuid4())
+
+        # Último punto para cancelar el trabajo antes de vectorizar y escribir en la base
+        check_cancelled()
+
+        # Buscar una versión anterior del documento entre los archivos del usuario
+        signature = minhasher.signature([chunk.page_content for chunk in chunks])
+        previous, similarity = _find_near_duplicate(user_id, file_hash, process_mode, signature)
 
-        # Añadir chunks a la base vectorial del chat
-        add_chunks_to_chat_vectorstore(chat_id, chunks, progress_id)
+        if previous is None:
+            return PreparedFile(file_path, file_hash, process_mode, chunks, filter_stats, chunks, signature=signature)
 
-        return file_hash, len(chunks), chunks
+        diff = diff_chunks(chunks, previous.chunks, previous.vectors)
+        logger.info(
+            f"{filename} es una revisión de {previous.file_hash} (similitud {similarity:.2f}): "
+            f"{len(diff.reused)} fragmentos reutilizados, {len(diff.changed_positions)} cambiados",
+            "app.process_file_for_chat"
+        )
+        set_embedding_progress(progress_id, near_duplicate_of=previous.file_hash, diff_ratio=round(diff.diff_ratio, 4),
+                               embeddings_reused=len(diff.reused))
+        return PreparedFile(
+            file_path, file_hash, process_mode, chunks, filter_stats,
+            [chunks[position] for position in diff.changed_positions],
+            diff=diff, signature=signature, near_duplicate_of=previous.file_hash,
+        )
     except Exception as e:
         # Capturar errores específicos y proporcionar un mensaje más descriptivo
         set_embedding_progress(progress_id, status="failed", completed=True, error=str(e))
         raise ValueError(f"Error al procesar el archivo: {str(e)}")
 
 
-def _add_chunks_to_vectorstore(store_path, new_chunks, *, progress_id=None, context_label="chat", log_source="app.add_chunks_to_vectorstore"):
-    """Añade documentos a una carpeta FAISS concreta, creando o fusionando según corresponda."""
-    index_path = os.path.join(store_path, "index.faiss")
-    metadata_path = os.path.join(store_path, "index.pkl")
-    has_valid_vectorstore = os.path.exists(index_path) and os.path.exists(metadata_path)
+def finish_prepared_file(prepared, pending_vectors):
+    """Combina los vectores de los fragmentos pendientes con los reutilizados."""
+    if prepared.vectors is not None:
+        return ProcessedFile(
+            prepared.file_hash, len(prepared.chunks), prepared.chunks, prepared.filter_stats, prepared.vectors,
+            reused=True, embeddings_reused=len(prepared.chunks), diff_ratio=0.0, near_duplicate_of=prepared.file_hash,
+        )
+    if prepared.diff is not None:
+        return ProcessedFile(
+            prepared.file_hash, len(prepared.chunks), prepared.chunks, prepared.filter_stats,
+            prepared.diff.assemble(pending_vectors),
+            embeddings_reused=len(prepared.diff.reused), diff_ratio=prepared.diff.diff_ratio,
+            near_duplicate_of=prepared.near_duplicate_of,
+        )
+    return ProcessedFile(prepared.file_hash, len(prepared.chunks), prepared.chunks, prepared.filter_stats, pending_vectors)
+
 
-    set_embedding_progress(progress_id, status="vectorizing", attempt=0, waiting_seconds=0, completed=False)
+def process_file_for_chat(file_path, chat_id, process_mode="full", progress_id=None, user_id=None, file_hash=None):
+    """Procesa un archivo para RAG y lo añade a la base vectorial del chat específico
+    
+    Args:
+        file_path: Ruta al archivo a procesar
+        chat_id: ID del chat al que pertenece el archivo
+        process_mode: "full" (texto + OCR por imagen), "text_only" (solo texto), "ocr_only" (OCR consolidado por página con imágenes).
+        progress_id: ID para seguimiento del progreso
+        user_id: Propietario del chat (necesario en el modo de índice por usuario)
+        file_hash: MD5 del archivo si ya se calculó al recibirlo (evita leerlo otra vez)
+    
+    Si el archivo ya se procesó con el mismo ``process_mode`` (en cualquier chat),
+    se reutilizan sus fragmentos y vectores sin cargarlo ni llamar a Azure. Si es
+    una revisión de otro archivo del usuario (similitud MinHash), solo se generan
+    embeddings para los fragmentos cuyo texto cambió.
+
+    Returns:
+        ProcessedFile: hash del archivo, número de fragmentos vectorizados, los
+        fragmentos, las estadísticas del filtro previo, los embeddings de los
+        fragmentos (para reutilizarlos en otras bases) y si se reutilizó un artefacto
+    """
+    prepared = prepare_file_for_chat(file_path, process_mode, progress_id=progress_id, user_id=user_id,
+                                     file_hash=file_hash)
+    try:
+        # Vectorizar una sola vez (solo lo pendiente) y añadir los chunks a la base vectorial del chat
+        pending_vectors = []
+        if prepared.pending:
+            set_embedding_progress(progress_id, status="vectorizing", attempt=0, waiting_seconds=0, completed=False)
+            pending_vectors = embed_chunks_with_retry(prepared.pending, embeddings, progress_id=progress_id)
+        processed = finish_prepared_file(prepared, pending_vectors)
+        add_chunks_to_chat_vectorstore(chat_id, processed.chunks, progress_id, user_id=user_id, vectors=processed.vectors)
+        if not processed.reused:
+            _save_file_artifact(prepared.file_hash, prepared.process_mode, processed.chunks, processed.vectors,
+                                processed.filter_stats, signature=prepared.signature)
+    except Exception as e:
+        set_embedding_progress(progress_id, status="failed", completed=True, error=str(e))
+        raise ValueError(f"Error al procesar el archivo: {str(e)}")
+    return processed
+
+
+def _add_chunks_to_vectorstore(store_path, new_chunks, *, vectors=None, progress_id=None, context_label="chat",
+                               log_source="app.add_chunks_to_vectorstore"):
+    """Añade documentos a una carpeta FAISS concreta.
+
+    Si la base no existe se crea; si ya existe, los nuevos fragmentos se publican
+    como un segmento delta (el coste depende del tamaño de la subida, no de la
+    base) y la base se encola para compactación al alcanzar el umbral. Con
+    ``vectors`` se usan esos embeddings en lugar de generarlos.
+    """
+    has_valid_vectorstore = has_components(store_path)
+
+    if vectors is None:
+        set_embedding_progress(progress_id, status="vectorizing", attempt=0, waiting_seconds=0, completed=False)
 
     try:
         if os.path.exists(store_path) and not has_valid_vectorstore:
@@ -1235,44 +2002,25 @@ def _add_chunks_to_vectorstore(store_path, new_chunks, *, progress_id=None, cont
             os.makedirs(store_path, exist_ok=True)
             has_valid_vectorstore = False
 
-        vectorstore = None
-        if has_valid_vectorstore:
-            logger.debug(
-                f"Cargando base vectorial existente para {context_label}",
-                log_source,
-            )
-            try:
-                vectorstore = FAISS.load_local(
-                    store_path,
-                    embeddings,
-                    allow_dangerous_deserialization=True,
-                )
-            except Exception as load_error:
-                logger.warning(
-                    f"No se pudo cargar la base vectorial existente para {context_label}: {load_error}. Se recreará.",
-                    log_source,
-                )
-                shutil.rmtree(store_path, ignore_errors=True)
-                os.makedirs(store_path, exist_ok=True)
-                vectorstore = None
+        if vectors is None:
+            new_vectorstore = build_vectorstore_with_retry(new_chunks, embeddings, progress_id=progress_id)
+        else:
+            new_vectorstore = vectorstore_from_vectors(new_chunks, vectors)
 
-        if vectorstore is not None:
+        if has_valid_vectorstore:
             logger.debug(
-                f"Añadiendo {len(new_chunks)} nuevos chunks a la base vectorial de {context_label}",
+                f"Añadiendo {len(new_chunks)} nuevos chunks a la base vectorial de {context_label} como segmento delta",
                 log_source,
             )
-            new_vectorstore = build_vectorstore_with_retry(new_chunks, embeddings, progress_id=progress_id)
-            vectorstore.merge_from(new_vectorstore)
+            write_segment(new_vectorstore, store_path)
+            store_compactor.maybe_schedule(store_path)
         else:
             logger.debug(
                 f"Creando nueva base vectorial para {context_label}",
                 log_source,
             )
-            if not os.path.exists(store_path):
-                os.makedirs(store_path, exist_ok=True)
-            vectorstore = build_vectorstore_with_retry(new_chunks, embeddings, progress_id=progress_id)
+            save_store(new_vectorstore, store_path)
 
-        vectorstore.save_local(store_path)
         logger.info(
             f"Base vectorial de {context_label} actualizada con {len(new_chunks)} chunks",
             log_source,
@@ -1281,14 +2029,45 @@ def _add_chunks_to_vectorstore(store_path, new_chunks, *, progress_id=None, cont
     except Exception as e:
         logger.error(f"Error al actualizar base vectorial de {context_label}: {str(e)}", log_source)
         raise
+    finally:
+        vectorstore_cache.invalidate(store_path)
+
+
+def _add_chunks_to_user_index(user_id, new_chunks, scopes, *, vectors=None, progress_id=None,
+                              log_source="app.add_chunks_to_user_index"):
+    """Añade ``new_chunks`` al índice del usuario etiquetados con ``scopes`` (vectorizándolos si hace falta)."""
+    try:
+        if vectors is None:
+            set_embedding_progress(progress_id, status="vectorizing", attempt=0, waiting_seconds=0, completed=False)
+            vectors = embed_chunks_with_retry(new_chunks, embeddings, progress_id=progress_id)
+        get_user_vector_index(user_id).add(new_chunks, vectors, scopes)
+    except Exception as e:
+        logger.error(f"Error al actualizar el índice vectorial del usuario {user_id}: {str(e)}", log_source)
+        raise
+    logger.info(
+        f"Índice vectorial del usuario {user_id} actualizado con {len(new_chunks)} chunks ({', '.join(f'{s}:{i}' for s, i in scopes)})",
+        log_source,
+    )
 
 
-def add_chunks_to_chat_vectorstore(chat_id, new_chunks, progress_id=None):
+def add_chunks_to_chat_vectorstore(chat_id, new_chunks, progress_id=None, user_id=None, vectors=None):
     """Añade chunks a la base vectorial específica del chat."""
+    if user_index_enabled() and user_id is not None:
+        _add_chunks_to_user_index(
+            user_id,
+            new_chunks,
+            [(CHAT_SCOPE, chat_id)],
+            vectors=vectors,
+            progress_id=progress_id,
+            log_source="app.add_chunks_to_chat_vectorstore",
+        )
+        return
+
     chat_db_path = os.path.join(VECTORDB_DIR, str(chat_id))
     _add_chunks_to_vectorstore(
         chat_db_path,
         new_chunks,
+        vectors=vectors,
         progress_id=progress_id,
         context_label=f"chat {chat_id}",
         log_source="app.add_chunks_to_chat_vectorstore",
@@ -1303,14 +2082,61 @@ def _resolve_vectorstore_path(path_fragment: str | None) -> str | None:
     return os.path.join(VECTORDB_DIR, path_fragment)
 
 
-def extend_attached_knowledge_bases(user_id, attached_ids, new_chunks):
-    """Añade nuevos documentos a todas las bases RAG asociadas al chat actual."""
+def _extend_knowledge_base(kb_id, kb_name, store_path, user_id, chat_id, new_chunks, vectors, new_file_hashes):
+    """Añade los fragmentos ya vectorizados a una base RAG (se ejecuta en KNOWLEDGE_BASE_WRITE_EXECUTOR)."""
+    started = time.perf_counter()
+    try:
+        if store_path is None:
+            user_index = get_user_vector_index(user_id)
+            if chat_id and new_file_hashes and user_index.has_scope(CHAT_SCOPE, chat_id):
+                # Los vectores ya están en el índice del usuario como parte del chat
+                user_index.copy_scope((CHAT_SCOPE, chat_id), (KB_SCOPE, kb_id), file_hashes=new_file_hashes)
+            else:
+                _add_chunks_to_user_index(
+                    user_id,
+                    new_chunks,
+                    [(KB_SCOPE, kb_id)],
+                    vectors=vectors,
+                    log_source="app.extend_attached_knowledge_bases",
+                )
+        else:
+            _add_chunks_to_vectorstore(
+                store_path,
+                new_chunks,
+                vectors=vectors,
+                progress_id=None,
+                context_label=f"base RAG '{kb_name}'",
+                log_source="app.extend_attached_knowledge_bases",
+            )
+    except Exception as exc:
+        logger.error(
+            f"Error al ampliar la base RAG '{kb_name}' ({kb_id}): {exc}",
+            "app.extend_attached_knowledge_bases",
+        )
+        raise
+    logger.debug(
+        f"Base RAG '{kb_name}' ampliada con {len(new_chunks)} chunks en {time.perf_counter() - started:.2f}s",
+        "app.extend_attached_knowledge_bases",
+    )
+
+
+def extend_attached_knowledge_bases(user_id, attached_ids, new_chunks, chat_id=None, vectors=None):
+    """Añade nuevos documentos a todas las bases RAG asociadas al chat actual.
+
+    Los fragmentos se vectorizan una sola vez (o se reutilizan ``vectors``, los
+    embeddings ya calculados para el chat) y la escritura en cada base se lanza
+    en segundo plano y en paralelo en ``KNOWLEDGE_BASE_WRITE_EXECUTOR``. Las bases
+    del índice por usuario reciben solo etiquetas cuando los fragmentos ya están
+    en el índice como parte del chat ``chat_id``.
+
+    Devuelve los ``Future`` de cada base (vacío si no hay nada que ampliar).
+    """
     if not attached_ids or not new_chunks:
-        return
+        return []
 
     ids = list(dict.fromkeys(attached_ids))
     if not ids:
-        return
+        return []
 
     bases = (
         KnowledgeBase.query.filter(
@@ -1319,10 +2145,12 @@ def extend_attached_knowledge_bases(user_id, attached_ids, new_chunks):
         ).all()
     )
 
-    if not bases:
-        return
-
+    # Resolver las rutas dentro de la petición: los hilos de escritura no usan la sesión de base de datos
+    targets = []
     for kb in bases:
+        if _is_user_index_kb(kb):
+            targets.append((kb.id, kb.name, None))
+            continue
         store_path = _resolve_vectorstore_path(kb.vectorstore_path)
         if not store_path:
             logger.warning(
@@ -1330,36 +2158,57 @@ def extend_attached_knowledge_bases(user_id, attached_ids, new_chunks):
                 "app.extend_attached_knowledge_bases",
             )
             continue
+        targets.append((kb.id, kb.name, store_path))
 
-        try:
-            _add_chunks_to_vectorstore(
-                store_path,
-                new_chunks,
-                progress_id=None,
-                context_label=f"base RAG '{kb.name}'",
-                log_source="app.extend_attached_knowledge_bases",
-            )
-        except Exception as exc:
-            logger.error(
-                f"Error al ampliar la base RAG '{kb.name}' ({kb.id}): {exc}",
-                "app.extend_attached_knowledge_bases",
-            )
+    if not targets:
+        return []
+
+    new_file_hashes = list(dict.fromkeys(
+        chunk.metadata.get('file_hash') for chunk in new_chunks if chunk.metadata.get('file_hash')
+    ))
+    needs_vectors = any(store_path is not None for _kb_id, _name, store_path in targets) or not chat_id
+    if vectors is None and needs_vectors:
+        vectors = embed_chunks_with_retry(new_chunks, embeddings)
+
+    logger.info(
+        f"Ampliando {len(targets)} bases RAG con {len(new_chunks)} chunks en segundo plano",
+        "app.extend_attached_knowledge_bases",
+    )
+    return [
+        KNOWLEDGE_BASE_WRITE_EXECUTOR.submit(
+            _extend_knowledge_base, kb_id, kb_name, store_path, user_id, chat_id, new_chunks, vectors, new_file_hashes
+        )
+        for kb_id, kb_name, store_path in targets
+    ]
 
 
-def rebuild_chat_vectorstore(chat_id, file_hashes_to_keep, progress_id=None):
-    """Reconstruye la base vectorial del chat con solo los archivos especificados
+def rebuild_chat_vectorstore(chat_id, file_hashes_to_keep, progress_id=None, user_id=None):
+    """Deja en la base vectorial del chat solo los archivos especificados.
+
+    Los vectores de los archivos descartados se eliminan del índice en sitio, sin
+    volver a generar embeddings para el resto.
     
     Args:
         chat_id: ID del chat
         file_hashes_to_keep: Lista de hashes de archivos que se deben mantener
         progress_id: ID para seguimiento del progreso
+        user_id: Propietario del chat (modo de índice por usuario)
     """
     chat_db_path = os.path.join(VECTORDB_DIR, str(chat_id))
+
+    if user_index_enabled() and user_id is not None:
+        # En el índice por usuario basta con retirar las etiquetas del chat
+        removed = get_user_vector_index(user_id).retain_files(CHAT_SCOPE, chat_id, file_hashes_to_keep or [])
+        logger.info(f"Índice del usuario {user_id}: {removed} chunks retirados del chat {chat_id}", "app.rebuild_chat_vectorstore")
+        if not os.path.exists(chat_db_path):
+            return
     
     if not file_hashes_to_keep:
         # Si no hay archivos que mantener, eliminar toda la base vectorial
         if os.path.exists(chat_db_path):
-            shutil.rmtree(chat_db_path)
+            with store_compactor.locked(chat_db_path):
+                shutil.rmtree(chat_db_path)
+            vectorstore_cache.invalidate(chat_db_path)
             logger.info(f"Base vectorial del chat {chat_id} eliminada (no hay archivos)", "app.rebuild_chat_vectorstore")
         return
     
@@ -1368,90 +2217,169 @@ def rebuild_chat_vectorstore(chat_id, file_hashes_to_keep, progress_id=None):
         return
     
     try:
-        # Cargar base vectorial existente
-        vectorstore = FAISS.load_local(chat_db_path, embeddings, allow_dangerous_deserialization=True)
-        
-        # Obtener todos los documentos
-        all_docs = vectorstore.docstore._dict.values()  # type: ignore[attr-defined]
-        
-        # Filtrar documentos que pertenecen a archivos que se deben mantener
-        filtered_docs = [
-            doc for doc in all_docs 
-            if doc.metadata.get('file_hash') in file_hashes_to_keep
-        ]
-        
-        if not filtered_docs:
-            # No hay documentos que mantener, eliminar la base vectorial
-            shutil.rmtree(chat_db_path)
-            logger.info(f"Base vectorial del chat {chat_id} eliminada (documentos filtrados)", "app.rebuild_chat_vectorstore")
-            return
-        
-        # Recrear la base vectorial solo con los documentos filtrados
-        set_embedding_progress(progress_id, status="rebuilding", attempt=0, waiting_seconds=0, completed=False)
-        
-        # Eliminar la base existente
-        shutil.rmtree(chat_db_path)
-        os.makedirs(chat_db_path, exist_ok=True)
-        
-        # Crear nueva base vectorial con los documentos filtrados
-        new_vectorstore = build_vectorstore_with_retry(filtered_docs, embeddings, progress_id=progress_id)
-        new_vectorstore.save_local(chat_db_path)
-        
-        logger.info(f"Base vectorial del chat {chat_id} reconstruida con {len(filtered_docs)} chunks de {len(file_hashes_to_keep)} archivos", "app.rebuild_chat_vectorstore")
+        with store_compactor.locked(chat_db_path):
+            # Fusionar primero los segmentos delta para que el borrado también les afecte
+            store_compactor.compact(chat_db_path)
+            # Cargar base vectorial existente
+            vectorstore = load_vectorstore(chat_db_path)
+
+            # Identificar los documentos de archivos que ya no pertenecen al chat
+            keep = set(file_hashes_to_keep)
+            ids_to_delete = []
+            for doc_id in vectorstore.index_to_docstore_id.values():
+                doc = vectorstore.docstore.search(doc_id)
+                metadata = getattr(doc, 'metadata', None) or {}
+                if metadata.get('file_hash') not in keep:
+                    ids_to_delete.append(doc_id)
+
+            if len(ids_to_delete) == len(vectorstore.index_to_docstore_id):
+                # No hay documentos que mantener, eliminar la base vectorial
+                shutil.rmtree(chat_db_path)
+                logger.info(f"Base vectorial del chat {chat_id} eliminada (documentos filtrados)", "app.rebuild_chat_vectorstore")
+                return
+
+            if not ids_to_delete:
+                logger.debug(f"Base vectorial del chat {chat_id} sin documentos que eliminar", "app.rebuild_chat_vectorstore")
+                return
+
+            set_embedding_progress(progress_id, status="rebuilding", attempt=0, waiting_seconds=0, completed=False)
+
+            # Eliminar vectores y entradas del docstore en sitio: los vectores restantes
+            # ya están en el índice, por lo que no se vuelve a llamar a Azure
+            vectorstore.delete(ids_to_delete)
+            save_store(vectorstore, chat_db_path)
+            set_embedding_progress(progress_id, status="completed", attempt=0, waiting_seconds=0, completed=True)
+
+            logger.info(
+                f"Base vectorial del chat {chat_id} depurada: {len(ids_to_delete)} chunks eliminados, "
+                f"{len(vectorstore.index_to_docstore_id)} chunks de {len(keep)} archivos conservados",
+                "app.rebuild_chat_vectorstore"
+            )
         
     except Exception as e:
         logger.error(f"Error al reconstruir base vectorial del chat {chat_id}: {str(e)}", "app.rebuild_chat_vectorstore")
         raise
+    finally:
+        vectorstore_cache.invalidate(chat_db_path)
+
+def _search_vectorstore_by_vector(store_path, query_vector, k):
+    """Busca en una base vectorial (base principal y segmentos delta) con un embedding ya calculado.
+
+    Devuelve hasta ``k`` pares (documento, distancia) sin repetir ids: durante una
+    compactación un fragmento puede estar a la vez en la base y en su segmento.
+    """
+    for attempt in range(2):
+        try:
+            scored = []
+            for component in store_components(store_path):
+                vectorstore = load_vectorstore_cached(component)
+                scored.extend(vectorstore.similarity_search_with_score_by_vector(query_vector, k=k))
+            break
+        except (FileNotFoundError, RuntimeError, sqlite3.OperationalError):
+            # Un segmento desapareció por una compactación concurrente (faiss.read_index
+            # lanza RuntimeError y SQLite OperationalError si falta su fichero), o se
+            # abrió a medio publicar: se repite con la lista nueva
+            if attempt:
+                raise
+
+    results = []
+    seen_ids = set()
+    for doc, score in sorted(scored, key=lambda item: item[1]):
+        doc_id = getattr(doc, 'id', None)
+        if doc_id and doc_id in seen_ids:
+            continue
+        seen_ids.add(doc_id)
+        results.append((doc, score))
+        if len(results) >= k:
+            break
+    return results
+
 
 def query_documents_for_chat(query, chat_id, k=3, user_id=None, extra_base_ids=None):
-    """Consulta documentos relevantes de las bases vectoriales del chat y bases guardadas anexadas."""
+    """Consulta documentos relevantes de las bases vectoriales del chat y bases guardadas anexadas.
+
+    La consulta se vectoriza una sola vez y ese vector se usa para buscar en todas
+    las bases en paralelo; los resultados se combinan por distancia real. En el
+    modo por usuario el chat y sus bases anexadas se buscan con una sola consulta
+    al índice del usuario, filtrada por sus etiquetas.
+    """
     if not (chat_id or extra_base_ids):
         return []
 
     vector_paths = []
+    user_scopes = []
+    if chat_id and user_id is not None and user_index_enabled():
+        user_scopes.append((CHAT_SCOPE, chat_id))
     if chat_id:
         chat_db_path = os.path.join(VECTORDB_DIR, str(chat_id))
         if os.path.exists(chat_db_path):
             vector_paths.append(chat_db_path)
-        else:
+        elif not user_scopes:
             logger.debug(f"No existe base vectorial para el chat {chat_id}", "app.query_documents_for_chat")
 
     if extra_base_ids and user_id:
-        for kb_id in extra_base_ids:
-            kb = KnowledgeBase.query.filter_by(id=kb_id, user_id=user_id).first()
-            if not kb:
+        bases = KnowledgeBase.query.filter(
+            KnowledgeBase.user_id == user_id,
+            KnowledgeBase.id.in_(list(dict.fromkeys(extra_base_ids)))
+        ).all()
+        for kb in bases:
+            if _is_user_index_kb(kb):
+                user_scopes.append((KB_SCOPE, kb.id))
                 continue
-            kb_path = os.path.join(VECTORDB_DIR, kb.vectorstore_path)
-            if os.path.exists(kb_path):
+            kb_path = _resolve_vectorstore_path(kb.vectorstore_path)
+            if kb_path and os.path.exists(kb_path):
                 vector_paths.append(kb_path)
 
-    if not vector_paths:
+    if not (vector_paths or user_scopes):
         return []
 
-    results = []
-    for path in vector_paths:
+    try:
+        query_vector = embeddings.embed_query(query)
+    except Exception as exc:
+        logger.warning(f"No se pudo generar el embedding de la consulta: {exc}", "app.query_documents_for_chat_warn")
+        return []
+
+    futures = [
+        (path, RAG_SEARCH_EXECUTOR.submit(_search_vectorstore_by_vector, path, query_vector, k))
+        for path in vector_paths
+    ]
+    if user_scopes:
+        user_index = get_user_vector_index(user_id)
+        futures.append((user_index.path, RAG_SEARCH_EXECUTOR.submit(user_index.search, query_vector, k, user_scopes)))
+
+    scored_results = []
+    for path, future in futures:
         try:
-            vectorstore = FAISS.load_local(
-                path,
-                embeddings,
-                allow_dangerous_deserialization=True,
-            )
-            results.extend(vectorstore.similarity_search(query, k=k))
+            scored_results.extend(future.result())
         except Exception as exc:
             logger.warning(
                 f"No se pudo consultar la base vectorial en {path}: {exc}",
                 "app.query_documents_for_chat_warn"
             )
 
-    if not results:
+    if not scored_results:
         return []
 
-    sorted_results = sorted(results, key=lambda doc: doc.metadata.get('score', 0), reverse=True)
+    # Distancia L2 de FAISS: menor distancia = mayor relevancia
+    scored_results.sort(key=lambda item: item[1])
+
+    # Una base guardada desde el chat contiene los mismos fragmentos; evitar duplicados
+    results = []
+    seen = set()
+    for doc, _distance in scored_results:
+        key = (doc.metadata.get('file_hash'), doc.page_content)
+        if key in seen:
+            continue
+        seen.add(key)
+        results.append(doc)
+        if len(results) >= k:
+            break
+
     logger.debug(
-        f"Encontrados {len(sorted_results)} documentos combinados para el chat {chat_id}",
+        f"Encontrados {len(scored_results)} documentos combinados de {len(futures)} bases para el chat {chat_id}",
         "app.query_documents_for_chat"
     )
-    return sorted_results[:k]
+    return results
 
 
 # Mantener función legacy para compatibilidad con código existente
@@ -1464,8 +2392,7 @@ def query_documents(query, file_hashes, k=3):
     for file_hash in file_hashes:
         db_path = os.path.join(VECTORDB_DIR, file_hash)
         if os.path.exists(db_path):
-            # Add allow_dangerous_deserialization parameter when loading the vector store
-            vectorstore = FAISS.load_local(db_path, embeddings, allow_dangerous_deserialization=True)
+            vectorstore = load_vectorstore_cached(db_path)
             docs = vectorstore.similarity_search(query, k=k)
             results.extend(docs)
 
@@ -1583,7 +2510,7 @@ def index():
         session['chat_id'] = chat_id
         
         # Cargar los file_hashes específicos del chat
-        chat_data = get_chat_data(user_id, chat_id)
+        chat_data = get_chat_data(user_id, chat_id, with_messages=False)
         session['file_hashes'] = chat_data.get('file_hashes', [])
         session['attached_bases'] = chat_data.get('attached_bases', [])
         logger.debug(f"Cargando file_hashes para chat inicial: {len(session['file_hashes'])} archivos", "app.index")
@@ -1621,6 +2548,46 @@ def index():
         history_max=MAX_HISTORY_LIMIT,
     )
 
+
+def summarize_history(previous_summary, messages):
+    """Pide al modelo por defecto el resumen acumulado con ``messages`` añadidos."""
+    try:
+        response = get_openai_client().chat.completions.create(
+            model=AZURE_OPENAI_DEPLOYMENT,
+            messages=summary_prompt(previous_summary, messages),
+            temperature=0.2,
+            max_tokens=HISTORY_SUMMARY_MAX_TOKENS
+        )
+        return response.choices[0].message.content.strip()
+    except Exception as exc:
+        logger.warning(f"No se pudo actualizar el resumen del historial: {exc}", "app.summarize_history")
+        raise
+
+
+def select_chat_history(user_id, chat_id, chat_data, messages, deployment, max_messages=None):
+    """Historial que se envía al modelo: los mensajes recientes que caben en HISTORY_MAX_TOKENS
+    (tokens de ``deployment``) y el resumen guardado del resto, que se amplía cuando hace falta."""
+    window = build_history_window(
+        messages,
+        max_tokens=HISTORY_MAX_TOKENS,
+        encoding=load_encoding(deployment, HISTORY_TOKEN_ENCODING),
+        max_messages=max_messages,
+        summary=chat_data.get('history_summary'),
+        summary_upto=chat_data.get('history_summary_upto') or 0,
+        summarize=summarize_history if HISTORY_SUMMARY_MAX_TOKENS and chat_id else None
+    )
+    if window.summary_changed:
+        get_chat_repository().update_header(
+            user_id, chat_id, history_summary=window.summary, history_summary_upto=window.summary_upto
+        )
+    logger.debug(
+        f"Historial para {deployment}: {len(window.messages)} de {len(messages)} mensajes, "
+        f"{window.tokens} tokens, resumen hasta {window.summary_upto}",
+        "app.select_chat_history"
+    )
+    return window
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Endpoint para procesar mensajes de chat"""
@@ -1634,11 +2601,11 @@ def chat():
 
     user_id = get_user_id()
 
-    # Cargar historial de chat existente o crear uno nuevo
-    messages = load_chat_history(user_id, chat_id)
-
-    # Obtener datos completos del chat para acceder al mensaje del sistema guardado
+    # Cargar el chat (historial y parámetros guardados) con una sola lectura
     chat_data = get_chat_data(user_id, chat_id)
+    messages = chat_data['messages']
+    if chat_data.get('chat_id'):
+        session['chat_id'] = chat_id
     saved_system_message = chat_data.get('system_message')
     stored_top_k = chat_data.get('rag_top_k', DEFAULT_RAG_TOP_K)
     stored_temperature = chat_data.get('temperature', DEFAULT_TEMPERATURE)
@@ -1755,6 +2722,12 @@ Si la información no es suficiente para responder, utiliza tu conocimiento gene
 
     # Determinar el deployment a usar
     deployment = model_id if model_id else AZURE_OPENAI_DEPLOYMENT
+
+    # Historial limitado por tokens y por la configuración activa; lo anterior va resumido
+    history = select_chat_history(user_id, chat_id, chat_data, messages, deployment,
+                                  max_messages=message_history_limit)
+    if history.summary:
+        system_message += f"\n\nResumen de la conversación anterior:\n{history.summary}"
     
     # Verificar si el modelo es o1-mini, que no soporta mensajes con rol 'system'
     is_o1mini = deployment == O1MINI_MODEL
@@ -1767,8 +2740,7 @@ Si la información no es suficiente para responder, utiliza tu conocimiento gene
     if not is_o1mini:
         api_messages.append({"role": "system", "content": system_message})
     
-    # Añadir historial de conversación limitado por la configuración activa
-    messages_to_add = messages[-message_history_limit:]
+    messages_to_add = history.messages
     
     # Para o1-mini, si hay mensajes de usuario, añadir el contenido del sistema al primer mensaje
     if is_o1mini and messages_to_add and messages_to_add[0]["role"] == "user":
@@ -1991,15 +2963,14 @@ def get_chat(chat_id):
     current_chat_id = session.get('chat_id')
     if current_chat_id and current_chat_id != chat_id:
         # Solo guardar el estado si estamos cambiando a un chat diferente
-        current_messages = load_chat_history(user_id, current_chat_id)
-        current_chat_data = get_chat_data(user_id, current_chat_id)
-        # Guardar el chat actual con los file_hashes actuales
+        current_chat_data = get_chat_data(user_id, current_chat_id, with_messages=False)
+        # Guardar el chat actual con los file_hashes actuales (solo la cabecera)
         save_chat_history(
             user_id, 
-            current_messages, 
+            None, 
             current_chat_data.get('system_message'), 
             current_chat_data.get('title'),
-            session.get('file_hashes', []),
+            None,
             rag_top_k=current_chat_data.get('rag_top_k'),
             temperature=current_chat_data.get('temperature'),
             message_history_limit=current_chat_data.get('message_history_limit'),
@@ -2031,6 +3002,43 @@ def get_chat(chat_id):
         'attached_bases': chat_data.get('attached_bases', [])
     })
 
+def _submit_upload_job(job_id, user_id, chat_id, filename, process_mode, progress_id, priority, *,
+                       staged_path=None, stored_path=None, file_hash=None, sha256=None):
+    """Encola el procesamiento de un archivo ya recibido (``staged_path``) o ya guardado (``stored_path``)."""
+    set_embedding_progress(progress_id, status="queued", filename=filename, completed=False, attempt=0,
+                           waiting_seconds=0, job_id=job_id)
+    return ingest_queue.submit(
+        'upload',
+        user_id,
+        {
+            'staged_path': staged_path,
+            'stored_path': stored_path,
+            'filename': filename,
+            'file_hash': file_hash,
+            'sha256': sha256,
+            'chat_id': chat_id,
+            'process_mode': process_mode,
+            'progress_id': progress_id,
+            'chat_user_id': user_id,
+            'owner_id': current_user.id if current_user.is_authenticated else None,
+        },
+        priority=priority,
+        job_id=job_id,
+    )
+
+
+def _resolve_upload_process_mode(form):
+    process_mode = form.get('process_mode')
+    if not process_mode:
+        # compatibilidad con booleano anterior
+        process_images_legacy = form.get('process_images', 'true').lower() == 'true'
+        process_mode = 'full' if process_images_legacy else 'text_only'
+
+    if process_mode not in {'full', 'text_only', 'ocr_only'}:
+        process_mode = 'full'
+    return process_mode
+
+
 @app.route('/api/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -2040,14 +3048,7 @@ def upload_file():
         return jsonify({"error": "No se proporcionó archivo"}), 400
     
     file = request.files['file']
-    process_mode = request.form.get('process_mode')
-    if not process_mode:
-        # compatibilidad con booleano anterior
-        process_images_legacy = request.form.get('process_images', 'true').lower() == 'true'
-        process_mode = 'full' if process_images_legacy else 'text_only'
-
-    if process_mode not in {'full', 'text_only', 'ocr_only'}:
-        process_mode = 'full'
+    process_mode = _resolve_upload_process_mode(request.form)
     progress_id = request.form.get('upload_id') or str(uuid.uuid4())
     
     if file.filename == '':
@@ -2061,91 +3062,545 @@ def upload_file():
         return jsonify({"error": "No hay chat activo. Crea un nuevo chat primero."}), 400
     
     if file:
+        filename = secure_filename(file.filename)
+        user_id = get_user_id()
+        priority = _resolve_int_setting(request.form.get('priority'), 0, minimum=-10, maximum=10)
+        job_id = str(uuid.uuid4())
         try:
-            filename = secure_filename(file.filename)
-            logger.info(f"Procesando archivo subido para chat {chat_id}: {filename}", "app.upload_file")
-            set_embedding_progress(progress_id, status="queued", filename=filename, completed=False, attempt=0, waiting_seconds=0)
-            
-            # Guardar archivo
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(file_path)
-            
-            # Procesar archivo para RAG y añadirlo al chat actual
-            file_hash, num_chunks, chunks = process_file_for_chat(file_path, chat_id, process_mode, progress_id=progress_id)
-            
-            # Guardar referencia al archivo en la sesión
-            if 'file_hashes' not in session:
-                session['file_hashes'] = []
-            
-            if file_hash not in session['file_hashes']:
-                session['file_hashes'].append(file_hash)
-            
-            # Actualizar el chat actual con el nuevo file_hash
-            user_id = get_user_id()
-            chat_data = get_chat_data(user_id, chat_id)
-            save_chat_history(
-                user_id, 
-                chat_data.get('messages', []), 
-                chat_data.get('system_message'), 
-                chat_data.get('title'),
-                session['file_hashes'],
-                rag_top_k=chat_data.get('rag_top_k'),
-                temperature=chat_data.get('temperature'),
-                message_history_limit=chat_data.get('message_history_limit'),
-                attached_bases=session.get('attached_bases', [])
-            )
-            logger.debug(f"Chat {chat_id} actualizado con nuevo archivo: {filename}", "app.upload_file")
-
-            attached_bases = session.get('attached_bases', [])
-            try:
-                extend_attached_knowledge_bases(user_id, attached_bases, chunks)
-            except Exception:
-                # El helper ya registra el detalle del error; no interrumpimos la carga del archivo.
-                pass
-            
-            # Guardar en base de datos si el usuario está autenticado
-            if current_user.is_authenticated:
-                # Verificar si ya existe
-                existing_file = File.query.filter_by(file_hash=file_hash).first()
-                if not existing_file:
-                    new_file = File(
-                        id=str(uuid.uuid4()),
-                        user_id=current_user.id,
-                        filename=filename,
-                        file_hash=file_hash
-                    )
-                    db.session.add(new_file)
-                    db.session.commit()
-                    logger.info(f"Archivo guardado en base de datos: {filename}", "app.upload_file")
-            
-            logger.info(f"Archivo procesado exitosamente para chat {chat_id}: {filename} ({num_chunks} fragmentos)", "app.upload_file")
-            set_embedding_progress(progress_id, status="completed", completed=True, attempt=None, waiting_seconds=0, file_hash=file_hash, chunks=num_chunks)
-            return jsonify({
-                "success": True,
-                "filename": filename,
-                "file_hash": file_hash,
-                "chunks": num_chunks,
-                "progress_id": progress_id,
-                "chat_id": chat_id
-            })
-            
-        except ValueError as e:
-            logger.error(f"Error al procesar archivo (valor): {str(e)}", "app.upload_file")
-            set_embedding_progress(progress_id, status="failed", completed=True, error=str(e))
-            return jsonify({"error": str(e), "progress_id": progress_id}), 400
+            # El archivo espera en una carpeta propia del trabajo hasta que un hilo
+            # de trabajo lo procese (dos subidas con el mismo nombre no se pisan)
+            staged_path = os.path.join(INGEST_PENDING_DIR, job_id, filename)
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            # Escritura por bloques con el hash calculado al vuelo (el trabajo no relee el archivo)
+            streamed = write_stream(file.stream, staged_path)
+
+            _submit_upload_job(job_id, user_id, chat_id, filename, process_mode, progress_id, priority,
+                               staged_path=staged_path, file_hash=streamed.md5, sha256=streamed.sha256)
         except Exception as e:
-            logger.error(f"Error al procesar archivo: {str(e)}", "app.upload_file")
+            logger.error(f"Error al encolar archivo: {str(e)}", "app.upload_file")
             set_embedding_progress(progress_id, status="failed", completed=True, error=str(e))
             return jsonify({"error": str(e), "progress_id": progress_id}), 500
+
+        logger.info(f"Archivo {filename} encolado para chat {chat_id} (trabajo {job_id})", "app.upload_file")
+        return jsonify({
+            "success": True,
+            "queued": True,
+            "job_id": job_id,
+            "status": "queued",
+            "filename": filename,
+            "progress_id": progress_id,
+            "chat_id": chat_id
+        }), 202
     
     return jsonify({"error": "Error desconocido"}), 500
 
 
+@app.route('/api/upload/batch', methods=['POST'])
+@login_required
+def upload_files_batch():
+    """Endpoint para subir varios archivos en un solo trabajo.
+
+    Los archivos se cargan y trocean en paralelo, se vectorizan en una sola
+    pasada y se añaden a la base del chat con una sola escritura. Cada archivo
+    conserva su ``progress_id`` (campo ``upload_ids`` en el mismo orden que
+    ``files``) y su resultado en ``result.files`` del trabajo.
+    """
+    files = [file for file in request.files.getlist('files') if file and file.filename]
+    if not files:
+        logger.warning("No se proporcionaron archivos en la solicitud", "app.upload_files_batch")
+        return jsonify({"error": "No se proporcionaron archivos"}), 400
+    if len(files) > UPLOAD_BATCH_MAX_FILES:
+        return jsonify({"error": f"Se admiten como máximo {UPLOAD_BATCH_MAX_FILES} archivos por lote"}), 400
+
+    chat_id = session.get('chat_id')
+    if not chat_id:
+        logger.warning("No hay chat activo para subir archivos", "app.upload_files_batch")
+        return jsonify({"error": "No hay chat activo. Crea un nuevo chat primero."}), 400
+
+    process_mode = _resolve_upload_process_mode(request.form)
+    upload_ids = request.form.getlist('upload_ids')
+    user_id = get_user_id()
+    priority = _resolve_int_setting(request.form.get('priority'), 0, minimum=-10, maximum=10)
+    filenames = [secure_filename(file.filename) for file in files]
+    if len(set(filenames)) != len(filenames):
+        # Todos se publican en la misma carpeta de uploads: uno pisaría al otro
+        return jsonify({"error": "El lote contiene archivos con el mismo nombre"}), 400
+
+    job_id = str(uuid.uuid4())
+    entries = []
+    try:
+        for position, (file, filename) in enumerate(zip(files, filenames)):
+            progress_id = (upload_ids[position] if position < len(upload_ids) else None) or str(uuid.uuid4())
+            staged_dir = os.path.join(INGEST_PENDING_DIR, job_id, str(position))
+            os.makedirs(staged_dir, exist_ok=True)
+            staged_path = os.path.join(staged_dir, filename)
+            streamed = write_stream(file.stream, staged_path)
+            entries.append({'staged_path': staged_path, 'filename': filename, 'progress_id': progress_id,
+                            'file_hash': streamed.md5, 'sha256': streamed.sha256})
+            set_embedding_progress(progress_id, status="queued", filename=filename, completed=False, attempt=0,
+                                   waiting_seconds=0, job_id=job_id)
+
+        ingest_queue.submit(
+            'upload_batch',
+            user_id,
+            {
+                'files': entries,
+                'chat_id': chat_id,
+                'process_mode': process_mode,
+                'chat_user_id': user_id,
+                'owner_id': current_user.id if current_user.is_authenticated else None,
+            },
+            priority=priority,
+            job_id=job_id,
+        )
+    except Exception as e:
+        logger.error(f"Error al encolar el lote de archivos: {str(e)}", "app.upload_files_batch")
+        shutil.rmtree(os.path.join(INGEST_PENDING_DIR, job_id), ignore_errors=True)
+        set_embedding_progress([entry['progress_id'] for entry in entries], status="failed", completed=True,
+                               error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+    logger.info(f"Lote de {len(entries)} archivos encolado para chat {chat_id} (trabajo {job_id})",
+                "app.upload_files_batch")
+    return jsonify({
+        "success": True,
+        "queued": True,
+        "job_id": job_id,
+        "status": "queued",
+        "chat_id": chat_id,
+        "files": [{"filename": entry['filename'], "progress_id": entry['progress_id']} for entry in entries],
+    }), 202
+
+
+def _find_known_user_file(owner_id, sha256):
+    """Archivo ya guardado del usuario con ese SHA-256 y su ruta, o ``(None, None)``.
+
+    Solo se consideran archivos del propio usuario: anunciar un hash no da
+    acceso a archivos de otros.
+    """
+    if owner_id is None or not sha256:
+        return None, None
+    for row in File.query.filter_by(user_id=owner_id, sha256=sha256.lower()):
+        file_path = catalog_file_path(row)
+        if file_path is not None:
+            return row, file_path
+    return None, None
+
+
+@app.route('/api/upload/sessions', methods=['POST'])
+@login_required
+def create_upload_session():
+    """Endpoint para empezar una subida por partes reanudable.
+
+    Recibe ``filename``, ``size`` y opcionalmente ``sha256`` (calculado en el
+    navegador), ``process_mode``, ``upload_id`` y ``priority``. Si el usuario ya
+    subió un archivo con ese SHA-256 no hace falta enviar los datos: se encola
+    directamente y la respuesta es la misma que la de ``/api/upload``.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get('filename') or '')
+    if not filename:
+        return jsonify({"error": "No se seleccionó archivo"}), 400
+    chat_id = session.get('chat_id')
+    if not chat_id:
+        logger.warning("No hay chat activo para subir archivo", "app.create_upload_session")
+        return jsonify({"error": "No hay chat activo. Crea un nuevo chat primero."}), 400
+
+    user_id = get_user_id()
+    process_mode = _resolve_upload_process_mode(data)
+    progress_id = data.get('upload_id') or str(uuid.uuid4())
+    priority = _resolve_int_setting(data.get('priority'), 0, minimum=-10, maximum=10)
+    sha256 = (data.get('sha256') or '').lower() or None
+
+    known, known_path = _find_known_user_file(current_user.id if current_user.is_authenticated else None, sha256)
+    if known is not None:
+        job_id = str(uuid.uuid4())
+        _submit_upload_job(job_id, user_id, chat_id, known.filename, process_mode, progress_id, priority,
+                           stored_path=known_path, file_hash=known.file_hash, sha256=sha256)
+        logger.info(f"Archivo {filename} ya subido como {known.filename}: se omite la transferencia (trabajo {job_id})",
+                    "app.create_upload_session")
+        return jsonify({
+            "success": True,
+            "queued": True,
+            "known": True,
+            "job_id": job_id,
+            "status": "queued",
+            "filename": known.filename,
+            "progress_id": progress_id,
+            "chat_id": chat_id
+        }), 202
+
+    try:
+        upload_size = _resolve_int_setting(data.get('size'), -1)
+        upload = upload_sessions.create(user_id, filename, upload_size, sha256=sha256,
+                                        options={'chat_id': chat_id, 'process_mode': process_mode,
+                                                 'progress_id': progress_id, 'priority': priority})
+    except UploadSessionError as e:
+        return jsonify({"error": str(e)}), 400 if upload_size < 0 else 413
+    logger.info(f"Subida por partes iniciada: {filename} ({upload.size} bytes, sesión {upload.upload_id})",
+                "app.create_upload_session")
+    return jsonify({**upload.as_dict(), "known": False, "chunk_size": UPLOAD_CHUNK_SIZE_MB * 1024 * 1024,
+                    "progress_id": progress_id}), 201
+
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['GET'])
+@login_required
+def get_upload_session(upload_id):
+    """Endpoint para consultar cuántos bytes se han recibido (para reanudar)"""
+    try:
+        return jsonify(upload_sessions.get(upload_id, get_user_id()).as_dict())
+    except UploadSessionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['PUT'])
+@login_required
+def upload_session_part(upload_id):
+    """Endpoint para enviar una parte: cuerpo binario que empieza en ``?offset=``"""
+    offset = _resolve_int_setting(request.args.get('offset'), -1)
+    try:
+        upload = upload_sessions.append(upload_id, get_user_id(), offset, request.stream)
+    except UploadOffsetError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    except UploadSessionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except UploadSessionError as e:
+        return jsonify({"error": str(e)}), 413
+    return jsonify(upload.as_dict())
+
+
+@app.route('/api/upload/sessions/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload_session(upload_id):
+    """Endpoint para cerrar una subida por partes y encolar su procesamiento"""
+    user_id = get_user_id()
+    try:
+        upload = upload_sessions.get(upload_id, user_id)
+        job_id = str(uuid.uuid4())
+        staged_path = os.path.join(INGEST_PENDING_DIR, job_id, upload.filename)
+        streamed = upload_sessions.finish(upload_id, user_id, staged_path)
+    except UploadSessionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except UploadOffsetError as e:
+        return jsonify({"error": str(e), "offset": e.offset}), 409
+    except UploadSessionError as e:
+        return jsonify({"error": str(e)}), 400
+
+    options = upload.options
+    chat_id = options['chat_id']
+    progress_id = options['progress_id']
+    try:
+        _submit_upload_job(job_id, user_id, chat_id, upload.filename, options['process_mode'], progress_id,
+                           options.get('priority', 0), staged_path=staged_path, file_hash=streamed.md5,
+                           sha256=streamed.sha256)
+    except Exception as e:
+        logger.error(f"Error al encolar archivo: {str(e)}", "app.complete_upload_session")
+        shutil.rmtree(os.path.dirname(staged_path), ignore_errors=True)
+        set_embedding_progress(progress_id, status="failed", completed=True, error=str(e))
+        return jsonify({"error": str(e), "progress_id": progress_id}), 500
+
+    logger.info(f"Archivo {upload.filename} recibido por partes ({streamed.size} bytes), encolado para chat "
+                f"{chat_id} (trabajo {job_id})", "app.complete_upload_session")
+    return jsonify({
+        "success": True,
+        "queued": True,
+        "job_id": job_id,
+        "status": "queued",
+        "filename": upload.filename,
+        "progress_id": progress_id,
+        "chat_id": chat_id
+    }), 202
+
+
+@app.route('/api/upload/sessions/<upload_id>', methods=['DELETE'])
+@login_required
+def discard_upload_session(upload_id):
+    """Endpoint para abandonar una subida por partes"""
+    try:
+        upload_sessions.get(upload_id, get_user_id())
+    except UploadSessionNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    upload_sessions.discard(upload_id)
+    return jsonify({"success": True})
+
+
+def _publish_staged_upload(staged_path, filename):
+    """Mueve el archivo de un trabajo a la carpeta de uploads y devuelve su ruta.
+
+    Si el trabajo se reintenta tras un reinicio, puede que ya se moviera en el
+    intento anterior.
+    """
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if os.path.exists(staged_path):
+        os.replace(staged_path, file_path)
+        shutil.rmtree(os.path.dirname(staged_path), ignore_errors=True)
+    elif not os.path.exists(file_path):
+        raise ValueError(f"El archivo {filename} ya no está disponible")
+    return file_path
+
+
+def _record_user_files(owner_id, files):
+    """Registra en el catálogo ``File`` los archivos ``(file_path, file_hash, sha256)`` subidos (un solo commit).
+
+    Si el hash ya estaba catalogado, la entrada pasa a apuntar a la copia recién
+    subida. Sin ``owner_id`` (sesiones anónimas) la entrada queda sin usuario.
+    """
+    known = {row.file_hash: row for row in File.query.filter(File.file_hash.in_([f[1] for f in files]))}
+    for file_path, file_hash, sha256 in files:
+        row = known.get(file_hash)
+        if row is None:
+            known[file_hash] = row = File(id=str(uuid.uuid4()), user_id=owner_id, file_hash=file_hash)
+            db.session.add(row)
+            logger.info(f"Archivo guardado en base de datos: {os.path.basename(file_path)}", "app.record_user_files")
+        elif row.user_id is None:
+            row.user_id = owner_id
+        if sha256 and not row.sha256:
+            row.sha256 = sha256
+        _catalog_file(row, file_path)
+    db.session.commit()
+
+
+def _upload_result(filename, processed, progress_id, chat_id):
+    filter_stats = processed.filter_stats
+    return {
+        "success": True,
+        "filename": filename,
+        "file_hash": processed.file_hash,
+        "chunks": processed.num_chunks,
+        "embeddings_saved": filter_stats.embeddings_saved,
+        "chunk_filter": filter_stats.as_dict(),
+        "reused": processed.reused,
+        "embeddings_reused": processed.embeddings_reused,
+        "diff_ratio": round(processed.diff_ratio, 4) if processed.diff_ratio is not None else None,
+        "near_duplicate_of": processed.near_duplicate_of,
+        "progress_id": progress_id,
+        "chat_id": chat_id
+    }
+
+
+def run_upload_job(job):
+    """Procesa una subida encolada (se ejecuta en un hilo de ``ingest_queue``).
+
+    Hace lo mismo que hacía la petición de subida, sin sesión ni usuario de
+    Flask: procesa el archivo, lo añade al JSON del chat, amplía las bases RAG
+    anexadas y registra el archivo del usuario. Devuelve la respuesta de la subida.
+    """
+    payload = job.payload
+    filename = payload['filename']
+    chat_id = payload['chat_id']
+    user_id = payload['chat_user_id']
+    progress_id = payload.get('progress_id')
+
+    with app.app_context():
+        file_path = payload.get('stored_path') or _publish_staged_upload(payload['staged_path'], filename)
+        logger.info(f"Procesando archivo subido para chat {chat_id}: {filename} (trabajo {job.id})", "app.run_upload_job")
+        try:
+            processed = process_file_for_chat(file_path, chat_id, payload['process_mode'], progress_id=progress_id,
+                                              user_id=user_id, file_hash=payload.get('file_hash'))
+        except BaseException as e:
+            set_embedding_progress(progress_id, status="cancelled" if isinstance(e, JobCancelled) else "failed",
+                                   completed=True, error=str(e))
+            raise
+
+        chat_data = add_files_to_chat(user_id, chat_id, [processed.file_hash])
+        try:
+            extend_attached_knowledge_bases(user_id, chat_data.get('attached_bases', []), processed.chunks,
+                                            chat_id=chat_id, vectors=processed.vectors)
+        except Exception:
+            # El helper ya registra el detalle del error; no interrumpimos la carga del archivo.
+            pass
+        _record_user_files(payload.get('owner_id'), [(file_path, processed.file_hash, payload.get('sha256'))])
+
+    logger.info(
+        f"Archivo procesado exitosamente para chat {chat_id}: {filename} ({processed.num_chunks} fragmentos)",
+        "app.run_upload_job",
+    )
+    set_embedding_progress(progress_id, status="completed", completed=True, attempt=None, waiting_seconds=0,
+                           file_hash=processed.file_hash, chunks=processed.num_chunks)
+    return _upload_result(filename, processed, progress_id, chat_id)
+
+
+def _prepare_upload_in_context(file_path, process_mode, progress_id, user_id, file_hash=None):
+    with app.app_context():
+        return prepare_file_for_chat(file_path, process_mode, progress_id=progress_id, user_id=user_id,
+                                     file_hash=file_hash)
+
+
+def run_upload_batch_job(job):
+    """Procesa una subida de varios archivos en tres fases.
+
+    1. Carga, OCR y troceado de los archivos en paralelo (``INGEST_PARSE_WORKERS``).
+    2. Una sola pasada de embeddings con los fragmentos pendientes de todos.
+    3. Una sola escritura en la base del chat, en el JSON del chat y en ``File``.
+
+    Un archivo que falla en la fase 1 se informa en su resultado sin detener el
+    resto; un fallo en las fases 2 o 3 hace fallar el lote completo.
+    """
+    payload = job.payload
+    chat_id = payload['chat_id']
+    user_id = payload['chat_user_id']
+    process_mode = payload['process_mode']
+    entries = payload['files']
+    results = {entry['progress_id']: {"success": False, "filename": entry['filename'],
+                                      "progress_id": entry['progress_id'], "chat_id": chat_id}
+               for entry in entries}
+
+    def fail(progress_id, error):
+        results[progress_id]["error"] = error
+        set_embedding_progress(progress_id, status="failed", completed=True, error=error)
+
+    with app.app_context():
+        paths = {}
+        for entry in entries:
+            try:
+                paths[entry['progress_id']] = _publish_staged_upload(entry['staged_path'], entry['filename'])
+            except ValueError as e:
+                fail(entry['progress_id'], str(e))
+        shutil.rmtree(os.path.join(INGEST_PENDING_DIR, job.id), ignore_errors=True)
+
+        # 1. Preparar los archivos en paralelo (los hilos ven la cancelación del trabajo)
+        prepare = bind_current_job(_prepare_upload_in_context)
+        prepared = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(INGEST_PARSE_WORKERS, len(paths))),
+                                thread_name_prefix="ingest-parse") as pool:
+            hashes = {entry['progress_id']: entry.get('file_hash') for entry in entries}
+            futures = {pid: pool.submit(prepare, path, process_mode, pid, user_id, hashes[pid])
+                       for pid, path in paths.items()}
+            for pid, future in futures.items():
+                try:
+                    prepared[pid] = future.result()
+                except Exception as e:
+                    fail(pid, str(e))
+
+        # El mismo archivo dos veces en el lote solo se indexa una vez
+        first_by_hash = {}
+        for pid, item in list(prepared.items()):
+            if item.file_hash in first_by_hash:
+                results[pid].update(success=True, file_hash=item.file_hash, chunks=0,
+                                    duplicate_of=results[first_by_hash[item.file_hash]]['filename'])
+                set_embedding_progress(pid, status="completed", completed=True, file_hash=item.file_hash, chunks=0)
+                del prepared[pid]
+            else:
+                first_by_hash[item.file_hash] = pid
+        check_cancelled()
+
+        progress_ids = list(prepared)
+        try:
+            # 2. Una sola pasada de embeddings para los fragmentos pendientes de todos los archivos
+            pending = [chunk for item in prepared.values() for chunk in item.pending]
+            pending_vectors = []
+            if pending:
+                set_embedding_progress(progress_ids, status="vectorizing", attempt=0, waiting_seconds=0, completed=False)
+                pending_vectors = embed_chunks_with_retry(pending, embeddings, progress_id=progress_ids)
+            processed = {}
+            offset = 0
+            for pid, item in prepared.items():
+                processed[pid] = finish_prepared_file(item, pending_vectors[offset:offset + len(item.pending)])
+                offset += len(item.pending)
+
+            # 3. Una sola escritura en la base del chat
+            all_chunks = [chunk for result in processed.values() for chunk in result.chunks]
+            if all_chunks:
+                all_vectors = np.concatenate([np.asarray(result.vectors, dtype=np.float32)
+                                              for result in processed.values() if result.chunks])
+                add_chunks_to_chat_vectorstore(chat_id, all_chunks, progress_ids, user_id=user_id, vectors=all_vectors)
+                for pid, result in processed.items():
+                    if not result.reused:
+                        _save_file_artifact(result.file_hash, process_mode, result.chunks, result.vectors,
+                                            result.filter_stats, signature=prepared[pid].signature)
+                chat_data = add_files_to_chat(user_id, chat_id, [result.file_hash for result in processed.values()])
+                try:
+                    extend_attached_knowledge_bases(user_id, chat_data.get('attached_bases', []), all_chunks,
+                                                    chat_id=chat_id, vectors=all_vectors)
+                except Exception:
+                    # El helper ya registra el detalle del error; no interrumpimos la carga de los archivos.
+                    pass
+                sha256s = {entry['progress_id']: entry.get('sha256') for entry in entries}
+                _record_user_files(payload.get('owner_id'), [(paths[pid], result.file_hash, sha256s[pid])
+                                                             for pid, result in processed.items()])
+        except BaseException as e:
+            set_embedding_progress(progress_ids, status="cancelled" if isinstance(e, JobCancelled) else "failed",
+                                   completed=True, error=str(e))
+            raise
+
+    for pid, result in processed.items():
+        results[pid] = _upload_result(results[pid]['filename'], result, pid, chat_id)
+        set_embedding_progress(pid, status="completed", completed=True, attempt=None, waiting_seconds=0,
+                               file_hash=result.file_hash, chunks=result.num_chunks)
+    logger.info(
+        f"Lote de {len(entries)} archivos procesado para chat {chat_id}: {len(processed)} indexados, "
+        f"{len(all_chunks)} fragmentos, {len(pending)} embeddings nuevos",
+        "app.run_upload_batch_job",
+    )
+    files = [results[entry['progress_id']] for entry in entries]
+    return {
+        "success": any(result['success'] for result in files),
+        "chat_id": chat_id,
+        "chunks": len(all_chunks),
+        "files": files,
+    }
+
+
+ingest_queue.register('upload', run_upload_job)
+ingest_queue.register('upload_batch', run_upload_batch_job)
+
+
+def _get_user_job(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None or job.user_id != str(get_user_id()):
+        return None
+    return job
+
+
+@app.route('/api/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    """Endpoint para listar los trabajos de subida recientes del usuario"""
+    active_only = request.args.get('active', 'false').lower() == 'true'
+    jobs = ingest_queue.list_jobs(get_user_id(), limit=50, active_only=active_only)
+    return jsonify({"jobs": [job.as_dict() for job in jobs]})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """Endpoint para consultar el estado de un trabajo de subida"""
+    job = _get_user_job(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+
+    # El trabajo actualizó el JSON del chat; si es el chat activo, reflejarlo en la sesión
+    result = job.result or {}
+    if job.status == JOB_COMPLETED and result.get('chat_id') == session.get('chat_id'):
+        file_hashes = session.get('file_hashes', [])
+        new_hashes = [item.get('file_hash') for item in result.get('files', [result])]
+        new_hashes = [h for h in dict.fromkeys(new_hashes) if h and h not in file_hashes]
+        if new_hashes:
+            session['file_hashes'] = file_hashes + new_hashes
+
+    return jsonify(job.as_dict())
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """Endpoint para cancelar un trabajo de subida en cola o en curso"""
+    job = _get_user_job(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+
+    job = ingest_queue.cancel(job_id)
+    if job.status == JOB_CANCELLED:
+        shutil.rmtree(os.path.join(INGEST_PENDING_DIR, job_id), ignore_errors=True)
+        set_embedding_progress(job_progress_ids(job), status="cancelled", completed=True)
+    logger.info(f"Cancelación solicitada para el trabajo {job_id} ({job.status})", "app.cancel_job")
+    return jsonify(job.as_dict())
+
+
 @app.route('/api/upload/progress/<progress_id>', methods=['GET'])
 @login_required
 def get_upload_progress(progress_id):
-    with EMBEDDING_PROGRESS_LOCK:
-        progress = EMBEDDING_PROGRESS.get(progress_id)
+    progress = upload_progress.get(progress_id)
 
     if not progress:
         return jsonify({
@@ -2160,6 +3615,37 @@ def get_upload_progress(progress_id):
         "server_time": datetime.utcnow().isoformat()
     })
 
+
+@app.route('/api/upload/events', methods=['GET'])
+@login_required
+def upload_events():
+    """Endpoint SSE con el progreso de todos los trabajos de subida activos del usuario"""
+    user_id = get_user_id()
+    stream = upload_event_streams.open(lambda: upload_event_stream(
+        ingest_queue,
+        upload_progress,
+        user_id,
+        interval=UPLOAD_EVENTS_INTERVAL_SECONDS,
+        max_seconds=UPLOAD_EVENTS_MAX_SECONDS,
+        idle_seconds=UPLOAD_EVENTS_IDLE_SECONDS,
+    ))
+    if stream is None:
+        # Sin plazas: EventSource no reconecta tras un 503 y el navegador usa el sondeo
+        return jsonify({"error": "Demasiadas conexiones de progreso abiertas"}), 503
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/api/upload/progress', methods=['GET'])
+@login_required
+def get_upload_progress_batch():
+    """Endpoint para consultar el progreso de varias subidas con una sola petición (?ids=a,b,c)"""
+    progress_ids = [pid for pid in request.args.get('ids', '').split(',') if pid][:UPLOAD_PROGRESS_MAX_IDS]
+    return jsonify({
+        "progress": upload_progress.get_many(progress_ids),
+        "server_time": datetime.utcnow().isoformat()
+    })
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
     """Endpoint para obtener los modelos disponibles"""
@@ -2178,15 +3664,14 @@ def new_chat():
     # Guardar el estado actual del chat antes de crear uno nuevo
     current_chat_id = session.get('chat_id')
     if current_chat_id:
-        current_messages = load_chat_history(user_id, current_chat_id)
-        current_chat_data = get_chat_data(user_id, current_chat_id)
-        # Guardar el chat actual con los file_hashes actuales
+        current_chat_data = get_chat_data(user_id, current_chat_id, with_messages=False)
+        # Guardar el chat actual con los file_hashes actuales (solo la cabecera)
         save_chat_history(
             user_id, 
-            current_messages, 
+            None, 
             current_chat_data.get('system_message'), 
             current_chat_data.get('title'),
-            session.get('file_hashes', []),
+            None,
             rag_top_k=current_chat_data.get('rag_top_k'),
             temperature=current_chat_data.get('temperature'),
             message_history_limit=current_chat_data.get('message_history_limit'),
@@ -2208,24 +3693,7 @@ def new_chat():
 def get_files():
     """Endpoint para obtener la lista de archivos subidos"""
     file_hashes = session.get('file_hashes', [])
-    files = []
-
-    # Obtener información de los archivos subidos
-    for file_hash in file_hashes:
-        # Buscar el archivo original en la carpeta de uploads
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.isfile(file_path):
-                # Verificar si el hash coincide
-                if hashlib.md5(open(file_path, 'rb').read()).hexdigest() == file_hash:
-                    files.append({
-                        "id": file_hash,
-                        "name": filename,
-                        "date": datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                    })
-                    break
-
-    return jsonify({"files": files})
+    return jsonify({"files": catalog_files(file_hashes)})
 
 @app.route('/api/files/<file_hash>', methods=['DELETE'])
 def delete_file(file_hash):
@@ -2242,10 +3710,10 @@ def delete_file(file_hash):
 
         # Actualizar el chat actual con la lista de archivos modificada
         user_id = get_user_id()
-        chat_data = get_chat_data(user_id, chat_id)
+        chat_data = get_chat_data(user_id, chat_id, with_messages=False)
         save_chat_history(
             user_id, 
-            chat_data.get('messages', []), 
+            None, 
             chat_data.get('system_message'), 
             chat_data.get('title'),
             file_hashes,
@@ -2258,7 +3726,7 @@ def delete_file(file_hash):
 
         # Reconstruir la base vectorial del chat sin el archivo eliminado
         try:
-            rebuild_chat_vectorstore(chat_id, file_hashes)
+            rebuild_chat_vectorstore(chat_id, file_hashes, user_id=user_id)
             logger.info(f"Base vectorial del chat {chat_id} reconstruida sin archivo {file_hash}", "app.delete_file")
         except Exception as e:
             logger.error(f"Error al reconstruir base vectorial tras eliminar archivo: {str(e)}", "app.delete_file")
@@ -2279,7 +3747,7 @@ def list_knowledge_bases():
     attached = set()
 
     if chat_id:
-        chat_data = get_chat_data(user_id, chat_id)
+        chat_data = get_chat_data(user_id, chat_id, with_messages=False)
         attached = set(chat_data.get('attached_bases', []))
 
     bases = (
@@ -2310,21 +3778,37 @@ def save_knowledge_base():
         return jsonify({"error": "No hay chat activo para guardar"}), 400
 
     chat_db_path = os.path.join(VECTORDB_DIR, str(chat_id))
-    if not os.path.exists(chat_db_path):
+    in_user_index = user_index_enabled() and get_user_vector_index(user_id).has_scope(CHAT_SCOPE, chat_id)
+    if not in_user_index and not os.path.exists(chat_db_path):
         return jsonify({"error": "Este chat no tiene una base RAG para guardar"}), 400
 
     if KnowledgeBase.query.filter_by(user_id=user_id, name=name).first():
         return jsonify({"error": "Ya existe una base con ese nombre"}), 409
 
     kb_id = str(uuid.uuid4())
-    relative_path = os.path.join('knowledge_bases', kb_id)
-    destination = os.path.join(KNOWLEDGE_BASE_DIR, kb_id)
 
-    try:
-        shutil.copytree(chat_db_path, destination)
-    except Exception as exc:
-        logger.error(f"No se pudo copiar la base vectorial del chat {chat_id} a {destination}: {exc}", "app.save_knowledge_base")
-        return jsonify({"error": "No se pudo guardar la base RAG"}), 500
+    if in_user_index:
+        # La base guardada son solo etiquetas sobre los vectores del chat en el índice del usuario
+        relative_path = _user_index_relpath(user_id)
+        try:
+            tagged = get_user_vector_index(user_id).copy_scope((CHAT_SCOPE, chat_id), (KB_SCOPE, kb_id))
+        except Exception as exc:
+            logger.error(f"No se pudo etiquetar la base RAG del chat {chat_id}: {exc}", "app.save_knowledge_base")
+            return jsonify({"error": "No se pudo guardar la base RAG"}), 500
+        logger.debug(f"Base RAG {kb_id} etiquetada sobre {tagged} vectores del chat {chat_id}", "app.save_knowledge_base")
+    else:
+        relative_path = os.path.join('knowledge_bases', kb_id)
+        destination = os.path.join(KNOWLEDGE_BASE_DIR, kb_id)
+        try:
+            # Bloquear la base para que una compactación no retire segmentos durante la copia
+            with store_compactor.locked(chat_db_path):
+                shutil.copytree(chat_db_path, destination, ignore=shutil.ignore_patterns(STORE_LOCK_FILE, '.*.tmp'))
+            # La base guardada queda en un único índice; si es grande, con su índice aproximado
+            compact_segments(destination, embeddings)
+        except Exception as exc:
+            logger.error(f"No se pudo copiar la base vectorial del chat {chat_id} a {destination}: {exc}", "app.save_knowledge_base")
+            shutil.rmtree(destination, ignore_errors=True)
+            return jsonify({"error": "No se pudo guardar la base RAG"}), 500
 
     kb = KnowledgeBase(
         id=kb_id,
@@ -2351,11 +3835,10 @@ def get_chat_knowledge_bases(chat_id):
     """Lista las bases guardadas del usuario e indica cuáles están asociadas al chat."""
 
     user_id = get_user_id()
-    chat_file = os.path.join(DATA_DIR, f"{user_id}_{chat_id}.json")
-    if not os.path.exists(chat_file):
+    if not get_chat_repository().exists(user_id, chat_id):
         return jsonify({"error": "Chat no encontrado"}), 404
 
-    chat_data = get_chat_data(user_id, chat_id)
+    chat_data = get_chat_data(user_id, chat_id, with_messages=False)
     attached = set(chat_data.get('attached_bases', []))
 
     bases = (
@@ -2380,11 +3863,10 @@ def attach_knowledge_base(chat_id, kb_id):
     if not kb:
         return jsonify({"error": "Base RAG no encontrada"}), 404
 
-    chat_file = os.path.join(DATA_DIR, f"{user_id}_{chat_id}.json")
-    if not os.path.exists(chat_file):
+    if not get_chat_repository().exists(user_id, chat_id):
         return jsonify({"error": "Chat no encontrado"}), 404
 
-    chat_data = get_chat_data(user_id, chat_id)
+    chat_data = get_chat_data(user_id, chat_id, with_messages=False)
     attached = set(chat_data.get('attached_bases', []))
 
     if kb_id not in attached:
@@ -2400,11 +3882,10 @@ def detach_knowledge_base(chat_id, kb_id):
     """Desasocia una base guardada del chat actual."""
 
     user_id = get_user_id()
-    chat_file = os.path.join(DATA_DIR, f"{user_id}_{chat_id}.json")
-    if not os.path.exists(chat_file):
+    if not get_chat_repository().exists(user_id, chat_id):
         return jsonify({"error": "Chat no encontrado"}), 404
 
-    chat_data = get_chat_data(user_id, chat_id)
+    chat_data = get_chat_data(user_id, chat_id, with_messages=False)
     attached = set(chat_data.get('attached_bases', []))
 
     if kb_id in attached:
@@ -2753,9 +4234,14 @@ def admin_delete_user(user_id):
     try:
         # Eliminar archivos de historial de chat
         removed_chat_files = 0
-        for filename in os.listdir(DATA_DIR):
+        chat_json_files = [
+            os.path.join(directory, filename)
+            for directory in (DATA_DIR, CHAT_JSON_ARCHIVE_DIR) if os.path.isdir(directory)
+            for filename in os.listdir(directory)
+        ]
+        for file_path in chat_json_files:
+            filename = os.path.basename(file_path)
             if filename.startswith(f"{user_id}_") and filename.endswith('.json'):
-                file_path = os.path.join(DATA_DIR, filename)
                 try:
                     os.remove(file_path)
                     removed_chat_files += 1
@@ -2770,6 +4256,7 @@ def admin_delete_user(user_id):
             db_path = os.path.join(VECTORDB_DIR, user_file.file_hash)
             if os.path.exists(db_path):
                 shutil.rmtree(db_path, ignore_errors=True)
+                vectorstore_cache.invalidate(db_path)
             db.session.delete(user_file)
 
         # Limpiar archivos temporales asociados en uploads/users
@@ -2785,10 +4272,8 @@ def admin_delete_user(user_id):
                     except Exception as exc:
                         logger.warning(f"No se pudo eliminar archivo de upload {file_path}: {exc}", "app.admin_delete_user")
 
-        # Eliminar chats y prompts relacionados
-        user_chats = Chat.query.filter_by(user_id=user_id).all()
-        for chat in user_chats:
-            db.session.delete(chat)
+        # Eliminar chats (con sus mensajes) y prompts relacionados
+        chat_repository.delete_user_chats(user_id, commit=False)
 
         user_prompts = UserPrompt.query.filter_by(user_id=user_id).all()
         for prompt in user_prompts:
@@ -2811,24 +4296,57 @@ def admin_delete_user(user_id):
         }), 500
 
 
+@app.route('/api/admin/vectorstore_cache', methods=['GET'])
+@login_required
+def admin_vectorstore_cache_stats():
+    """Devuelve los contadores de la caché de bases vectoriales del proceso."""
+    if not current_user.is_admin:
+        return jsonify({
+            "success": False,
+            "error": "No tienes permisos para realizar esta acción."
+        }), 403
+
+    return jsonify({"success": True, "cache": vectorstore_cache.stats()})
+
+
+@app.route('/api/admin/embedding_cache', methods=['GET'])
+@login_required
+def admin_embedding_cache_stats():
+    """Devuelve ocupación y tasa de aciertos de la caché persistente de embeddings."""
+    if not current_user.is_admin:
+        return jsonify({
+            "success": False,
+            "error": "No tienes permisos para realizar esta acción."
+        }), 403
+
+    return jsonify({"success": True, "cache": embedding_cache.stats()})
+
+
 @app.route('/api/chat/<chat_id>', methods=['DELETE'])
 def delete_chat(chat_id):
     """Endpoint para eliminar un chat y su base de datos RAG asociada"""
     user_id = get_user_id()
-    filename = os.path.join(DATA_DIR, f"{user_id}_{chat_id}.json")
 
-    if os.path.exists(filename):
-        os.remove(filename)
-        logger.info(f"Archivo de chat eliminado: {filename}", "app.delete_chat")
+    if get_chat_repository().delete(user_id, chat_id):
+        logger.info(f"Chat eliminado: {chat_id}", "app.delete_chat")
 
         # Eliminar la base de datos vectorial asociada al chat
         chat_db_path = os.path.join(VECTORDB_DIR, str(chat_id))
         if os.path.exists(chat_db_path):
             try:
-                shutil.rmtree(chat_db_path)
+                with store_compactor.locked(chat_db_path):
+                    shutil.rmtree(chat_db_path)
                 logger.info(f"Base vectorial del chat {chat_id} eliminada: {chat_db_path}", "app.delete_chat")
             except Exception as e:
                 logger.error(f"Error al eliminar base vectorial del chat {chat_id}: {str(e)}", "app.delete_chat")
+            finally:
+                vectorstore_cache.invalidate(chat_db_path)
+
+        if user_index_enabled():
+            try:
+                get_user_vector_index(user_id).remove_scope(CHAT_SCOPE, chat_id)
+            except Exception as e:
+                logger.error(f"Error al retirar el chat {chat_id} del índice del usuario: {str(e)}", "app.delete_chat")
 
         # Limpiar sesión si es el chat actual
         if session.get('chat_id') == chat_id:
@@ -2836,12 +4354,7 @@ def delete_chat(chat_id):
             session.pop('file_hashes', None)
 
         # Verificar si quedan chats
-        remaining_chats = [
-            name for name in os.listdir(DATA_DIR)
-            if name.startswith(f"{user_id}_") and name.endswith('.json')
-        ]
-
-        if not remaining_chats:
+        if not get_chat_repository().list_chats(user_id):
             new_chat_info = create_new_chat_session(user_id)
             return jsonify({
                 "success": True,
@@ -2930,16 +4443,16 @@ def update_system_message(chat_id):
     data = request.json
     system_message = data.get('system_message')
 
-    # Cargar datos del chat
-    chat_data = get_chat_data(user_id, chat_id)
+    # Cargar la cabecera del chat
+    chat_data = get_chat_data(user_id, chat_id, with_messages=False)
 
-    if not chat_data or not chat_data.get('messages'):
+    if not chat_data.get('chat_id') or not get_chat_repository().message_count(chat_id):
         return jsonify({"error": "Chat no encontrado"}), 404
 
     # Actualizar y guardar manteniendo los file_hashes específicos de este chat
     chat_id = save_chat_history(
         user_id, 
-        chat_data.get('messages', []), 
+        None, 
         system_message, 
         chat_data.get('title'), 
         chat_data.get('file_hashes', []),
@@ -2966,8 +4479,8 @@ def update_chat_title(chat_id):
     if not title:
         return jsonify({"error": "Título no proporcionado"}), 400
 
-    # Cargar datos del chat
-    chat_data = get_chat_data(user_id, chat_id)
+    # Cargar la cabecera del chat
+    chat_data = get_chat_data(user_id, chat_id, with_messages=False)
 
     if not chat_data:
         return jsonify({"error": "Chat no encontrado"}), 404
@@ -2975,7 +4488,7 @@ def update_chat_title(chat_id):
     # Actualizar y guardar manteniendo los file_hashes específicos
     chat_id = save_chat_history(
         user_id, 
-        chat_data.get('messages', []), 
+        None, 
         chat_data.get('system_message'), 
         title, 
         chat_data.get('file_hashes', []),
@@ -2991,26 +4504,9 @@ def update_chat_title(chat_id):
 def get_chat_files(chat_id):
     """Endpoint para obtener la lista de archivos asociados a un chat específico"""
     user_id = get_user_id()
-    chat_data = get_chat_data(user_id, chat_id)
+    chat_data = get_chat_data(user_id, chat_id, with_messages=False)
     file_hashes = chat_data.get('file_hashes', [])
-    files = []
-
-    # Obtener información de los archivos asociados a este chat
-    for file_hash in file_hashes:
-        # Buscar el archivo original en la carpeta de uploads
-        for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.isfile(file_path):
-                # Verificar si el hash coincide
-                if hashlib.md5(open(file_path, 'rb').read()).hexdigest() == file_hash:
-                    files.append({
-                        "id": file_hash,
-                        "name": filename,
-                        "date": datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-                    })
-                    break
-
-    return jsonify({"files": files})
+    return jsonify({"files": catalog_files(file_hashes)})
 
 # Crear tablas de la base de datos si no existen
 # Note: before_first_request was removed in Flask 2.3.0
@@ -3019,8 +4515,17 @@ def get_chat_files(chat_id):
 with app.app_context():
     db.create_all()
     ensure_user_type_consistency()
+    ensure_file_catalog_columns()
+    backfill_file_catalog()
+    ensure_chat_table_columns()
     backfill_missing_default_prompts()
     migrate_vectorstores_to_chat_system()
+    migrate_json_chats_to_database()
+    convert_legacy_vectorstores()
+    migrate_vectorstores_to_user_indexes()
+
+# Arrancar los hilos de la cola de subidas (recupera los trabajos interrumpidos)
+ingest_queue.start()
 
 @app.route('/chat-stream', methods=['POST'])
 @login_required
@@ -3039,7 +4544,7 @@ def chat_stream():
         # Obtener o crear chat
         if not chat_id:
             # Crear nuevo chat
-            chat = Chat(user_id=current_user.id, title=message[:30])
+            chat = Chat(id=str(uuid.uuid4()), user_id=current_user.id, title=message[:30])
             db.session.add(chat)
             db.session.commit()
             chat_id = chat.id
@@ -3055,12 +4560,20 @@ def chat_stream():
         db.session.commit()
         
         # Obtener historial de mensajes para contexto
-        messages_history = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp).all()
+        messages_history = Message.query.filter_by(chat_id=chat_id).order_by(Message.id).all()
         
-        # Preparar mensajes para la API
+        # Preparar mensajes para la API: los recientes que caben en el presupuesto y el resumen del resto
+        history = select_chat_history(
+            current_user.id,
+            chat_id,
+            get_chat_repository().get(current_user.id, chat_id, with_messages=False) or {},
+            [{"role": msg.role, "content": msg.content} for msg in messages_history],
+            model_id or AZURE_OPENAI_DEPLOYMENT
+        )
         api_messages = []
-        for msg in messages_history:
-            api_messages.append({"role": msg.role, "content": msg.content})
+        if history.summary:
+            api_messages.append({"role": "system", "content": f"Resumen de la conversación anterior:\n{history.summary}"})
+        api_messages.extend(history.messages)
         
         # Obtener cliente de OpenAI para el modelo seleccionado
         client = get_openai_client(model_id)
@@ -3079,13 +4592,13 @@ def chat_stream():
                     
                     # Convertir mensajes al formato de Azure AI Inference
                     inference_messages = []
-                    for msg in messages_history:
-                        if msg.role == "system":
-                            inference_messages.append(SystemMessage(content=msg.content))
-                        elif msg.role == "user":
-                            inference_messages.append(UserMessage(content=msg.content))
-                        elif msg.role == "assistant":
-                            inference_messages.append(AssistantMessage(content=msg.content))
+                    for msg in api_messages:
+                        if msg["role"] == "system":
+                            inference_messages.append(SystemMessage(content=msg["content"]))
+                        elif msg["role"] == "user":
+                            inference_messages.append(UserMessage(content=msg["content"]))
+                        elif msg["role"] == "assistant":
+                            inference_messages.append(AssistantMessage(content=msg["content"]))
                     
                     # Si no hay mensaje de sistema, añadir uno por defecto
                     if not any(isinstance(msg, SystemMessage) for msg in inference_messages):
@@ -3146,7 +4659,7 @@ def chat_stream():
             # Enviar señal de finalización
             yield f"data: {json.dumps({'content': '[DONE]', 'chat_id': chat_id})}\n\n"
         
-        return Response(generate(), mimetype='text/event-stream')
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
         
     except Exception as e:
         logger.error(f"Error en chat_stream: {str(e)}", "app.chat_stream")
@@ -0,0 +1,129 @@
+"""Ventana del historial por presupuesto de tokens con resumen acumulado.
+
+El historial que se enviaba al modelo se recortaba por número de mensajes
+(``chat``) o no se recortaba (``chat-stream``): un chat largo, o con documentos
+pegados, mandaba prompts enormes, lentos, caros y a veces más largos que el
+contexto del modelo. :func:`build_history_window` elige los mensajes más
+recientes que caben en ``max_tokens`` (contados con la codificación de
+tiktoken del deployment) y los anteriores se resumen.
+
+El resumen es incremental y se guarda con el chat junto con ``summary_upto``,
+el número de mensajes que cubre. Solo se vuelve a pedir al modelo cuando los
+mensajes posteriores a ``summary_upto`` ya no caben: entonces se pliegan en el
+resumen los suficientes para bajar a ``target_ratio`` del presupuesto, de modo
+que los turnos siguientes vuelven a caber sin otra llamada.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from rag_pipeline.batching import HEURISTIC_CHARS_PER_TOKEN, Encoding
+
+# Tokens fijos por mensaje (rol y separadores del formato de chat)
+MESSAGE_OVERHEAD_TOKENS = 4
+# Coste aproximado de una imagen en alta resolución
+IMAGE_TOKENS = 765
+
+Summarizer = Callable[[Optional[str], List[Dict[str, Any]]], str]
+
+
+@dataclass
+class HistoryWindow:
+    """Mensajes que se envían al modelo y resumen de los anteriores."""
+
+    messages: List[Dict[str, Any]]
+    summary: Optional[str]
+    summary_upto: int
+    tokens: int
+    summary_changed: bool = False
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """Texto de un mensaje; las imágenes de los mensajes multimodales se omiten."""
+    content = message.get('content')
+    if isinstance(content, list):
+        return ' '.join(part.get('text', '') for part in content
+                        if isinstance(part, dict) and part.get('type') == 'text')
+    return str(content or '')
+
+
+def count_text_tokens(text: str, encoding: Optional[Encoding]) -> int:
+    if not text:
+        return 0
+    if encoding is None:
+        return len(text) // HEURISTIC_CHARS_PER_TOKEN + 1
+    # Un usuario puede escribir "<|endoftext|>": se cuenta como texto normal
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(message: Dict[str, Any], encoding: Optional[Encoding]) -> int:
+    content = message.get('content')
+    images = 0
+    if isinstance(content, list):
+        images = sum(1 for part in content if isinstance(part, dict) and part.get('type') == 'image_url')
+    return MESSAGE_OVERHEAD_TOKENS + count_text_tokens(message_text(message), encoding) + images * IMAGE_TOKENS
+
+
+def _fit(messages: Sequence[Dict[str, Any]], budget: int, max_messages: Optional[int],
+         encoding: Optional[Encoding]) -> Tuple[int, int]:
+    """Cuántos mensajes finales caben en ``budget`` y sus tokens (el último entra siempre)."""
+    count = tokens = 0
+    for message in reversed(messages):
+        if max_messages is not None and count >= max_messages:
+            break
+        cost = count_message_tokens(message, encoding)
+        if count and tokens + cost > budget:
+            break
+        count += 1
+        tokens += cost
+    return count, tokens
+
+
+def build_history_window(messages: Sequence[Dict[str, Any]], *, max_tokens: int,
+                         encoding: Optional[Encoding] = None, max_messages: Optional[int] = None,
+                         summary: Optional[str] = None, summary_upto: int = 0,
+                         summarize: Optional[Summarizer] = None, target_ratio: float = 0.6) -> HistoryWindow:
+    """Mensajes recientes que caben en ``max_tokens`` y resumen (guardado o actualizado) del resto.
+
+    ``summary`` y ``summary_upto`` son el resumen guardado del chat. Sin
+    ``summarize``, o si falla, los mensajes que no caben simplemente no se
+    envían y el resumen guardado no cambia.
+    """
+    if summary_upto > len(messages) or not summary:
+        # Sin resumen, o el historial se recortó por debajo de él (ya no sirve)
+        summary, summary_upto = None, 0
+    summary_tokens = count_text_tokens(summary or '', encoding)
+    pending = messages[summary_upto:]
+    count, tokens = _fit(pending, max_tokens - summary_tokens, max_messages, encoding)
+    if count == len(pending) or summarize is None:
+        return HistoryWindow(list(pending[len(pending) - count:]), summary, summary_upto, tokens + summary_tokens)
+
+    # Plegar en el resumen lo necesario para bajar a ``target_ratio`` del presupuesto
+    target_messages = max(1, int(max_messages * target_ratio)) if max_messages is not None else None
+    target_count, _ = _fit(pending, int(max_tokens * target_ratio) - summary_tokens, target_messages, encoding)
+    start = summary_upto + len(pending) - target_count
+    try:
+        new_summary = summarize(summary, list(messages[summary_upto:start]))
+    except Exception:
+        return HistoryWindow(list(pending[len(pending) - count:]), summary, summary_upto, tokens + summary_tokens)
+
+    summary_tokens = count_text_tokens(new_summary, encoding)
+    recent = messages[start:]
+    count, tokens = _fit(recent, max_tokens - summary_tokens, max_messages, encoding)
+    return HistoryWindow(list(recent[len(recent) - count:]), new_summary, start, tokens + summary_tokens,
+                         summary_changed=True)
+
+
+def summary_prompt(previous_summary: Optional[str], messages: Sequence[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Mensajes para pedir al modelo el resumen acumulado."""
+    transcript = '\n'.join(f"{message.get('role')}: {message_text(message)}" for message in messages)
+    request = (
+        "Actualiza el resumen de una conversación con los mensajes nuevos. Conserva los datos, "
+        "decisiones, nombres y cifras que puedan hacer falta más adelante. Responde solo con el resumen."
+    )
+    previous = previous_summary or '(sin resumen previo)'
+    return [
+        {"role": "system", "content": request},
+        {"role": "user", "content": f"Resumen actual:\n{previous}\n\nMensajes nuevos:\n{transcript}"},
+    ]
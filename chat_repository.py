@@ -0,0 +1,382 @@
+"""Historial de chats en las tablas ``Chat`` y ``Message``.
+
+Cada chat era un JSON ``<DATA_DIR>/<user_id>_<chat_id>.json`` con todos sus
+mensajes y parámetros: listar los chats del usuario recorría la carpeta de
+todos los usuarios y cargaba cada archivo, y cada mensaje reescribía el JSON
+completo. :class:`ChatRepository` guarda la cabecera del chat (título, mensaje
+de sistema, archivos, bases RAG y parámetros) en ``Chat`` y los mensajes en
+``Message``:
+
+- La lista de chats es una consulta sobre el índice ``(user_id, updated_at)``.
+- Los mensajes de un chat se leen en orden con el índice ``(chat_id, id)``.
+- Los mensajes son un registro que solo crece: guardar un turno escribe las
+  filas nuevas y no vuelve a serializar el historial (con sus imágenes en
+  base64). Cambiar los parámetros del chat solo escribe la cabecera.
+
+Los diccionarios que devuelve tienen la misma forma que los antiguos JSON, así
+que las respuestas de la API no cambian. :meth:`ChatRepository.import_json_file`
+incorpora un JSON antiguo (migración al arrancar).
+
+Dentro de una petición se usa :class:`BufferedChatRepository`: cada chat se lee
+una sola vez, los cambios se acumulan y :meth:`BufferedChatRepository.flush`
+los confirma con una única escritura al terminar, solo si algo cambió.
+"""
+from __future__ import annotations
+
+import copy
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from models import Chat, Message, db
+
+# Campos de la cabecera del chat que se guardan como JSON
+_JSON_FIELDS = ('file_hashes', 'attached_bases')
+_HEADER_FIELDS = ('system_message', 'title', 'file_hashes', 'attached_bases', 'rag_top_k', 'temperature',
+                  'message_history_limit', 'history_summary', 'history_summary_upto')
+
+
+def _encode_content(content: Any) -> Tuple[str, str]:
+    """Contenido de un mensaje como texto: los mensajes multimodales (listas) se guardan en JSON."""
+    if isinstance(content, str):
+        return content, 'text'
+    return json.dumps(content, ensure_ascii=False), 'json'
+
+
+def _decode_content(row: Message) -> Any:
+    if row.content_type == 'json':
+        return json.loads(row.content)
+    return row.content if row.content is not None else ''
+
+
+def _same_message(row: Message, message: Dict[str, Any]) -> bool:
+    content, content_type = _encode_content(message.get('content', ''))
+    return (row.role, row.content or '', row.content_type) == (message.get('role'), content, content_type)
+
+
+def _message_preview(content: Any) -> str:
+    if isinstance(content, list):
+        content = ' '.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return f"{str(content)[:50]}..."
+
+
+class ChatRepository:
+    """Lectura y escritura de chats con la sesión de ``models.db`` (cada escritura se confirma al momento)."""
+
+    def __init__(self) -> None:
+        # Filas leídas y escritas, para comprobar cuánta E/S cuesta cada operación
+        self.counters = {'chat_reads': 0, 'message_reads': 0, 'chat_writes': 0, 'message_writes': 0}
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+    def _load(self, chat_id: str) -> Optional[Chat]:
+        self.counters['chat_reads'] += 1
+        return db.session.get(Chat, chat_id)
+
+    def _chat(self, user_id: Any, chat_id: str) -> Optional[Chat]:
+        if not chat_id:
+            return None
+        chat = self._load(chat_id)
+        if chat is None or str(chat.user_id) != str(user_id):
+            return None
+        return chat
+
+    def exists(self, user_id: Any, chat_id: str) -> bool:
+        return self._chat(user_id, chat_id) is not None
+
+    def _header(self, chat: Chat) -> Dict[str, Any]:
+        header = {
+            'chat_id': chat.id,
+            'timestamp': chat.updated_at.isoformat() if chat.updated_at else None,
+            'system_message': chat.system_message,
+            'title': chat.title,
+            'rag_top_k': chat.rag_top_k,
+            'temperature': chat.temperature,
+            'message_history_limit': chat.message_history_limit,
+            'history_summary': chat.history_summary,
+            'history_summary_upto': chat.history_summary_upto or 0,
+        }
+        for name in _JSON_FIELDS:
+            raw = getattr(chat, name)
+            header[name] = json.loads(raw) if raw else []
+        return header
+
+    def message_count(self, chat_id: str) -> int:
+        return Message.query.filter_by(chat_id=chat_id).count()
+
+    def messages(self, chat_id: str) -> List[Dict[str, Any]]:
+        rows = Message.query.filter_by(chat_id=chat_id).order_by(Message.id).all()
+        self.counters['message_reads'] += len(rows)
+        return [{'role': row.role, 'content': _decode_content(row)} for row in rows]
+
+    def get(self, user_id: Any, chat_id: str, *, with_messages: bool = True) -> Optional[Dict[str, Any]]:
+        """Datos del chat (como el antiguo JSON) o None si no existe o es de otro usuario."""
+        chat = self._chat(user_id, chat_id)
+        if chat is None:
+            return None
+        data = self._header(chat)
+        if with_messages:
+            data['messages'] = self.messages(chat.id)
+        return data
+
+    def list_chats(self, user_id: Any) -> List[Dict[str, Any]]:
+        """Chats del usuario, el más reciente primero (formato de ``/api/chats``)."""
+        chats = Chat.query.filter_by(user_id=user_id).order_by(Chat.updated_at.desc()).all()
+        self.counters['chat_reads'] += len(chats)
+        # Solo los chats sin título necesitan su primer mensaje para la vista previa
+        untitled = [chat.id for chat in chats if not chat.title]
+        first_messages = {}
+        if untitled:
+            first_ids = (db.session.query(db.func.min(Message.id))
+                         .filter(Message.chat_id.in_(untitled)).group_by(Message.chat_id))
+            for row in Message.query.filter(Message.id.in_(first_ids)):
+                first_messages[row.chat_id] = _message_preview(_decode_content(row))
+            self.counters['message_reads'] += len(first_messages)
+        return [
+            {
+                'id': chat.id,
+                'timestamp': chat.updated_at.isoformat() if chat.updated_at else '',
+                'preview': chat.title or first_messages.get(chat.id, 'Chat vacío'),
+                'system_message': chat.system_message,
+            }
+            for chat in chats
+        ]
+
+    def save(self, user_id: Any, chat_id: str, data: Dict[str, Any], *, timestamp: Optional[datetime] = None) -> None:
+        """Crea o actualiza el chat con ``data``: la cabecera y, si viene, la lista completa de mensajes.
+
+        Sin la clave ``messages`` solo se escribe la cabecera. ``updated_at`` solo
+        cambia si cambió algo.
+        """
+        chat = self._load(chat_id)
+        # Hora local, como el ``timestamp`` de los antiguos JSON
+        now = timestamp or datetime.now()
+        created = chat is None
+        if created:
+            chat = Chat(id=chat_id, user_id=user_id, created_at=now)
+            db.session.add(chat)
+            self._remember(chat)
+        elif str(chat.user_id) != str(user_id):
+            raise ValueError(f"El chat {chat_id} pertenece a otro usuario")
+        self._apply_header(chat, data)
+        messages_changed = 'messages' in data and self._stage_messages(chat_id, data['messages'] or [], now)
+        if created or messages_changed or db.session.is_modified(chat):
+            chat.updated_at = now
+            self._changed(chat_id)
+        self._commit()
+
+    def _remember(self, chat: Chat) -> None:
+        """Gancho para las subclases con caché: se acaba de crear ``chat``."""
+
+    def _changed(self, chat_id: str) -> None:
+        self.counters['chat_writes'] += 1
+
+    def _commit(self) -> None:
+        db.session.commit()
+
+    def _stage_messages(self, chat_id: str, messages: List[Dict[str, Any]], now: datetime) -> bool:
+        written = self._sync_messages(chat_id, messages, now)
+        self.counters['message_writes'] += written
+        return bool(written)
+
+    def _sync_messages(self, chat_id: str, messages: List[Dict[str, Any]], now: datetime, *,
+                       keep: Optional[int] = None) -> int:
+        """Deja en ``Message`` exactamente ``messages`` escribiendo solo lo que cambió.
+
+        Lo normal es que el historial crezca por el final: basta comparar el
+        último mensaje guardado que se conserva y añadir los nuevos. Si el
+        historial cambió antes (se recortó o se editó), las filas se reescriben
+        desde el primer mensaje distinto. Si quien llama ya sabe cuántos
+        mensajes guardados se conservan, lo indica con ``keep`` y no se compara
+        nada. Devuelve cuántas filas se escribieron o borraron.
+        """
+        ids = [message_id for (message_id,) in
+               db.session.query(Message.id).filter_by(chat_id=chat_id).order_by(Message.id)]
+        if keep is None:
+            keep = min(len(ids), len(messages))
+            if keep and not _same_message(db.session.get(Message, ids[keep - 1]), messages[keep - 1]):
+                rows = Message.query.filter_by(chat_id=chat_id).order_by(Message.id).limit(keep)
+                keep = next((index for index, (row, message) in enumerate(zip(rows, messages))
+                             if not _same_message(row, message)), keep)
+        keep = min(keep, len(ids), len(messages))
+        if keep < len(ids):
+            (Message.query.filter(Message.chat_id == chat_id, Message.id >= ids[keep])
+             .delete(synchronize_session=False))
+        self._insert_messages(chat_id, messages[keep:], now)
+        return len(ids) - keep + len(messages) - keep
+
+    def _insert_messages(self, chat_id: str, messages: List[Dict[str, Any]], now: datetime) -> None:
+        for message in messages:
+            content, content_type = _encode_content(message.get('content', ''))
+            db.session.add(Message(chat_id=chat_id, role=message.get('role'), content=content,
+                                   content_type=content_type, created_at=now))
+
+    def _apply_header(self, chat: Chat, data: Dict[str, Any]) -> None:
+        for name in _HEADER_FIELDS:
+            if name not in data:
+                continue
+            value = data[name]
+            if name in _JSON_FIELDS:
+                value = json.dumps(list(value or []), ensure_ascii=False)
+            setattr(chat, name, value)
+
+    def update_header(self, user_id: Any, chat_id: str, **fields: Any) -> Optional[Dict[str, Any]]:
+        """Actualiza solo campos de la cabecera; devuelve la cabecera o None si el chat no existe."""
+        chat = self._chat(user_id, chat_id)
+        if chat is None:
+            return None
+        self._apply_header(chat, fields)
+        if db.session.is_modified(chat):
+            chat.updated_at = datetime.now()
+            self._changed(chat_id)
+        self._commit()
+        return self._header(chat)
+
+    def delete(self, user_id: Any, chat_id: str) -> bool:
+        chat = self._chat(user_id, chat_id)
+        if chat is None:
+            return False
+        Message.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+        db.session.delete(chat)
+        db.session.commit()
+        return True
+
+    def delete_user_chats(self, user_id: Any, *, commit: bool = True) -> int:
+        """Borra todos los chats del usuario; con ``commit=False`` el borrado queda en la transacción en curso."""
+        chat_ids = [chat_id for (chat_id,) in db.session.query(Chat.id).filter_by(user_id=user_id)]
+        if chat_ids:
+            Message.query.filter(Message.chat_id.in_(chat_ids)).delete(synchronize_session=False)
+            Chat.query.filter(Chat.id.in_(chat_ids)).delete(synchronize_session=False)
+            if commit:
+                db.session.commit()
+        return len(chat_ids)
+
+    def chat_ids(self) -> Iterator[Tuple[Any, str]]:
+        """Pares ``(user_id, chat_id)`` de todos los chats."""
+        yield from db.session.query(Chat.user_id, Chat.id).all()
+
+    def import_json_file(self, path: str) -> bool:
+        """Incorpora un JSON antiguo ``<user_id>_<chat_id>.json``; False si el chat ya existía."""
+        user_id, chat_id = os.path.basename(path)[:-len('.json')].split('_', 1)
+        if self._load(chat_id) is not None:
+            return False
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            data = {}
+        timestamp = None
+        if data.get('timestamp'):
+            try:
+                timestamp = datetime.fromisoformat(data['timestamp'])
+            except (TypeError, ValueError):
+                timestamp = None
+        data['messages'] = data.get('messages') or []
+        self.save(int(user_id) if user_id.isdigit() else user_id, chat_id, data,
+                  timestamp=timestamp or datetime.fromtimestamp(os.path.getmtime(path)))
+        return True
+
+
+class BufferedChatRepository(ChatRepository):
+    """Repositorio de una petición: lee cada chat una vez y escribe al final.
+
+    Las cabeceras quedan en el mapa de identidad de la sesión de SQLAlchemy,
+    que ya sabe qué columnas cambiaron (asignar el mismo valor no cuenta).
+    Los mensajes leídos se guardan en memoria; guardar la misma lista no
+    escribe nada y una lista distinta queda pendiente hasta :meth:`flush`,
+    que calcula sin consultar cuántos mensajes guardados se conservan.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._chats: Dict[str, Optional[Chat]] = {}
+        self._stored: Dict[str, List[Dict[str, Any]]] = {}
+        self._messages: Dict[str, List[Dict[str, Any]]] = {}
+        self._pending: Dict[str, datetime] = {}
+        self._dirty: Set[str] = set()
+
+    def _load(self, chat_id: str) -> Optional[Chat]:
+        if chat_id not in self._chats:
+            self._chats[chat_id] = super()._load(chat_id)
+        return self._chats[chat_id]
+
+    def _remember(self, chat: Chat) -> None:
+        self._chats[chat.id] = chat
+        self._stored.setdefault(chat.id, [])
+        self._messages.setdefault(chat.id, [])
+
+    def _changed(self, chat_id: str) -> None:
+        self._dirty.add(chat_id)
+
+    def _commit(self) -> None:
+        # Se confirma una sola vez, en ``flush``
+        pass
+
+    def messages(self, chat_id: str) -> List[Dict[str, Any]]:
+        if chat_id not in self._messages:
+            messages = super().messages(chat_id)
+            self._stored[chat_id] = messages
+            self._messages[chat_id] = copy.deepcopy(messages)
+        # Copia: quien llama suele añadir mensajes a la lista antes de guardarla
+        return copy.deepcopy(self._messages[chat_id])
+
+    def message_count(self, chat_id: str) -> int:
+        if chat_id in self._messages:
+            return len(self._messages[chat_id])
+        return super().message_count(chat_id)
+
+    def _stage_messages(self, chat_id: str, messages: List[Dict[str, Any]], now: datetime) -> bool:
+        if self._messages.get(chat_id) == messages:
+            return False
+        self._messages[chat_id] = copy.deepcopy(messages)
+        self._pending[chat_id] = now
+        return True
+
+    def _write_pending(self) -> None:
+        for chat_id, now in self._pending.items():
+            messages = self._messages[chat_id]
+            stored = self._stored.get(chat_id)
+            if stored is None:
+                written = self._sync_messages(chat_id, messages, now)
+            elif messages[:len(stored)] == stored:
+                # Solo se añadieron mensajes: basta insertarlos
+                self._insert_messages(chat_id, messages[len(stored):], now)
+                written = len(messages) - len(stored)
+            else:
+                keep = next((index for index, (old, new) in enumerate(zip(stored, messages)) if old != new), len(messages))
+                written = self._sync_messages(chat_id, messages, now, keep=keep)
+            self.counters['message_writes'] += written
+            self._stored[chat_id] = copy.deepcopy(messages)
+        self._pending.clear()
+
+    def list_chats(self, user_id: Any) -> List[Dict[str, Any]]:
+        # Las vistas previas dependen de los mensajes pendientes
+        self._write_pending()
+        return super().list_chats(user_id)
+
+    def delete(self, user_id: Any, chat_id: str) -> bool:
+        deleted = super().delete(user_id, chat_id)
+        for cache in (self._chats, self._stored, self._messages, self._pending):
+            cache.pop(chat_id, None)
+        self._dirty.discard(chat_id)
+        return deleted
+
+    def flush(self) -> bool:
+        """Escribe los cambios pendientes con una sola confirmación; False si no había ninguno."""
+        if not self._dirty:
+            return False
+        self._write_pending()
+        self.counters['chat_writes'] += len(self._dirty)
+        db.session.commit()
+        self._dirty.clear()
+        return True
+
+    def discard(self) -> None:
+        """Descarta los cambios pendientes (la petición terminó con error)."""
+        db.session.rollback()
+        self._chats.clear()
+        self._stored.clear()
+        self._messages.clear()
+        self._pending.clear()
+        self._dirty.clear()
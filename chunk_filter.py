@@ -0,0 +1,124 @@
+"""Filtro de fragmentos previo a la generación de embeddings.
+
+``RecursiveCharacterTextSplitter`` produce fragmentos que no merece la pena
+vectorizar: cabeceras y pies repetidos, restos de tablas sin texto y los
+marcadores ``[ERROR EN PROCESAMIENTO DE IMAGEN ...]`` del OCR. Este módulo:
+
+- Agrupa duplicados exactos y normalizados (mayúsculas, espacios, puntuación)
+  en un único fragmento; los demás quedan referenciados en sus metadatos
+  (``duplicate_refs``) y ``occurrences`` cuenta todas las apariciones.
+- Descarta fragmentos por debajo de un umbral de información (caracteres
+  alfanuméricos, proporción de texto y palabras distintas).
+- Descarta siempre los marcadores de error de OCR.
+- Devuelve estadísticas con los embeddings ahorrados.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Tuple
+
+ERROR_PLACEHOLDER_PREFIXES = ("[ERROR EN PROCESAMIENTO DE IMAGEN",)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_WHITESPACE_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"\w{2,}", re.UNICODE)
+
+
+@dataclass
+class ChunkFilterStats:
+    """Resultado del filtrado de un documento."""
+
+    total: int = 0
+    kept: int = 0
+    duplicates: int = 0
+    low_information: int = 0
+    error_placeholders: int = 0
+
+    @property
+    def embeddings_saved(self) -> int:
+        return self.total - self.kept
+
+    def as_dict(self) -> Dict[str, int]:
+        data = asdict(self)
+        data["embeddings_saved"] = self.embeddings_saved
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ChunkFilterStats":
+        """Inverso de ``as_dict`` (ignora ``embeddings_saved`` y claves desconocidas)."""
+        return cls(**{name: int(data[name]) for name in cls.__dataclass_fields__ if name in data})
+
+
+def normalize_text(text: str) -> str:
+    """Forma canónica usada para detectar duplicados normalizados."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _PUNCTUATION_RE.sub(" ", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def is_error_placeholder(text: str) -> bool:
+    return text.lstrip().startswith(ERROR_PLACEHOLDER_PREFIXES)
+
+
+def is_low_information(text: str, min_chars: int = 20, min_alnum_ratio: float = 0.3, min_words: int = 3) -> bool:
+    """Indica si el fragmento no aporta texto suficiente para ser recuperable."""
+    stripped = "".join(text.split())
+    alnum = sum(1 for char in stripped if char.isalnum())
+    if alnum < min_chars:
+        return True
+    if stripped and alnum / len(stripped) < min_alnum_ratio:
+        return True
+    return len(set(_WORD_RE.findall(text.casefold()))) < min_words
+
+
+def _chunk_ref(index: int, metadata: Dict[str, Any]) -> Dict[str, Any]:
+    ref: Dict[str, Any] = {"chunk_index": index}
+    if metadata.get("page") is not None:
+        ref["page"] = metadata["page"]
+    return ref
+
+
+def filter_chunks(chunks: List[Any], min_chars: int = 20, min_alnum_ratio: float = 0.3,
+                  min_words: int = 3) -> Tuple[List[Any], ChunkFilterStats]:
+    """Filtra fragmentos (``Document`` de LangChain) antes de vectorizarlos.
+
+    Conserva el orden original. Si todos los fragmentos con contenido quedaran
+    por debajo del umbral de información se conservan igualmente (sin
+    duplicados), para no rechazar documentos breves.
+    """
+    stats = ChunkFilterStats(total=len(chunks))
+    unique: List[Any] = []
+    informative: List[Any] = []
+    by_key: Dict[str, Any] = {}
+
+    for index, chunk in enumerate(chunks):
+        text = chunk.page_content or ""
+        if not text.strip():
+            stats.low_information += 1
+            continue
+        if is_error_placeholder(text):
+            stats.error_placeholders += 1
+            continue
+
+        key = normalize_text(text)
+        first = by_key.get(key)
+        if first is not None:
+            first.metadata.setdefault("duplicate_refs", []).append(_chunk_ref(index, chunk.metadata))
+            first.metadata["occurrences"] = first.metadata.get("occurrences", 1) + 1
+            stats.duplicates += 1
+            continue
+        by_key[key] = chunk
+        unique.append(chunk)
+        if not is_low_information(text, min_chars, min_alnum_ratio, min_words):
+            informative.append(chunk)
+
+    if informative:
+        stats.low_information += len(unique) - len(informative)
+        kept = informative
+    else:
+        kept = unique
+
+    stats.kept = len(kept)
+    return kept, stats
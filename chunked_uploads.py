@@ -0,0 +1,252 @@
+"""Subidas por partes reanudables y hash calculado durante la escritura.
+
+La subida guardaba el archivo completo de la petición y después lo volvía a
+leer entero para calcular su hash; el tamaño máximo quedaba limitado por
+``MAX_CONTENT_LENGTH``. Aquí los datos se escriben a disco por bloques y los
+hashes (MD5, que identifica el archivo en la aplicación, y SHA-256, que el
+navegador puede calcular con ``crypto.subtle``) se actualizan con cada bloque.
+
+Una sesión de subida vive en su carpeta:
+
+    <root>/<upload_id>/
+        meta.json    usuario, nombre, tamaño declarado, SHA-256 anunciado y opciones
+        data.part    bytes recibidos hasta ahora
+
+El cliente envía partes consecutivas con su ``offset``; el tamaño de
+``data.part`` es la única fuente de verdad, así que tras un corte basta con
+consultar la sesión y seguir desde ese punto. Los hashes en curso se guardan en
+memoria del proceso; si la parte siguiente llega a otro proceso (o tras un
+reinicio) se recalculan leyendo ``data.part`` una vez.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+META_FILE = "meta.json"
+PART_FILE = "data.part"
+BLOCK_SIZE = 1024 * 1024
+
+
+class UploadSessionError(ValueError):
+    """Sesión inexistente, de otro usuario, o datos que no cuadran con lo declarado."""
+
+
+class UploadSessionNotFound(UploadSessionError):
+    """La sesión no existe (o caducó) o es de otro usuario."""
+
+
+class UploadOffsetError(UploadSessionError):
+    """La parte no empieza donde termina lo recibido; ``offset`` indica dónde seguir."""
+
+    def __init__(self, message: str, offset: int):
+        super().__init__(message)
+        self.offset = offset
+
+
+@dataclass
+class StreamedFile:
+    """Resultado de escribir un flujo a disco: tamaño y hashes del contenido."""
+
+    size: int
+    md5: str
+    sha256: str
+
+
+@dataclass
+class UploadSession:
+    upload_id: str
+    user_id: str
+    filename: str
+    size: int
+    received: int
+    sha256: Optional[str] = None
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        return self.received >= self.size
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "offset": self.received,
+            "complete": self.complete,
+        }
+
+
+def _copy_stream(source: BinaryIO, target: BinaryIO, digests: Tuple[Any, ...], *, limit: Optional[int],
+                 block_size: int = BLOCK_SIZE) -> int:
+    """Copia ``source`` en ``target`` actualizando ``digests``; falla si se superan ``limit`` bytes."""
+    written = 0
+    for block in iter(lambda: source.read(block_size), b""):
+        written += len(block)
+        if limit is not None and written > limit:
+            raise UploadSessionError("El archivo supera el tamaño máximo permitido")
+        target.write(block)
+        for digest in digests:
+            digest.update(block)
+    return written
+
+
+def write_stream(source: BinaryIO, path: str, *, max_size: Optional[int] = None,
+                 block_size: int = BLOCK_SIZE) -> StreamedFile:
+    """Escribe ``source`` en ``path`` por bloques y devuelve tamaño, MD5 y SHA-256."""
+    md5, sha256 = hashlib.md5(), hashlib.sha256()
+    try:
+        with open(path, "wb") as target:
+            size = _copy_stream(source, target, (md5, sha256), limit=max_size, block_size=block_size)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return StreamedFile(size, md5.hexdigest(), sha256.hexdigest())
+
+
+class ChunkedUploadStore:
+    """Sesiones de subida por partes en ``root`` (mismo disco que el destino, para mover sin copiar)."""
+
+    def __init__(self, root: str, *, max_size: int, ttl: float = 86400.0):
+        self.root = root
+        self.max_size = int(max_size)
+        self.ttl = float(ttl)
+        self._lock = Lock()
+        self._session_locks: Dict[str, Lock] = {}
+        self._digests: Dict[str, Tuple[int, Any, Any]] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, upload_id: str) -> str:
+        if not upload_id or os.sep in upload_id or upload_id.startswith("."):
+            raise UploadSessionNotFound("Sesión de subida no encontrada")
+        return os.path.join(self.root, upload_id)
+
+    def _session_lock(self, upload_id: str) -> Lock:
+        # Un cerrojo por sesión: una parte lenta no bloquea las subidas de otros usuarios
+        with self._lock:
+            return self._session_locks.setdefault(upload_id, Lock())
+
+    def _write_meta(self, session: UploadSession) -> None:
+        path = os.path.join(self._dir(session.upload_id), META_FILE)
+        meta = {
+            "user_id": session.user_id,
+            "filename": session.filename,
+            "size": session.size,
+            "sha256": session.sha256,
+            "options": session.options,
+        }
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as handle:
+            json.dump(meta, handle, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def create(self, user_id: Any, filename: str, size: int, *, sha256: Optional[str] = None,
+               options: Optional[Dict[str, Any]] = None) -> UploadSession:
+        if size < 0:
+            raise UploadSessionError("Tamaño de archivo no válido")
+        if size > self.max_size:
+            raise UploadSessionError("El archivo supera el tamaño máximo permitido")
+        self.evict_expired()
+        session = UploadSession(uuid.uuid4().hex, str(user_id), filename, int(size), 0,
+                                sha256=sha256.lower() if sha256 else None, options=dict(options or {}))
+        os.makedirs(self._dir(session.upload_id))
+        open(os.path.join(self._dir(session.upload_id), PART_FILE), "wb").close()
+        self._write_meta(session)
+        return session
+
+    def get(self, upload_id: str, user_id: Any) -> UploadSession:
+        directory = self._dir(upload_id)
+        try:
+            with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as handle:
+                meta = json.load(handle)
+            received = os.path.getsize(os.path.join(directory, PART_FILE))
+        except (OSError, ValueError):
+            raise UploadSessionNotFound("Sesión de subida no encontrada") from None
+        if meta["user_id"] != str(user_id):
+            raise UploadSessionNotFound("Sesión de subida no encontrada")
+        return UploadSession(upload_id, meta["user_id"], meta["filename"], meta["size"], received,
+                             sha256=meta.get("sha256"), options=meta.get("options") or {})
+
+    def _resume_digests(self, session: UploadSession) -> Tuple[Any, Any]:
+        cached = self._digests.get(session.upload_id)
+        if cached is not None and cached[0] == session.received:
+            return cached[1], cached[2]
+        # Otro proceso recibió las partes anteriores: rehacer los hashes desde disco
+        md5, sha256 = hashlib.md5(), hashlib.sha256()
+        with open(os.path.join(self._dir(session.upload_id), PART_FILE), "rb") as handle:
+            for block in iter(lambda: handle.read(BLOCK_SIZE), b""):
+                md5.update(block)
+                sha256.update(block)
+        return md5, sha256
+
+    def append(self, upload_id: str, user_id: Any, offset: int, source: BinaryIO) -> UploadSession:
+        """Añade la parte ``source`` que empieza en ``offset`` y devuelve la sesión actualizada."""
+        with self._session_lock(upload_id):
+            session = self.get(upload_id, user_id)
+            if offset != session.received:
+                raise UploadOffsetError(
+                    f"La parte empieza en {offset} pero se han recibido {session.received} bytes", session.received
+                )
+            md5, sha256 = self._resume_digests(session)
+            part_path = os.path.join(self._dir(upload_id), PART_FILE)
+            with open(part_path, "ab") as target:
+                try:
+                    written = _copy_stream(source, target, (md5, sha256), limit=session.size - session.received)
+                except BaseException:
+                    # Descartar la parte incompleta: el cliente la reenvía desde ``received``
+                    target.flush()
+                    target.truncate(session.received)
+                    self._digests.pop(upload_id, None)
+                    raise
+            session.received += written
+            self._digests[upload_id] = (session.received, md5, sha256)
+            return session
+
+    def finish(self, upload_id: str, user_id: Any, target_path: str) -> StreamedFile:
+        """Mueve el archivo completo a ``target_path`` y devuelve sus hashes."""
+        with self._session_lock(upload_id):
+            session = self.get(upload_id, user_id)
+            if not session.complete:
+                raise UploadOffsetError(
+                    f"Faltan {session.size - session.received} bytes por recibir", session.received
+                )
+            md5, sha256 = self._resume_digests(session)
+            result = StreamedFile(session.size, md5.hexdigest(), sha256.hexdigest())
+            if session.sha256 and session.sha256 != result.sha256:
+                self.discard(upload_id)
+                raise UploadSessionError("El contenido recibido no coincide con el hash anunciado")
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(os.path.join(self._dir(upload_id), PART_FILE), target_path)
+            self.discard(upload_id)
+            return result
+
+    def discard(self, upload_id: str) -> None:
+        self._digests.pop(upload_id, None)
+        with self._lock:
+            self._session_locks.pop(upload_id, None)
+        shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+
+    def evict_expired(self) -> int:
+        """Borra las sesiones sin actividad en ``ttl`` segundos y devuelve cuántas se borraron."""
+        cutoff = time.time() - self.ttl
+        evicted = 0
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            part_path = os.path.join(directory, PART_FILE)
+            try:
+                last_activity = os.path.getmtime(part_path if os.path.exists(part_path) else directory)
+            except OSError:
+                continue
+            if last_activity >= cutoff:
+                continue
+            self.discard(name)
+            evicted += 1
+        return evicted
@@ -0,0 +1,488 @@
+"""Formato en disco de las bases vectoriales FAISS sin pickle.
+
+``FAISS.save_local`` guarda ``index.faiss`` y un ``index.pkl`` con el docstore
+completo, que hay que deserializar entero (y con ``allow_dangerous_deserialization``)
+en cada carga. Este módulo guarda cada base como:
+
+- ``index.faiss``: índice FAISS escrito con ``faiss.write_index``. En modo
+  lectura se abre mapeado en memoria, de modo que varios procesos comparten las
+  páginas a través de la caché del sistema operativo.
+- ``docstore.sqlite3``: texto y metadatos (JSON) de cada fragmento, indexados por
+  posición en el índice y por id. En modo lectura solo se leen los fragmentos
+  devueltos por cada búsqueda.
+
+Las bases antiguas (``index.pkl``) se siguen pudiendo abrir y se convierten al
+guardarlas de nuevo o con :func:`convert_legacy_store`.
+
+Las bases grandes llevan además ``index.ann.faiss``, un índice aproximado
+derivado del plano (ver ``index_factory``) que se usa para las búsquedas.
+
+Cada base puede tener además segmentos delta inmutables en ``segments/<seq>/``
+(mismo formato). Las subidas escriben un segmento nuevo en lugar de reescribir
+la base; :func:`compact_segments` los fusiona con la base principal.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from collections.abc import Mapping
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from index_factory import IndexPolicy, RefinedIndex, apply_search_parameters, build_ann_index, flat_vectors
+
+INDEX_FILE = "index.faiss"
+ANN_INDEX_FILE = "index.ann.faiss"
+DOCSTORE_FILE = "docstore.sqlite3"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+
+# Conjuntos de ficheros que forman una base completa, del formato actual al antiguo
+STORE_LAYOUTS: Tuple[Tuple[str, ...], ...] = (
+    (INDEX_FILE, DOCSTORE_FILE),
+    (INDEX_FILE, LEGACY_DOCSTORE_FILE),
+)
+
+FORMAT_VERSION = "1"
+
+# save_store sustituye el docstore y el índice por separado: un lector puede
+# emparejar un docstore nuevo con el índice anterior. El docstore guarda el
+# ``ntotal`` de su índice y load_store reintenta mientras no coincidan.
+LOAD_ATTEMPTS = 5
+LOAD_RETRY_SECONDS = 0.05
+
+SEGMENTS_DIR = "segments"
+# Temporales de segmentos abandonados (proceso interrumpido) que se pueden borrar
+STALE_SEGMENT_SECONDS = 3600
+
+# Política de índices aproximados; la aplicación la fija al arrancar con set_index_policy
+_index_policy = IndexPolicy()
+
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+_SCHEMA = """
+CREATE TABLE docs (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def set_index_policy(policy: IndexPolicy) -> None:
+    global _index_policy
+    _index_policy = policy
+
+
+def get_index_policy() -> IndexPolicy:
+    return _index_policy
+
+
+def store_layout(path: str) -> Optional[Tuple[str, ...]]:
+    """Devuelve los ficheros de la base de ``path`` o None si está incompleta."""
+    for layout in STORE_LAYOUTS:
+        if all(os.path.exists(os.path.join(path, name)) for name in layout):
+            return layout
+    return None
+
+
+def has_store(path: str) -> bool:
+    return store_layout(path) is not None
+
+
+def is_legacy_store(path: str) -> bool:
+    return store_layout(path) == STORE_LAYOUTS[1]
+
+
+def _connect_read_only(path: str) -> sqlite3.Connection:
+    uri = "file:" + os.path.abspath(path).replace("?", "%3f").replace("#", "%23") + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+def _row_to_document(doc_id: str, page_content: str, metadata: str) -> Document:
+    return Document(id=doc_id, page_content=page_content, metadata=json.loads(metadata))
+
+
+class SQLiteDocstore(Docstore):
+    """Docstore de solo lectura que consulta ``docstore.sqlite3`` bajo demanda."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = _connect_read_only(path)
+        self._lock = Lock()
+
+    def _fetchone(self, query: str, params: Tuple[Any, ...]) -> Optional[Tuple[Any, ...]]:
+        with self._lock:
+            return self._connection.execute(query, params).fetchone()
+
+    def search(self, search: str) -> Document | str:
+        row = self._fetchone("SELECT id, page_content, metadata FROM docs WHERE id = ?", (search,))
+        if row is None:
+            return f"ID {search} not found."
+        return _row_to_document(*row)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        raise NotImplementedError("Docstore de solo lectura: cargue la base con writable=True")
+
+    def delete(self, ids: List) -> None:
+        raise NotImplementedError("Docstore de solo lectura: cargue la base con writable=True")
+
+    def __len__(self) -> int:
+        row = self._fetchone("SELECT COUNT(*) FROM docs", ())
+        return int(row[0]) if row else 0
+
+    def id_at(self, position: int) -> Optional[str]:
+        row = self._fetchone("SELECT id FROM docs WHERE position = ?", (int(position),))
+        return row[0] if row else None
+
+    def positions(self) -> List[int]:
+        with self._lock:
+            return [row[0] for row in self._connection.execute("SELECT position FROM docs ORDER BY position")]
+
+    def iter_documents(self) -> Iterator[Tuple[int, Document]]:
+        """Recorre todos los fragmentos por posición (para cargas escribibles y migraciones)."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT position, id, page_content, metadata FROM docs ORDER BY position"
+            ).fetchall()
+        for position, doc_id, page_content, metadata in rows:
+            yield position, _row_to_document(doc_id, page_content, metadata)
+
+    def meta(self) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._connection.execute("SELECT key, value FROM meta").fetchall())
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class LazyIndexToDocstoreId(Mapping):
+    """``index_to_docstore_id`` respaldado por el docstore SQLite en lugar de un dict."""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self._docstore = docstore
+        self._length = len(docstore)
+
+    def __getitem__(self, position: int) -> str:
+        doc_id = self._docstore.id_at(position)
+        if doc_id is None:
+            raise KeyError(position)
+        return doc_id
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._docstore.positions())
+
+    def __len__(self) -> int:
+        return self._length
+
+
+class StoreMismatchError(RuntimeError):
+    """El docstore y el índice de una base son de versiones distintas."""
+
+
+def _open_consistent(path: str, writable: bool) -> Tuple[Any, SQLiteDocstore, Dict[str, str]]:
+    """Abre el índice y después el docstore, y comprueba que son de la misma versión.
+
+    save_store publica primero el docstore y después el índice, así que la única
+    pareja posible de versiones distintas es índice antiguo con docstore nuevo:
+    se detecta por ``ntotal`` y se vuelve a abrir. Las bases guardadas antes de
+    que el docstore registrara ``ntotal`` no se comprueban.
+    """
+    index_path = os.path.join(path, INDEX_FILE)
+    docstore_path = os.path.join(path, DOCSTORE_FILE)
+    for attempt in range(LOAD_ATTEMPTS):
+        index = faiss.read_index(index_path) if writable else faiss.read_index(index_path, _MMAP_FLAGS)
+        docstore = SQLiteDocstore(docstore_path)
+        meta = docstore.meta()
+        expected = meta.get("ntotal")
+        if expected is None or int(expected) == index.ntotal:
+            return index, docstore, meta
+        docstore.close()
+        time.sleep(LOAD_RETRY_SECONDS * (attempt + 1))
+    raise StoreMismatchError(f"El docstore y el índice de {path} no coinciden")
+
+
+def _faiss_kwargs(meta: Dict[str, str]) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {"normalize_L2": meta.get("normalize_L2") == "1"}
+    if meta.get("distance_strategy"):
+        kwargs["distance_strategy"] = meta["distance_strategy"]
+    return kwargs
+
+
+def load_store(path: str, embeddings: Any, *, writable: bool = False) -> FAISS:
+    """Abre la base de ``path``.
+
+    - ``writable=False``: índice mapeado en memoria y docstore perezoso; la base
+      solo admite búsquedas y puede compartirse entre hilos.
+    - ``writable=True``: índice y docstore en memoria, aptos para ``merge_from``,
+      ``add_embeddings`` o ``delete`` y para guardarse con :func:`save_store`.
+
+    Las bases en formato antiguo se abren con ``FAISS.load_local``.
+    """
+    layout = store_layout(path)
+    if layout is None:
+        raise FileNotFoundError(f"No hay una base vectorial completa en {path}")
+    if layout == STORE_LAYOUTS[1]:
+        return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+
+    if not writable:
+        index, docstore, meta = _open_consistent(path, writable=False)
+        index = _with_ann_index(path, index)
+        return FAISS(embeddings, index, docstore, LazyIndexToDocstoreId(docstore), **_faiss_kwargs(meta))
+
+    index, reader, meta = _open_consistent(path, writable=True)
+    try:
+        documents = {}
+        index_to_docstore_id = {}
+        for position, document in reader.iter_documents():
+            documents[document.id] = document
+            index_to_docstore_id[position] = document.id
+    finally:
+        reader.close()
+    return FAISS(embeddings, index, InMemoryDocstore(documents), index_to_docstore_id, **_faiss_kwargs(meta))
+
+
+def _with_ann_index(path: str, flat_index: Any) -> Any:
+    """Envuelve el índice plano con el aproximado de la base si existe y está al día."""
+    ann_path = os.path.join(path, ANN_INDEX_FILE)
+    if not os.path.exists(ann_path) or _index_policy.mode == "flat":
+        return flat_index
+    try:
+        ann_index = faiss.read_index(ann_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        ann_index = faiss.read_index(ann_path)
+    if ann_index.ntotal != flat_index.ntotal:
+        # Índice aproximado de otra versión de la base: se busca en el plano
+        return flat_index
+    apply_search_parameters(ann_index, _index_policy)
+    return RefinedIndex(ann_index, flat_index, _index_policy.refine_factor)
+
+
+def _ann_spec(vectorstore: FAISS) -> Optional[str]:
+    index = vectorstore.index
+    if getattr(index, "metric_type", None) != faiss.METRIC_L2 or not isinstance(index, faiss.IndexFlat):
+        return None
+    return _index_policy.spec_for(index.ntotal, index.d)
+
+
+def _write_docstore(vectorstore: FAISS, target: str) -> None:
+    if os.path.exists(target):
+        os.remove(target)
+    connection = sqlite3.connect(target)
+    try:
+        connection.executescript(_SCHEMA)
+        rows = []
+        for position, doc_id in sorted(vectorstore.index_to_docstore_id.items()):
+            document = vectorstore.docstore.search(doc_id)
+            if not isinstance(document, Document):
+                raise ValueError(f"El docstore no contiene el documento {doc_id}")
+            rows.append((
+                int(position),
+                str(doc_id),
+                document.page_content,
+                json.dumps(document.metadata or {}, ensure_ascii=False, default=str),
+            ))
+        connection.executemany("INSERT INTO docs (position, id, page_content, metadata) VALUES (?, ?, ?, ?)", rows)
+        distance_strategy = getattr(vectorstore, "distance_strategy", None)
+        connection.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?)",
+            [
+                ("format_version", FORMAT_VERSION),
+                ("ntotal", str(vectorstore.index.ntotal)),
+                ("normalize_L2", "1" if getattr(vectorstore, "_normalize_L2", False) else "0"),
+                ("distance_strategy", str(getattr(distance_strategy, "value", distance_strategy or ""))),
+            ],
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def save_store(vectorstore: FAISS, path: str) -> None:
+    """Guarda ``vectorstore`` en ``path`` con el formato mapeable.
+
+    Cada fichero se escribe en un temporal y se sustituye con ``os.replace``: los
+    lectores que ya tienen abierta la versión anterior siguen usándola. El
+    docstore se publica antes que el índice (ver :func:`_open_consistent`). Elimina el
+    ``index.pkl`` antiguo si existía.
+
+    Si la política de índices lo pide por tamaño, construye también el índice
+    aproximado derivado; si ya no procede, lo elimina.
+    """
+    os.makedirs(path, exist_ok=True)
+    docstore_tmp = os.path.join(path, DOCSTORE_FILE + ".tmp")
+    index_tmp = os.path.join(path, INDEX_FILE + ".tmp")
+    ann_tmp = os.path.join(path, ANN_INDEX_FILE + ".tmp")
+    ann_path = os.path.join(path, ANN_INDEX_FILE)
+    spec = _ann_spec(vectorstore)
+    try:
+        _write_docstore(vectorstore, docstore_tmp)
+        faiss.write_index(vectorstore.index, index_tmp)
+        if spec:
+            faiss.write_index(build_ann_index(flat_vectors(vectorstore.index), spec, _index_policy), ann_tmp)
+        os.replace(docstore_tmp, os.path.join(path, DOCSTORE_FILE))
+        if spec:
+            os.replace(ann_tmp, ann_path)
+        elif os.path.exists(ann_path):
+            os.remove(ann_path)
+        os.replace(index_tmp, os.path.join(path, INDEX_FILE))
+    finally:
+        for leftover in (docstore_tmp, index_tmp, ann_tmp):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+    legacy_path = os.path.join(path, LEGACY_DOCSTORE_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+
+def convert_legacy_store(path: str, embeddings: Any) -> bool:
+    """Reescribe una base ``index.pkl`` en el formato actual. Devuelve True si la convirtió."""
+    if not is_legacy_store(path):
+        return False
+    vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    save_store(vectorstore, path)
+    return True
+
+
+def iter_store_paths(root: str) -> Iterator[str]:
+    """Recorre las carpetas bajo ``root`` que contienen una base vectorial (segmentos incluidos)."""
+    for current, _dirs, files in os.walk(root):
+        if INDEX_FILE in files and has_store(current):
+            yield current
+
+
+def segment_paths(path: str) -> List[str]:
+    """Segmentos delta completos de la base de ``path``, del más antiguo al más reciente."""
+    segments_root = os.path.join(path, SEGMENTS_DIR)
+    try:
+        names = sorted(os.listdir(segments_root))
+    except FileNotFoundError:
+        return []
+    paths = []
+    for name in names:
+        if name.startswith("."):
+            continue
+        segment = os.path.join(segments_root, name)
+        if has_store(segment):
+            paths.append(segment)
+    return paths
+
+
+def store_components(path: str) -> List[str]:
+    """Base principal (si existe) seguida de sus segmentos delta."""
+    components = [path] if has_store(path) else []
+    return components + segment_paths(path)
+
+
+def has_components(path: str) -> bool:
+    return bool(store_components(path))
+
+
+def write_segment(vectorstore: FAISS, path: str) -> str:
+    """Guarda ``vectorstore`` como segmento delta nuevo de la base ``path`` y devuelve su ruta.
+
+    El segmento se escribe en una carpeta temporal oculta y se publica con un
+    ``os.replace`` del directorio completo, por lo que nunca se ve a medias.
+    """
+    segments_root = os.path.join(path, SEGMENTS_DIR)
+    os.makedirs(segments_root, exist_ok=True)
+    name = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+    tmp_path = os.path.join(segments_root, f".{name}.tmp")
+    final_path = os.path.join(segments_root, name)
+    try:
+        save_store(vectorstore, tmp_path)
+        os.replace(tmp_path, final_path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    return final_path
+
+
+def _remove_stale_segment_tmp(path: str) -> None:
+    segments_root = os.path.join(path, SEGMENTS_DIR)
+    try:
+        names = os.listdir(segments_root)
+    except FileNotFoundError:
+        return
+    now = time.time()
+    for name in names:
+        leftover = os.path.join(segments_root, name)
+        if name.startswith(".") and now - os.path.getmtime(leftover) > STALE_SEGMENT_SECONDS:
+            shutil.rmtree(leftover, ignore_errors=True)
+
+
+def _remove_half_removed_segments(path: str) -> None:
+    """Borra las carpetas de segmento visibles e incompletas.
+
+    write_segment publica cada segmento completo, así que una carpeta visible a
+    la que le faltan ficheros es el resto de un borrado interrumpido tras
+    compactar: su contenido ya está en la base.
+    """
+    segments_root = os.path.join(path, SEGMENTS_DIR)
+    try:
+        names = os.listdir(segments_root)
+    except FileNotFoundError:
+        return
+    for name in names:
+        segment = os.path.join(segments_root, name)
+        if not name.startswith(".") and os.path.isdir(segment) and not has_store(segment):
+            shutil.rmtree(segment, ignore_errors=True)
+
+
+def _merge_new_documents(base: FAISS, segment: FAISS) -> None:
+    """Añade a ``base`` los fragmentos de ``segment`` cuyo id aún no contiene."""
+    known = set(base.index_to_docstore_id.values())
+    duplicated = [doc_id for doc_id in segment.index_to_docstore_id.values() if doc_id in known]
+    if len(duplicated) == len(segment.index_to_docstore_id):
+        return
+    if duplicated:
+        segment.delete(duplicated)
+    base.merge_from(segment)
+
+
+def compact_segments(path: str, embeddings: Any, segments: Optional[List[str]] = None) -> int:
+    """Fusiona los segmentos delta con la base principal y los elimina.
+
+    Solo se tocan los segmentos listados al empezar (o ``segments``); los que se
+    publiquen mientras tanto quedan para la siguiente compactación. Entre el
+    guardado de la base y el borrado de los segmentos un mismo fragmento puede
+    aparecer dos veces, por lo que las búsquedas deben deduplicar por id. Si una
+    compactación se interrumpe en ese punto, la siguiente omite los fragmentos
+    que la base ya contiene. Devuelve el número de segmentos fusionados. El
+    llamante debe impedir compactaciones concurrentes de la misma base.
+    """
+    _remove_stale_segment_tmp(path)
+    _remove_half_removed_segments(path)
+    segments = [segment for segment in (segment_paths(path) if segments is None else segments) if has_store(segment)]
+    if not segments:
+        return 0
+
+    if has_store(path):
+        base = load_store(path, embeddings, writable=True)
+        pending = segments
+    else:
+        base = load_store(segments[0], embeddings, writable=True)
+        pending = segments[1:]
+    for segment in pending:
+        _merge_new_documents(base, load_store(segment, embeddings, writable=True))
+
+    save_store(base, path)
+    for segment in segments:
+        shutil.rmtree(segment, ignore_errors=True)
+    return len(segments)
@@ -0,0 +1,125 @@
+"""Artefactos vectoriales globales por archivo.
+
+Subir el mismo documento a otro chat repetía carga, OCR, troceado y
+embeddings. Tras procesar un archivo se guardan sus fragmentos y vectores como
+artefacto, con clave ``(file_hash, process_mode)``:
+
+    <root>/<file_hash>/<process_mode>/
+        index.faiss, docstore.sqlite3   formato de ``faiss_storage``
+        artifact.json                   huella del pipeline, estadísticas y firma MinHash
+
+Una subida posterior del mismo archivo recupera fragmentos (con sus ids) y
+vectores del artefacto y los añade al chat sin llamadas a Azure. La huella
+(despliegue de embeddings, troceado y filtro) debe coincidir; si el pipeline
+cambia, el artefacto se ignora y se sobrescribe con el nuevo resultado.
+"""
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from faiss_storage import has_store, load_store, save_store
+from index_factory import flat_vectors
+
+META_FILE = "artifact.json"
+
+
+@dataclass
+class FileArtifact:
+    """Fragmentos y vectores de un archivo ya procesado."""
+
+    file_hash: str
+    process_mode: str
+    chunks: List[Document]
+    vectors: np.ndarray
+    meta: Dict[str, Any]
+
+
+class FileArtifactStore:
+    """Almacén de artefactos en ``root`` para una huella de pipeline concreta."""
+
+    def __init__(self, root: str, embeddings: Any, fingerprint: Dict[str, Any]):
+        self.root = root
+        self.embeddings = embeddings
+        self.fingerprint = dict(fingerprint)
+
+    def path_for(self, file_hash: str, process_mode: str) -> str:
+        return os.path.join(self.root, file_hash, process_mode)
+
+    def read_meta(self, file_hash: str, process_mode: str) -> Optional[Dict[str, Any]]:
+        """Metadatos del artefacto (sin cargar vectores) o None si no existe o es de otro pipeline."""
+        path = self.path_for(file_hash, process_mode)
+        try:
+            with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as handle:
+                meta = json.load(handle)
+        except (FileNotFoundError, ValueError):
+            return None
+        if meta.get("fingerprint") != self.fingerprint or not has_store(path):
+            return None
+        return meta
+
+    def load(self, file_hash: str, process_mode: str) -> Optional[FileArtifact]:
+        """Devuelve el artefacto del archivo o None si no existe o es de otro pipeline."""
+        meta = self.read_meta(file_hash, process_mode)
+        if meta is None:
+            return None
+        path = self.path_for(file_hash, process_mode)
+
+        vectorstore = load_store(path, self.embeddings, writable=True)
+        positions = sorted(vectorstore.index_to_docstore_id)
+        chunks = []
+        for position in positions:
+            doc_id = vectorstore.index_to_docstore_id[position]
+            document = vectorstore.docstore.search(doc_id)
+            if not isinstance(document, Document):
+                return None
+            chunks.append(Document(id=str(doc_id), page_content=document.page_content, metadata=dict(document.metadata)))
+        vectors = flat_vectors(vectorstore.index)[positions]
+        return FileArtifact(file_hash, process_mode, chunks, vectors, meta)
+
+    def save(self, file_hash: str, process_mode: str, vectorstore: Any, stats: Optional[Dict[str, Any]] = None,
+             signature: Optional[List[int]] = None) -> str:
+        """Guarda la base ``vectorstore`` de un archivo como su artefacto.
+
+        ``signature`` es la firma MinHash del documento (ver ``near_duplicates``),
+        usada para encontrar revisiones del mismo documento.
+
+        Se escribe en una carpeta temporal y se publica con ``os.replace``; si
+        otro proceso publicó el mismo artefacto a la vez, se conserva el suyo.
+        """
+        path = self.path_for(file_hash, process_mode)
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = os.path.join(parent, f".{process_mode}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            save_store(vectorstore, tmp_path)
+            with open(os.path.join(tmp_path, META_FILE), "w", encoding="utf-8") as handle:
+                json.dump({
+                    "file_hash": file_hash,
+                    "process_mode": process_mode,
+                    "fingerprint": self.fingerprint,
+                    "chunks": vectorstore.index.ntotal,
+                    "stats": stats or {},
+                    "minhash": signature,
+                    "created_at": datetime.utcnow().isoformat(),
+                }, handle, ensure_ascii=False)
+            if os.path.isdir(path):
+                # Artefacto de otro pipeline (o de una carrera): se sustituye
+                shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                if not has_store(path):
+                    raise
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
@@ -0,0 +1,156 @@
+"""Selección del tipo de índice FAISS según el tamaño de la base.
+
+El índice plano (``IndexFlatL2``, float32) sigue siendo la fuente de verdad de
+cada base: admite ``merge_from`` y ``delete`` y se abre mapeado en memoria. A
+partir de cierto tamaño se construye además un índice aproximado derivado
+(``index.ann.faiss``) con las mismas posiciones, que es el que se usa para buscar:
+
+- menos de ``flat_max_vectors`` vectores: solo índice plano;
+- hasta ``ivf_min_vectors``: HNSW con almacenamiento SQ8 (int8) o SQfp16;
+- a partir de ahí: IVF-PQ.
+
+Los candidatos del índice aproximado se reordenan con la distancia exacta
+leída del índice plano (``refine_factor`` candidatos por resultado), de modo que
+las distancias siguen siendo comparables entre bases y segmentos.
+
+``mode`` admite ``auto`` (lo anterior), ``flat`` (nunca índice aproximado) o una
+cadena de ``faiss.index_factory`` que se aplica a partir de ``flat_max_vectors``.
+"""
+from __future__ import annotations
+
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+import faiss
+import numpy as np
+
+# Vectores usados como máximo para entrenar índices IVF/PQ
+MAX_TRAINING_VECTORS = 100_000
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass
+class IndexPolicy:
+    """Umbrales y parámetros del índice aproximado."""
+
+    mode: str = "auto"
+    flat_max_vectors: int = 50_000
+    ivf_min_vectors: int = 1_000_000
+    hnsw_m: int = 32
+    hnsw_storage: str = "SQ8"
+    ef_search: int = 64
+    nprobe: int = 16
+    refine_factor: int = 4
+
+    @classmethod
+    def from_env(cls) -> "IndexPolicy":
+        return cls(
+            mode=os.environ.get("VECTORSTORE_INDEX_MODE", "auto").strip() or "auto",
+            flat_max_vectors=max(1, _env_int("VECTORSTORE_FLAT_MAX_VECTORS", 50_000)),
+            ivf_min_vectors=max(1, _env_int("VECTORSTORE_IVF_MIN_VECTORS", 1_000_000)),
+            hnsw_storage=os.environ.get("VECTORSTORE_HNSW_STORAGE", "SQ8").strip() or "SQ8",
+            ef_search=max(1, _env_int("VECTORSTORE_EF_SEARCH", 64)),
+            nprobe=max(1, _env_int("VECTORSTORE_NPROBE", 16)),
+            refine_factor=max(1, _env_int("VECTORSTORE_REFINE_FACTOR", 4)),
+        )
+
+    def spec_for(self, ntotal: int, dim: int) -> Optional[str]:
+        """Cadena de ``index_factory`` del índice aproximado, o None si basta el plano."""
+        if self.mode == "flat" or ntotal < self.flat_max_vectors:
+            return None
+        if self.mode != "auto":
+            return self.mode
+        if ntotal < self.ivf_min_vectors:
+            storage = "" if self.hnsw_storage.lower() == "flat" else f"_{self.hnsw_storage}"
+            return f"HNSW{self.hnsw_m}{storage}"
+        nlist = max(1, int(4 * math.sqrt(ntotal)))
+        return f"IVF{nlist},PQ{pq_subquantizers(dim)}x8"
+
+
+def pq_subquantizers(dim: int, dims_per_subquantizer: int = 16) -> int:
+    """Mayor número de subcuantizadores que divide ``dim`` con ~16 dimensiones cada uno."""
+    target = max(1, dim // dims_per_subquantizer)
+    for m in range(target, 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def apply_search_parameters(index: Any, policy: IndexPolicy) -> None:
+    """Fija ``efSearch``/``nprobe`` según la política en un índice ya cargado."""
+    space = faiss.ParameterSpace()
+    for name, value in (("efSearch", policy.ef_search), ("nprobe", policy.nprobe)):
+        try:
+            space.set_index_parameter(index, name, value)
+        except RuntimeError:
+            # El parámetro no aplica a este tipo de índice
+            pass
+
+
+def build_ann_index(vectors: np.ndarray, spec: str, policy: IndexPolicy) -> Any:
+    """Construye el índice aproximado ``spec`` con ``vectors`` en su orden (mismas posiciones)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], spec, faiss.METRIC_L2)
+    if not index.is_trained:
+        if len(vectors) > MAX_TRAINING_VECTORS:
+            sample = np.random.default_rng(0).choice(len(vectors), MAX_TRAINING_VECTORS, replace=False)
+            index.train(vectors[np.sort(sample)])
+        else:
+            index.train(vectors)
+    index.add(vectors)
+    apply_search_parameters(index, policy)
+    return index
+
+
+def flat_vectors(index: Any) -> np.ndarray:
+    """Todos los vectores de un índice plano como matriz ``(ntotal, d)``."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    return index.reconstruct_n(0, index.ntotal)
+
+
+class RefinedIndex:
+    """Índice de búsqueda: candidatos del índice aproximado, distancias exactas del plano.
+
+    Expone lo que usa ``FAISS`` de LangChain para buscar (``search``, ``ntotal``
+    y ``d``); el resto de atributos se delega en el índice plano.
+    """
+
+    def __init__(self, ann_index: Any, flat_index: Any, refine_factor: int = 4):
+        self.ann_index = ann_index
+        self.flat_index = flat_index
+        self.refine_factor = max(1, int(refine_factor))
+
+    @property
+    def ntotal(self) -> int:
+        return self.flat_index.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.flat_index.d
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        _distances, candidates = self.ann_index.search(queries, k * self.refine_factor)
+        out_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        out_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, (query, ids) in enumerate(zip(queries, candidates)):
+            ids = ids[ids >= 0]
+            if not len(ids):
+                continue
+            exact = ((self.flat_index.reconstruct_batch(ids) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:k]
+            out_distances[row, : len(order)] = exact[order]
+            out_ids[row, : len(order)] = ids[order]
+        return out_distances, out_ids
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.flat_index, name)
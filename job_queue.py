@@ -0,0 +1,478 @@
+"""Cola persistente de trabajos en segundo plano sobre SQLite.
+
+Las subidas se procesaban dentro de la petición HTTP: la petición quedaba
+abierta durante la carga, el OCR y los embeddings, y un reinicio del servidor
+perdía el trabajo. Esta cola guarda cada trabajo en una tabla SQLite (modo WAL)
+y lo ejecuta un grupo de hilos de trabajo:
+
+- ``submit`` devuelve el trabajo al momento; la petición responde con su id.
+- Los trabajos se reclaman con ``BEGIN IMMEDIATE``, de modo que varios procesos
+  (p. ej. varios workers WSGI) comparten la misma cola sin ejecutar dos veces
+  el mismo trabajo. Se respeta un máximo de trabajos en curso por usuario y se
+  eligen por prioridad (mayor primero) y antigüedad.
+- Los trabajos en curso de un proceso que ya no existe (reinicio o caída) o sin
+  latido reciente vuelven a la cola al arrancar, hasta ``max_attempts`` veces.
+- ``cancel`` descarta los trabajos en cola y marca los que están en curso; el
+  manejador comprueba la marca con :func:`check_cancelled` en puntos seguros.
+"""
+from __future__ import annotations
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINAL_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+# Intervalo mínimo entre consultas de cancelación desde un mismo trabajo
+_CANCEL_CHECK_INTERVAL = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_pending ON jobs (status, priority, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_user ON jobs (user_id, status);
+"""
+
+
+class JobCancelled(BaseException):
+    """El trabajo en curso fue cancelado por el usuario.
+
+    Hereda de ``BaseException`` (como ``asyncio.CancelledError``) para que los
+    ``except Exception`` del procesamiento no la absorban.
+    """
+
+
+@dataclass
+class Job:
+    """Fila de la tabla ``jobs``."""
+
+    id: str
+    kind: str
+    user_id: str
+    payload: Dict[str, Any]
+    priority: int
+    status: str
+    attempts: int
+    cancel_requested: bool
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINAL_STATUSES
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(
+            id=row["id"],
+            kind=row["kind"],
+            user_id=row["user_id"],
+            payload=json.loads(row["payload"]),
+            priority=row["priority"],
+            status=row["status"],
+            attempts=row["attempts"],
+            cancel_requested=bool(row["cancel_requested"]),
+            created_at=row["created_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"],
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=row["error"],
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Representación para la API (sin el payload interno)."""
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "priority": self.priority,
+            "attempts": self.attempts,
+            "cancel_requested": self.cancel_requested,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+_current = threading.local()
+
+
+def current_job() -> Optional[Job]:
+    """Trabajo que se está ejecutando en este hilo, si lo hay."""
+    return getattr(_current, "job", None)
+
+
+def check_cancelled() -> None:
+    """Lanza :class:`JobCancelled` si se pidió cancelar el trabajo de este hilo.
+
+    Fuera de un trabajo de la cola no hace nada, por lo que puede llamarse desde
+    código compartido con las peticiones síncronas.
+    """
+    job = current_job()
+    queue = getattr(_current, "queue", None)
+    if job is None or queue is None:
+        return
+    now = time.monotonic()
+    if now - getattr(_current, "last_check", 0.0) < _CANCEL_CHECK_INTERVAL:
+        return
+    _current.last_check = now
+    if queue.cancel_requested(job.id):
+        raise JobCancelled(job.id)
+
+
+def bind_current_job(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Envuelve ``fn`` para que, ejecutada en otro hilo, vea el trabajo de este.
+
+    Sirve para repartir un trabajo entre varios hilos (p. ej. un pool) sin perder
+    la cancelación: :func:`check_cancelled` funciona igual dentro de ``fn``.
+    """
+    job, queue = current_job(), getattr(_current, "queue", None)
+
+    def bound(*args: Any, **kwargs: Any) -> Any:
+        previous = (current_job(), getattr(_current, "queue", None))
+        _current.job, _current.queue, _current.last_check = job, queue, 0.0
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.job, _current.queue = previous
+
+    return bound
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Cola de trabajos en ``path`` con ``workers`` hilos en este proceso.
+
+    Cada tipo de trabajo (``kind``) tiene un manejador registrado con
+    :meth:`register` que recibe el :class:`Job` y devuelve un diccionario
+    serializable como resultado. Una excepción marca el trabajo como fallido.
+    """
+
+    def __init__(self, path: str, *, workers: int = 2, per_user_limit: int = 1, max_attempts: int = 3,
+                 stale_after: float = 300.0, poll_interval: float = 1.0, busy_timeout: float = 60.0,
+                 logger: Any = None):
+        self.path = path
+        self.workers = max(0, int(workers))
+        self.per_user_limit = max(1, int(per_user_limit))
+        self.max_attempts = max(1, int(max_attempts))
+        self.stale_after = float(stale_after)
+        self.poll_interval = float(poll_interval)
+        self.busy_timeout = float(busy_timeout)
+        self.logger = logger
+        # Identifica a este proceso aunque el PID se repita tras un reinicio
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[Job], Optional[Dict[str, Any]]]] = {}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    # -- Conexiones ---------------------------------------------------------------
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Transacción de escritura exclusiva entre hilos y procesos."""
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def _log(self, level: str, message: str) -> None:
+        if self.logger is not None:
+            getattr(self.logger, level)(message, "job_queue")
+
+    # -- Encolado y consulta -------------------------------------------------------
+
+    def register(self, kind: str, handler: Callable[[Job], Optional[Dict[str, Any]]]) -> None:
+        self._handlers[kind] = handler
+
+    def submit(self, kind: str, user_id: Any, payload: Dict[str, Any], priority: int = 0,
+               job_id: Optional[str] = None) -> Job:
+        """Encola un trabajo y despierta a los hilos de este proceso."""
+        job = Job(
+            id=job_id or str(uuid.uuid4()),
+            kind=kind,
+            user_id=str(user_id),
+            payload=dict(payload),
+            priority=int(priority),
+            status=JOB_QUEUED,
+            attempts=0,
+            cancel_requested=False,
+            created_at=time.time(),
+        )
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO jobs (id, kind, user_id, payload, priority, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.user_id, json.dumps(job.payload, ensure_ascii=False), job.priority,
+                 job.status, job.created_at),
+            )
+        self._wakeup.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return Job.from_row(row) if row else None
+
+    def list_jobs(self, user_id: Any, *, limit: int = 50, active_only: bool = False) -> List[Job]:
+        """Trabajos del usuario, los más recientes primero."""
+        query = "SELECT * FROM jobs WHERE user_id = ?"
+        params: List[Any] = [str(user_id)]
+        if active_only:
+            query += " AND status IN (?, ?)"
+            params += [JOB_QUEUED, JOB_RUNNING]
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(int(limit))
+        with self._connect() as connection:
+            return [Job.from_row(row) for row in connection.execute(query, params)]
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancela un trabajo en cola o pide la cancelación de uno en curso."""
+        with self._write() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+                (JOB_CANCELLED, time.time(), job_id, JOB_QUEUED),
+            )
+            connection.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                (job_id, JOB_RUNNING),
+            )
+        return self.get(job_id)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as connection:
+            row = connection.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    # -- Reclamación y ejecución ---------------------------------------------------
+
+    def claim(self) -> Optional[Job]:
+        """Reserva el siguiente trabajo ejecutable para este proceso.
+
+        Orden: prioridad descendente y, a igual prioridad, el más antiguo. Se
+        saltan los usuarios que ya tienen ``per_user_limit`` trabajos en curso.
+        """
+        with self._write() as connection:
+            row = connection.execute(
+                """
+                SELECT id FROM jobs AS j
+                WHERE j.status = ?
+                  AND (SELECT COUNT(*) FROM jobs AS r WHERE r.user_id = j.user_id AND r.status = ?) < ?
+                ORDER BY j.priority DESC, j.created_at, j.rowid
+                LIMIT 1
+                """,
+                (JOB_QUEUED, JOB_RUNNING, self.per_user_limit),
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            connection.execute(
+                """
+                UPDATE jobs SET status = ?, owner = ?, heartbeat_at = ?, started_at = ?, attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (JOB_RUNNING, self.owner, now, now, row["id"]),
+            )
+            row = connection.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        return Job.from_row(row)
+
+    def run(self, job: Job) -> Job:
+        """Ejecuta ``job`` (ya reclamado) con su manejador y registra el resultado."""
+        handler = self._handlers.get(job.kind)
+        _current.job, _current.queue, _current.last_check = job, self, 0.0
+        status, result, error = JOB_COMPLETED, None, None
+        try:
+            if handler is None:
+                raise LookupError(f"Tipo de trabajo desconocido: {job.kind}")
+            result = handler(job)
+        except JobCancelled:
+            status = JOB_CANCELLED
+            self._log("info", f"Trabajo {job.id} cancelado")
+        except Exception as exc:
+            status, error = JOB_FAILED, str(exc)
+            self._log("error", f"Trabajo {job.id} ({job.kind}) fallido: {exc}")
+        finally:
+            _current.job = _current.queue = None
+        with self._connect() as connection:
+            # Solo si el trabajo sigue siendo de este proceso: recover() pudo devolverlo
+            # a la cola (latido caducado) y otro proceso haberlo reclamado
+            updated = connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, heartbeat_at = NULL "
+                "WHERE id = ? AND owner = ? AND status = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None, error,
+                 time.time(), job.id, self.owner, JOB_RUNNING),
+            ).rowcount
+        if not updated:
+            self._log("warning", f"Trabajo {job.id} recuperado por otro proceso: se descarta su resultado ({status})")
+        return self.get(job.id) or job
+
+    def run_pending(self) -> int:
+        """Ejecuta en este hilo los trabajos reclamables hasta vaciar la cola."""
+        processed = 0
+        while True:
+            job = self.claim()
+            if job is None:
+                return processed
+            self.run(job)
+            processed += 1
+
+    def heartbeat(self) -> None:
+        """Renueva el latido de los trabajos en curso de este proceso."""
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+                (time.time(), self.owner, JOB_RUNNING),
+            )
+
+    def _is_orphan(self, owner: str, heartbeat_at: Optional[float], now: float) -> bool:
+        if owner == self.owner:
+            return False
+        if (heartbeat_at or 0) < now - self.stale_after:
+            return True
+        host, _, rest = owner.partition(":")
+        pid = rest.partition(":")[0]
+        if host != socket.gethostname() or not pid.isdigit():
+            return False
+        # Mismo PID con otro identificador: este proceso reemplaza a uno anterior
+        return int(pid) == os.getpid() or not _process_alive(int(pid))
+
+    def recover(self) -> int:
+        """Devuelve a la cola los trabajos huérfanos y devuelve cuántos se recuperaron.
+
+        Un trabajo en curso está huérfano si su proceso ya no existe en esta
+        máquina o si no renueva el latido desde hace ``stale_after`` segundos.
+        Tras ``max_attempts`` intentos se marca como fallido.
+        """
+        now = time.time()
+        recovered = 0
+        with self._write() as connection:
+            rows = connection.execute(
+                "SELECT id, owner, heartbeat_at, attempts FROM jobs WHERE status = ?", (JOB_RUNNING,)
+            ).fetchall()
+            for row in rows:
+                if not self._is_orphan(row["owner"] or "", row["heartbeat_at"], now):
+                    continue
+                if row["attempts"] >= self.max_attempts:
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                        (JOB_FAILED, "Trabajo interrumpido demasiadas veces", now, row["id"]),
+                    )
+                else:
+                    connection.execute(
+                        "UPDATE jobs SET status = ?, owner = NULL, heartbeat_at = NULL WHERE id = ?",
+                        (JOB_QUEUED, row["id"]),
+                    )
+                recovered += 1
+        if recovered:
+            self._log("warning", f"{recovered} trabajos interrumpidos recuperados")
+            self._wakeup.set()
+        return recovered
+
+    # -- Hilos de trabajo ----------------------------------------------------------
+
+    def start(self) -> None:
+        """Recupera trabajos huérfanos y arranca los hilos de trabajo (idempotente)."""
+        with self._lock:
+            if self._threads or not self.workers:
+                return
+            self._stopping.clear()
+            self.recover()
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            monitor = threading.Thread(target=self._monitor_loop, name="job-monitor", daemon=True)
+            monitor.start()
+            self._threads.append(monitor)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            self._stopping.set()
+            self._wakeup.set()
+            for thread in self._threads:
+                thread.join(timeout)
+            self._threads = []
+
+    def _worker_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = self.claim()
+            except sqlite3.Error as exc:
+                self._log("warning", f"No se pudo reclamar un trabajo: {exc}")
+                job = None
+            if job is None:
+                # Sin trabajo: esperar a un ``submit`` de este proceso o al siguiente sondeo
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self.run(job)
+            # Otro trabajo del mismo usuario puede haber quedado desbloqueado
+            self._wakeup.set()
+
+    def _monitor_loop(self) -> None:
+        interval = max(1.0, min(30.0, self.stale_after / 4))
+        while not self._stopping.wait(interval):
+            try:
+                self.heartbeat()
+                self.recover()
+            except sqlite3.Error as exc:
+                self._log("warning", f"Error en el mantenimiento de la cola: {exc}")
@@ -41,11 +41,25 @@ class Chat(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     title = db.Column(db.String(200))
     system_message = db.Column(db.Text, nullable=True)
+    # Parámetros del chat (file_hashes y attached_bases son listas en JSON)
+    file_hashes = db.Column(db.Text, nullable=True)
+    attached_bases = db.Column(db.Text, nullable=True)
+    rag_top_k = db.Column(db.Integer, nullable=True)
+    temperature = db.Column(db.Float, nullable=True)
+    message_history_limit = db.Column(db.Integer, nullable=True)
+    # Resumen acumulado de los mensajes que ya no caben en la ventana del historial
+    # (cubre los ``history_summary_upto`` primeros mensajes; ver chat_history.py)
+    history_summary = db.Column(db.Text, nullable=True)
+    history_summary_upto = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship with User model
     user = db.relationship('User', backref=db.backref('chats', lazy='dynamic'))
+
+    __table_args__ = (
+        db.Index('ix_chat_user_updated', 'user_id', 'updated_at'),
+    )
     
     def __repr__(self):
         return f'<Chat {self.title}>'
@@ -56,10 +70,15 @@ class Message(db.Model):
     chat_id = db.Column(db.String(36), db.ForeignKey('chat.id'))
     role = db.Column(db.String(20))  # 'user' or 'assistant'
     content = db.Column(db.Text)
+    content_type = db.Column(db.String(10), nullable=False, default='text', server_default='text')  # 'text' o 'json'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship with Chat model
     chat = db.relationship('Chat', backref=db.backref('messages', lazy='dynamic', cascade='all, delete-orphan'))
+
+    __table_args__ = (
+        db.Index('ix_message_chat_id', 'chat_id', 'id'),
+    )
     
     def __repr__(self):
         return f'<Message {self.id} - {self.role}>'
@@ -70,6 +89,12 @@ class File(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     filename = db.Column(db.String(255))
     file_hash = db.Column(db.String(32), unique=True)
+    sha256 = db.Column(db.String(64), index=True, nullable=True)
+    # Catálogo: dónde está el archivo (relativo a la carpeta de uploads) y su tamaño
+    # y fecha de modificación al guardarlo, para detectar si otro archivo lo sustituyó
+    stored_path = db.Column(db.String(512), nullable=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    mtime = db.Column(db.Float, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship with User model
@@ -0,0 +1,99 @@
+"""Detección de documentos casi duplicados y diff por fragmentos.
+
+Una revisión de un documento ("v2") tiene otro ``file_hash`` aunque solo cambien
+unas páginas. Este módulo permite reutilizar los vectores de la versión anterior:
+
+- :class:`MinHasher` calcula una firma MinHash de los *shingles* de palabras del
+  texto normalizado; la proporción de posiciones iguales entre dos firmas estima
+  la similitud de Jaccard entre documentos.
+- :func:`diff_chunks` compara los fragmentos nuevos con los de la versión
+  anterior por texto normalizado: los que no cambian reutilizan su vector y solo
+  los demás se envían a generar embeddings.
+"""
+from __future__ import annotations
+
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from chunk_filter import normalize_text
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# Shingles procesados por bloque al calcular la firma (acota la memoria)
+_BLOCK_SIZE = 8192
+
+
+class MinHasher:
+    """Firmas MinHash de ``num_perm`` permutaciones sobre shingles de ``shingle_size`` palabras."""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.num_perm = int(num_perm)
+        self.shingle_size = max(1, int(shingle_size))
+        rng = np.random.default_rng(seed)
+        # Coeficientes < 2^32 con hashes de 32 bits: a * h + b no desborda uint64
+        self._a = rng.integers(1, 1 << 32, self.num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, self.num_perm, dtype=np.uint64)
+
+    def shingle_hashes(self, text: str) -> np.ndarray:
+        words = normalize_text(text).split()
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+
+    def signature(self, texts: Sequence[str]) -> List[int]:
+        hashes = self.shingle_hashes(" ".join(texts))
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        for start in range(0, len(hashes), _BLOCK_SIZE):
+            block = hashes[start:start + _BLOCK_SIZE, None]
+            permuted = ((block * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+            signature = np.minimum(signature, permuted.min(axis=0))
+        return [int(value) for value in signature]
+
+
+def signature_similarity(first: Sequence[int], second: Sequence[int]) -> float:
+    """Similitud de Jaccard estimada entre dos firmas de la misma configuración."""
+    if not first or len(first) != len(second):
+        return 0.0
+    return float(np.mean(np.asarray(first, dtype=np.uint64) == np.asarray(second, dtype=np.uint64)))
+
+
+@dataclass
+class ChunkDiff:
+    """Fragmentos nuevos que reutilizan vector y fragmentos que hay que vectorizar."""
+
+    total: int
+    reused: Dict[int, Any] = field(default_factory=dict)
+    changed_positions: List[int] = field(default_factory=list)
+
+    @property
+    def diff_ratio(self) -> float:
+        return len(self.changed_positions) / self.total if self.total else 0.0
+
+    def assemble(self, changed_vectors: Sequence[Sequence[float]]) -> np.ndarray:
+        """Vectores de todos los fragmentos en su orden, con ``changed_vectors`` para los cambiados."""
+        if len(changed_vectors) != len(self.changed_positions):
+            raise ValueError("Número de vectores distinto del de fragmentos cambiados")
+        rows: List[Optional[Any]] = [None] * self.total
+        for position, vector in self.reused.items():
+            rows[position] = vector
+        for position, vector in zip(self.changed_positions, changed_vectors):
+            rows[position] = vector
+        return np.asarray(rows, dtype=np.float32)
+
+
+def diff_chunks(new_chunks: Sequence[Any], old_chunks: Sequence[Any], old_vectors: Sequence[Sequence[float]]) -> ChunkDiff:
+    """Empareja los fragmentos nuevos con los antiguos por texto normalizado."""
+    known = {}
+    for chunk, vector in zip(old_chunks, old_vectors):
+        known.setdefault(normalize_text(chunk.page_content), vector)
+    diff = ChunkDiff(total=len(new_chunks))
+    for position, chunk in enumerate(new_chunks):
+        vector = known.get(normalize_text(chunk.page_content))
+        if vector is None:
+            diff.changed_positions.append(position)
+        else:
+            diff.reused[position] = vector
+    return diff
@@ -0,0 +1,126 @@
+"""Progreso de las subidas compartido entre procesos (SQLite en modo WAL).
+
+El progreso vivía en un diccionario del proceso: con varios workers (mod_wsgi,
+gunicorn) la consulta de progreso solía llegar a otro proceso y la interfaz
+mostraba "no encontrado", y las entradas nunca se borraban. Aquí cada estado
+es una fila JSON que cualquier proceso puede leer:
+
+- :meth:`ProgressStore.update` fusiona los cambios con el estado guardado,
+  como hacía ``set_embedding_progress`` con el diccionario.
+- Las entradas terminadas (``completed``) caducan a los ``ttl`` segundos y las
+  abandonadas a los ``active_ttl``; la purga se hace de paso en las escrituras.
+- :meth:`ProgressStore.get_many` lee muchos estados con una sola consulta.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_progress_expires ON progress (expires_at);
+"""
+
+# Máximo de parámetros por consulta ``IN (...)`` (límite clásico de SQLite: 999)
+_MAX_IDS_PER_QUERY = 500
+
+
+class ProgressStore:
+    """Estados de progreso por id en ``path`` con caducidad automática."""
+
+    def __init__(self, path: str, *, ttl: float = 3600.0, active_ttl: float = 86400.0,
+                 eviction_interval: float = 60.0, busy_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = float(ttl)
+        self.active_ttl = float(active_ttl)
+        self.eviction_interval = float(eviction_interval)
+        self.busy_timeout = float(busy_timeout)
+        self.clock = clock
+        self._last_eviction = 0.0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        connection = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            # El progreso es efímero: no hace falta sincronizar cada escritura a disco
+            connection.execute("PRAGMA synchronous=NORMAL")
+            yield connection
+        finally:
+            connection.close()
+
+    def update(self, progress_id: str, **updates: Any) -> Dict[str, Any]:
+        """Fusiona ``updates`` en el estado de ``progress_id`` y devuelve el estado resultante."""
+        return self.update_many([progress_id], **updates)[progress_id]
+
+    def update_many(self, progress_ids: Iterable[str], **updates: Any) -> Dict[str, Dict[str, Any]]:
+        """Aplica la misma actualización a varios ids en una sola transacción."""
+        ids = list(dict.fromkeys(progress_ids))
+        now = self.clock()
+        timestamp = datetime.utcnow().isoformat()
+        states: Dict[str, Dict[str, Any]] = {}
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for progress_id in ids:
+                    row = connection.execute(
+                        "SELECT state FROM progress WHERE id = ? AND expires_at >= ?", (progress_id, now)
+                    ).fetchone()
+                    state = json.loads(row[0]) if row else {'created_at': timestamp}
+                    state.update(updates)
+                    state['updated_at'] = timestamp
+                    expires_at = now + (self.ttl if state.get('completed') else self.active_ttl)
+                    connection.execute(
+                        "INSERT OR REPLACE INTO progress (id, state, updated_at, expires_at) VALUES (?, ?, ?, ?)",
+                        (progress_id, json.dumps(state, ensure_ascii=False, default=str), now, expires_at),
+                    )
+                    states[progress_id] = state
+                if now - self._last_eviction >= self.eviction_interval:
+                    self._last_eviction = now
+                    connection.execute("DELETE FROM progress WHERE expires_at < ?", (now,))
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        return states
+
+    def get(self, progress_id: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([progress_id]).get(progress_id)
+
+    def get_many(self, progress_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Estados vigentes de ``progress_ids`` (los que no existen no aparecen)."""
+        ids = list(dict.fromkeys(progress_ids))
+        now = self.clock()
+        found: Dict[str, Dict[str, Any]] = {}
+        with self._connect() as connection:
+            for start in range(0, len(ids), _MAX_IDS_PER_QUERY):
+                block = ids[start:start + _MAX_IDS_PER_QUERY]
+                rows = connection.execute(
+                    f"SELECT id, state FROM progress WHERE id IN ({', '.join('?' for _ in block)}) AND expires_at >= ?",
+                    [*block, now],
+                )
+                found.update((row[0], json.loads(row[1])) for row in rows)
+        return found
+
+    def evict_expired(self) -> int:
+        """Borra las entradas caducadas y devuelve cuántas se borraron."""
+        now = self.clock()
+        with self._connect() as connection:
+            deleted = connection.execute("DELETE FROM progress WHERE expires_at < ?", (now,)).rowcount
+        self._last_eviction = now
+        return deleted
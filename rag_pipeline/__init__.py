@@ -6,10 +6,13 @@ workflows programmatically.
 """
 
 from .config import EmbeddingConfig, PipelineConfig, VectorStoreConfig
+from .embedding_cache import CachedEmbeddings, EmbeddingCache
 from .pipeline import RAGPipeline
 from .schemas import PipelineResponse, RetrievedChunk, Segment
 
 __all__ = [
+    "CachedEmbeddings",
+    "EmbeddingCache",
     "EmbeddingConfig",
     "PipelineConfig",
     "VectorStoreConfig",
@@ -0,0 +1,181 @@
+"""Token-aware packing of embedding requests."""
+
+from __future__ import annotations
+
+import logging
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Literal, Optional, Protocol, Sequence
+
+logger = logging.getLogger(__name__)
+
+OversizeStrategy = Literal["split", "truncate"]
+
+# Conservative characters-per-token ratio used when no tiktoken encoding is available.
+HEURISTIC_CHARS_PER_TOKEN = 3
+
+
+class Encoding(Protocol):
+    def encode(self, text: str) -> List[int]: ...
+
+    def decode(self, tokens: List[int]) -> str: ...
+
+
+@lru_cache(maxsize=8)
+def load_encoding(model_name: Optional[str] = None, encoding_name: str = "cl100k_base") -> Optional[Encoding]:
+    """Return the tiktoken encoding for ``model_name`` (or ``encoding_name``), or None if unavailable."""
+
+    try:
+        import tiktoken
+    except ImportError:  # pragma: no cover - tiktoken is a hard requirement
+        return None
+
+    if model_name:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            pass
+        except Exception as exc:  # pragma: no cover - download failures
+            logger.warning("Unable to load tiktoken encoding for %s: %s", model_name, exc)
+            return None
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as exc:  # pragma: no cover - download failures
+        logger.warning("Unable to load tiktoken encoding %s: %s", encoding_name, exc)
+        return None
+
+
+@dataclass
+class TokenBatchPlan:
+    """Request layout produced by :class:`TokenBatcher`.
+
+    ``pieces`` are the strings actually sent (an oversized input may become several
+    pieces), ``owners[i]`` is the input index of piece ``i`` and ``weights[i]`` its
+    token count. ``batches`` lists piece indices per request, in input order.
+    """
+
+    input_count: int
+    pieces: List[str] = field(default_factory=list)
+    owners: List[int] = field(default_factory=list)
+    weights: List[int] = field(default_factory=list)
+    batches: List[List[int]] = field(default_factory=list)
+
+    def batch_texts(self, batch_index: int) -> List[str]:
+        return [self.pieces[piece] for piece in self.batches[batch_index]]
+
+    def inputs_before(self, batch_index: int) -> int:
+        """Number of inputs fully covered by the batches preceding ``batch_index``."""
+
+        if batch_index >= len(self.batches):
+            return self.input_count
+        return self.owners[self.batches[batch_index][0]]
+
+    def assemble(self, batch_vectors: Sequence[Sequence[Sequence[float]]]) -> List[List[float]]:
+        """Map per-batch results back to one vector per input.
+
+        Inputs that were split are combined with a token-weighted average,
+        re-normalised to unit length.
+        """
+
+        piece_vectors: List[Sequence[float]] = [[] for _ in self.pieces]
+        for batch, vectors in zip(self.batches, batch_vectors, strict=True):
+            for piece, vector in zip(batch, vectors, strict=True):
+                piece_vectors[piece] = vector
+
+        grouped: List[List[int]] = [[] for _ in range(self.input_count)]
+        for piece, owner in enumerate(self.owners):
+            grouped[owner].append(piece)
+
+        results: List[List[float]] = []
+        for pieces in grouped:
+            if len(pieces) == 1:
+                results.append(list(piece_vectors[pieces[0]]))
+                continue
+            total = sum(self.weights[piece] for piece in pieces) or 1
+            dimension = len(piece_vectors[pieces[0]])
+            combined = [0.0] * dimension
+            for piece in pieces:
+                weight = self.weights[piece] / total
+                for position, value in enumerate(piece_vectors[piece]):
+                    combined[position] += value * weight
+            norm = math.sqrt(sum(value * value for value in combined)) or 1.0
+            results.append([value / norm for value in combined])
+        return results
+
+
+class TokenBatcher:
+    """Pack texts into embedding requests bounded by a token ceiling.
+
+    - ``max_batch_tokens`` caps the sum of tokens sent in one request.
+    - ``max_batch_size`` caps the number of inputs per request.
+    - Inputs longer than ``max_input_tokens`` are split (and averaged back) or
+      truncated according to ``oversize``.
+
+    Token counts come from tiktoken; when the encoding cannot be loaded a
+    characters-per-token heuristic is used instead.
+    """
+
+    def __init__(
+        self,
+        max_batch_tokens: int = 16_000,
+        max_input_tokens: int = 8191,
+        max_batch_size: int = 2048,
+        oversize: OversizeStrategy = "split",
+        model_name: Optional[str] = None,
+        encoding: Optional[Encoding] = None,
+        encoding_name: str = "cl100k_base",
+    ) -> None:
+        self.max_input_tokens = max(1, int(max_input_tokens))
+        self.max_batch_tokens = max(self.max_input_tokens, int(max_batch_tokens))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.oversize = oversize
+        self.encoding = encoding if encoding is not None else load_encoding(model_name, encoding_name)
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return math.ceil(len(text) / HEURISTIC_CHARS_PER_TOKEN)
+
+    def _split(self, text: str) -> List[str]:
+        limit = self.max_input_tokens
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)
+            windows = [tokens[start : start + limit] for start in range(0, len(tokens), limit)]
+            if self.oversize == "truncate":
+                windows = windows[:1]
+            return [self.encoding.decode(window) for window in windows]
+
+        chars = limit * HEURISTIC_CHARS_PER_TOKEN
+        parts = [text[start : start + chars] for start in range(0, len(text), chars)]
+        return parts[:1] if self.oversize == "truncate" else parts
+
+    def plan(self, texts: Sequence[str]) -> TokenBatchPlan:
+        """Return the request layout for ``texts``."""
+
+        plan = TokenBatchPlan(input_count=len(texts))
+        for index, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if tokens <= self.max_input_tokens:
+                plan.pieces.append(text)
+                plan.owners.append(index)
+                plan.weights.append(tokens)
+                continue
+            for part in self._split(text):
+                plan.pieces.append(part)
+                plan.owners.append(index)
+                plan.weights.append(self.count_tokens(part))
+
+        current: List[int] = []
+        current_tokens = 0
+        for piece, tokens in enumerate(plan.weights):
+            # Pieces are capped at max_input_tokens; the min() guards heuristic rounding
+            tokens = min(tokens, self.max_input_tokens)
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_size):
+                plan.batches.append(current)
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+        if current:
+            plan.batches.append(current)
+        return plan
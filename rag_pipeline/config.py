@@ -15,8 +15,27 @@ class EmbeddingConfig:
     """Settings for the embedding stage."""
 
     model_name: str = "text-embedding-ada-002"
-    batch_size: int = 32
+    batch_size: int = field(default=32, metadata={"description": "Maximum inputs per embedding request"})
+    max_batch_tokens: int = field(
+        default=16_000,
+        metadata={"description": "Token ceiling per embedding request, counted with tiktoken"},
+    )
+    max_input_tokens: int = field(default=8191, metadata={"description": "Model limit for a single input"})
+    oversize_strategy: Literal["split", "truncate"] = "split"
     max_retries: int = 3
+    cache_path: Optional[str] = field(
+        default=None,
+        metadata={"description": "SQLite file for the persistent embedding cache (disabled if None)"},
+    )
+    cache_max_bytes: int = 1024**3
+    max_concurrency: int = field(
+        default=1,
+        metadata={"description": "Batches dispatched in parallel (1 keeps the sequential behaviour)"},
+    )
+    requests_per_second: Optional[float] = field(
+        default=None,
+        metadata={"description": "Token-bucket refill rate for embedding calls (None disables it)"},
+    )
 
 
 @dataclass
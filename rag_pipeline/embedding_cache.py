@@ -0,0 +1,213 @@
+"""Persistent, content-addressed cache for embedding vectors."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    namespace TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    vector BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (namespace, text_hash)
+);
+CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def text_hash(text: str) -> str:
+    """Return the content address used as cache key for ``text``."""
+
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed vector cache keyed by (namespace, text hash) with size-based eviction."""
+
+    def __init__(self, path: str, max_bytes: int = 1024**3, evict_ratio: float = 0.9) -> None:
+        self.path = path
+        self.max_bytes = max(0, int(max_bytes))
+        self.evict_ratio = evict_ratio
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(_SCHEMA)
+        self._approx_bytes = self._total_bytes()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _total_bytes(self) -> int:
+        row = self._connection().execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()
+        return int(row[0])
+
+    def get_many(self, namespace: str, hashes: Sequence[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors found for ``hashes``."""
+
+        found: Dict[str, List[float]] = {}
+        unique = list(dict.fromkeys(hashes))
+        connection = self._connection()
+        for start in range(0, len(unique), 500):
+            batch = unique[start : start + 500]
+            placeholders = ",".join("?" for _ in batch)
+            rows = connection.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE namespace = ? AND text_hash IN ({placeholders})",
+                [namespace, *batch],
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+
+        if found:
+            now = time.time()
+            connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE namespace = ? AND text_hash = ?",
+                [(now, namespace, key) for key in found],
+            )
+
+        with self._stats_lock:
+            self.hits += sum(1 for key in hashes if key in found)
+            self.misses += sum(1 for key in hashes if key not in found)
+        return found
+
+    def put_many(self, namespace: str, items: Dict[str, Sequence[float]]) -> None:
+        """Store vectors keyed by text hash and evict old entries when over budget."""
+
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        added = 0
+        for key, vector in items.items():
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((namespace, key, len(vector), blob, len(blob), now))
+            added += len(blob)
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (namespace, text_hash, dim, vector, nbytes, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        self._approx_bytes += added
+        if self._approx_bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self) -> None:
+        connection = self._connection()
+        total = self._total_bytes()
+        target = int(self.max_bytes * self.evict_ratio)
+        evicted = 0
+        while total > target:
+            rows = connection.execute(
+                "SELECT namespace, text_hash, nbytes FROM embeddings ORDER BY last_used ASC LIMIT 500"
+            ).fetchall()
+            if not rows:
+                break
+            victims = []
+            for namespace, key, nbytes in rows:
+                victims.append((namespace, key))
+                total -= nbytes
+                if total <= target:
+                    break
+            connection.executemany("DELETE FROM embeddings WHERE namespace = ? AND text_hash = ?", victims)
+            evicted += len(victims)
+        self._approx_bytes = max(total, 0)
+        with self._stats_lock:
+            self.evictions += evicted
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and current size of the cache."""
+
+        row = self._connection().execute(
+            "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM embeddings"
+        ).fetchone()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int(row[0]),
+                "current_bytes": int(row[1]),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that reuses vectors already stored in an :class:`EmbeddingCache`.
+
+    Only document embeddings are cached; queries are forwarded to the wrapped client.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, namespace: str) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+        self.namespace = namespace
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(text) for text in texts]
+        cached = self.cache.get_many(self.namespace, hashes)
+
+        pending: Dict[str, str] = {}
+        for key, text in zip(hashes, texts):
+            if key not in cached and key not in pending:
+                pending[key] = text
+
+        if pending:
+            vectors = self.embeddings.embed_documents(list(pending.values()))
+            computed = dict(zip(pending.keys(), vectors))
+            self.cache.put_many(self.namespace, computed)
+            cached.update(computed)
+
+        return [list(cached[key]) for key in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def __getattr__(self, name: str):
+        # Expose the wrapped client's settings (deployment, chunk_size, ...)
+        if name in {"embeddings", "cache", "namespace"}:
+            raise AttributeError(name)
+        return getattr(self.embeddings, name)
+
+
+def cached_embeddings(
+    embeddings: Embeddings,
+    cache_path: Optional[str],
+    namespace: str,
+    max_bytes: int = 1024**3,
+) -> Embeddings:
+    """Wrap ``embeddings`` with a persistent cache when ``cache_path`` is configured."""
+
+    if not cache_path:
+        return embeddings
+    return CachedEmbeddings(embeddings, EmbeddingCache(cache_path, max_bytes=max_bytes), namespace)
@@ -3,11 +3,15 @@
 from __future__ import annotations
 
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Iterable, List
 
 from langchain_openai import OpenAIEmbeddings
 
+from .batching import TokenBatcher
 from .config import EmbeddingConfig
+from .embedding_cache import cached_embeddings
+from .rate_limit import AdaptiveRateLimiter, is_rate_limit_error, response_headers, retry_after_seconds
 from .schemas import Segment
 
 
@@ -16,30 +20,64 @@ class EmbeddingGenerator:
 
     def __init__(self, config: EmbeddingConfig, embeddings: OpenAIEmbeddings | None = None):
         self.config = config
-        self._client = embeddings or OpenAIEmbeddings(model=config.model_name)
+        self._client = cached_embeddings(
+            embeddings or OpenAIEmbeddings(model=config.model_name),
+            config.cache_path,
+            namespace=config.model_name,
+            max_bytes=config.cache_max_bytes,
+        )
+        self.batcher = TokenBatcher(
+            max_batch_tokens=config.max_batch_tokens,
+            max_input_tokens=config.max_input_tokens,
+            max_batch_size=config.batch_size,
+            oversize=config.oversize_strategy,
+            model_name=config.model_name,
+        )
+        self.rate_limiter = AdaptiveRateLimiter(
+            max_concurrency=config.max_concurrency,
+            requests_per_second=config.requests_per_second,
+        )
 
-    def embed_segments(self, segments: Iterable[Segment]) -> List[tuple[Segment, List[float]]]:
-        """Return embeddings for the provided segments."""
-
-        segment_list = list(segments)
-        vectors: List[tuple[Segment, List[float]]] = []
-
-        for start in range(0, len(segment_list), self.config.batch_size):
-            batch = segment_list[start : start + self.config.batch_size]
-            texts = [segment.text for segment in batch]
-            attempt = 0
-            while True:
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            with self.rate_limiter.slot():
                 try:
                     embeddings = self._client.embed_documents(texts)
-                    break
-                except Exception:  # pragma: no cover - retries
+                except Exception as exc:
                     attempt += 1
                     if attempt >= self.config.max_retries:
                         raise
-                    time.sleep(2**attempt)
-            for segment, vector in zip(batch, embeddings, strict=True):
-                vectors.append((segment, vector))
-        return vectors
+                    if is_rate_limit_error(exc):
+                        self.rate_limiter.observe_headers(response_headers(exc))
+                        self.rate_limiter.on_rate_limited(retry_after_seconds(exc), fallback_delay=2**attempt)
+                        continue
+                    delay = 2**attempt
+                else:
+                    self.rate_limiter.on_success()
+                    return embeddings
+            time.sleep(delay)
+
+    def embed_segments(self, segments: Iterable[Segment]) -> List[tuple[Segment, List[float]]]:
+        """Return embeddings for the provided segments.
+
+        Requests are packed up to ``max_batch_tokens``; segments above the model's
+        input limit are split and averaged (or truncated). With ``max_concurrency > 1``
+        requests are dispatched on a worker pool; the output keeps the input order
+        regardless of completion order.
+        """
+
+        segment_list = list(segments)
+        plan = self.batcher.plan([segment.text for segment in segment_list])
+        batch_texts = [plan.batch_texts(index) for index in range(len(plan.batches))]
+
+        if self.config.max_concurrency > 1 and len(batch_texts) > 1:
+            with ThreadPoolExecutor(max_workers=self.config.max_concurrency) as executor:
+                batch_vectors = list(executor.map(self._embed_batch, batch_texts))
+        else:
+            batch_vectors = [self._embed_batch(texts) for texts in batch_texts]
+
+        return list(zip(segment_list, plan.assemble(batch_vectors), strict=True))
 
     def embed_query(self, query: str) -> List[float]:
         """Return the embedding for a single query string."""
@@ -0,0 +1,181 @@
+"""Rate-limit helpers shared by the embedding clients."""
+
+from __future__ import annotations
+
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Iterator, Mapping, Optional
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Return True when the exception comes from an HTTP 429 / rate limit response."""
+
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    if getattr(exc, "http_status", None) == 429:
+        return True
+    error_code = getattr(getattr(exc, "error", None), "code", None)
+    if error_code in (429, "429"):
+        return True
+    message = str(exc).lower()
+    return "429" in message or "rate limit" in message
+
+
+def response_headers(exc: BaseException) -> Optional[Mapping[str, str]]:
+    response = getattr(exc, "response", None)
+    return getattr(response, "headers", None) or None
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Return the wait requested by the Retry-After headers of the failed response, if any."""
+
+    headers = response_headers(exc)
+    if not headers:
+        return None
+
+    for header in ("retry-after-ms", "x-ms-retry-after-ms"):
+        raw = headers.get(header)
+        if raw:
+            try:
+                return max(0.0, float(raw) / 1000)
+            except (TypeError, ValueError):
+                pass
+
+    raw = headers.get("retry-after")
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(raw)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+
+
+class AdaptiveRateLimiter:
+    """Token bucket plus an AIMD concurrency window driven by 429 responses.
+
+    - ``requests_per_second`` refills the bucket (``None`` disables the bucket).
+    - The concurrency window starts at ``max_concurrency``; every 429 halves it
+      and pauses all callers for the Retry-After delay, and each run of
+      ``recovery_successes`` successful calls widens it by one slot again.
+    - :meth:`observe_headers` shrinks the window when the ``x-ratelimit-remaining-*``
+      budgets reported by the service are lower than the calls in flight.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 1,
+        requests_per_second: Optional[float] = None,
+        burst: Optional[int] = None,
+        recovery_successes: int = 5,
+    ) -> None:
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.requests_per_second = requests_per_second if requests_per_second and requests_per_second > 0 else None
+        self.capacity = float(burst or self.max_concurrency)
+        self.recovery_successes = max(1, int(recovery_successes))
+        self._limit = self.max_concurrency
+        self._in_flight = 0
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    @property
+    def concurrency_limit(self) -> int:
+        with self._condition:
+            return self._limit
+
+    def _refill(self, now: float) -> None:
+        if self.requests_per_second is None:
+            return
+        elapsed = now - self._last_refill
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.requests_per_second)
+        self._last_refill = now
+
+    def acquire(self) -> None:
+        """Block until a concurrency slot and a bucket token are available."""
+
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = 0.0
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight >= self._limit:
+                    wait = 0.5
+                elif self.requests_per_second is not None and self._tokens < 1:
+                    wait = (1 - self._tokens) / self.requests_per_second
+                else:
+                    if self.requests_per_second is not None:
+                        self._tokens -= 1
+                    self._in_flight += 1
+                    return
+                self._condition.wait(timeout=wait)
+
+    def release(self) -> None:
+        with self._condition:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Context manager wrapping :meth:`acquire` / :meth:`release`."""
+
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self._successes += 1
+            if self._successes >= self.recovery_successes and self._limit < self.max_concurrency:
+                self._limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    def on_rate_limited(self, retry_after: Optional[float] = None, fallback_delay: float = 1.0) -> float:
+        """Shrink the window and pause every caller; return the pause applied (seconds)."""
+
+        delay = retry_after if retry_after is not None else fallback_delay
+        with self._condition:
+            self._limit = max(1, self._limit // 2)
+            self._successes = 0
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            self._tokens = 0.0
+            self._condition.notify_all()
+        return delay
+
+    def observe_headers(self, headers: Optional[Mapping[str, str]]) -> None:
+        """Adapt the window to the remaining request/token budgets reported by the service."""
+
+        if not headers:
+            return
+        remaining = []
+        for name in ("x-ratelimit-remaining-requests", "x-ratelimit-remaining-tokens"):
+            raw = headers.get(name)
+            if raw is None:
+                continue
+            try:
+                remaining.append(int(float(raw)))
+            except (TypeError, ValueError):
+                continue
+        if not remaining:
+            return
+        budget = min(remaining)
+        with self._condition:
+            if budget < self._in_flight:
+                self._limit = max(1, min(self._limit, budget))
+                self._successes = 0
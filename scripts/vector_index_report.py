@@ -0,0 +1,139 @@
+"""Recall versus latency report for the FAISS index types used by the app.
+
+Builds each candidate index over the vectors of an existing store (its
+``index.faiss``) or over synthetic data, and compares it with exact flat search:
+
+- build time and serialized size,
+- recall@k of the raw approximate index and after exact re-ranking
+  (the ``RefinedIndex`` path used by the app),
+- mean and p95 latency per query.
+
+The output is a Markdown table meant to help choose
+``VECTORSTORE_FLAT_MAX_VECTORS``, ``VECTORSTORE_IVF_MIN_VECTORS`` and the
+search parameters.
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from index_factory import IndexPolicy, RefinedIndex, build_ann_index, flat_vectors, pq_subquantizers  # noqa: E402
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare recall and latency of FAISS index types")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--store", help="Vector store folder containing index.faiss")
+    source.add_argument("--synthetic", type=int, default=100_000, help="Number of synthetic vectors (default)")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries to run")
+    parser.add_argument("--k", type=int, default=6, help="Results per query")
+    parser.add_argument("--specs", nargs="*", help="index_factory strings (defaults to the app candidates)")
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--refine-factor", type=int, default=4)
+    return parser.parse_args()
+
+
+def load_vectors(args: argparse.Namespace) -> np.ndarray:
+    if args.store:
+        return flat_vectors(faiss.read_index(str(Path(args.store) / "index.faiss")))
+    rng = np.random.default_rng(0)
+    # Clustered data resembles real embeddings better than uniform noise
+    centers = rng.normal(size=(max(1, args.synthetic // 500), args.dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=args.synthetic)
+    vectors = centers[labels] + 0.3 * rng.normal(size=(args.synthetic, args.dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def default_specs(ntotal: int, dim: int) -> List[str]:
+    nlist = max(1, int(4 * math.sqrt(ntotal)))
+    m = pq_subquantizers(dim)
+    return ["HNSW32", "HNSW32_SQfp16", "HNSW32_SQ8", f"IVF{nlist},SQ8", f"IVF{nlist},PQ{m}x8"]
+
+
+def make_queries(vectors: np.ndarray, count: int) -> np.ndarray:
+    rng = np.random.default_rng(1)
+    picked = vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+    noisy = picked + 0.05 * rng.normal(size=picked.shape).astype(np.float32)
+    return np.ascontiguousarray(noisy, dtype=np.float32)
+
+
+def timed_search(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, List[float]]:
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = []
+    for row, query in enumerate(queries):
+        start = time.perf_counter()
+        _distances, found = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        ids[row] = found[0]
+    return ids, latencies
+
+
+def recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+    return hits / truth.size
+
+
+def report_row(name: str, build_s: float, size: int, raw: float, refined: float, latencies: Sequence[float]) -> Dict:
+    return {
+        "index": name,
+        "build_s": f"{build_s:.2f}",
+        "size_mb": f"{size / 2**20:.1f}",
+        "recall": f"{raw:.3f}",
+        "recall_refined": f"{refined:.3f}",
+        "mean_ms": f"{float(np.mean(latencies)):.3f}",
+        "p95_ms": f"{float(np.percentile(latencies, 95)):.3f}",
+    }
+
+
+def main() -> None:
+    args = parse_args()
+    vectors = load_vectors(args)
+    ntotal, dim = vectors.shape
+    queries = make_queries(vectors, args.queries)
+    policy = IndexPolicy(ef_search=args.ef_search, nprobe=args.nprobe, refine_factor=args.refine_factor)
+
+    flat = faiss.IndexFlatL2(dim)
+    start = time.perf_counter()
+    flat.add(vectors)
+    flat_build = time.perf_counter() - start
+    truth, flat_latencies = timed_search(flat, queries, args.k)
+    rows = [report_row("Flat", flat_build, flat.ntotal * dim * 4, 1.0, 1.0, flat_latencies)]
+
+    for spec in args.specs or default_specs(ntotal, dim):
+        print(f"Building {spec} over {ntotal} vectors...", file=sys.stderr)
+        start = time.perf_counter()
+        ann = build_ann_index(vectors, spec, policy)
+        build_s = time.perf_counter() - start
+        raw_ids, _ = timed_search(ann, queries, args.k)
+        refined_ids, latencies = timed_search(RefinedIndex(ann, flat, policy.refine_factor), queries, args.k)
+        rows.append(report_row(
+            spec,
+            build_s,
+            len(faiss.serialize_index(ann)),
+            recall(raw_ids, truth),
+            recall(refined_ids, truth),
+            latencies,
+        ))
+
+    print(f"Vectors: {ntotal} x {dim}, queries: {len(queries)}, k={args.k}, "
+          f"efSearch={args.ef_search}, nprobe={args.nprobe}, refine={args.refine_factor}\n")
+    headers = list(rows[0])
+    print("| " + " | ".join(headers) + " |")
+    print("|" + "|".join("---" for _ in headers) + "|")
+    for row in rows:
+        print("| " + " | ".join(row[header] for header in headers) + " |")
+
+
+if __name__ == "__main__":
+    main()
@@ -2127,10 +2127,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const processMode = selected ? selected.value : 'full';
             modal.classList.remove('open');
 
-            // Procesar todos los archivos PDF con la misma opción
-            files.forEach(file => {
-                addToUploadQueue(file, processMode);
-            });
+            // Procesar todos los archivos PDF con la misma opción (en un solo lote)
+            addFilesToUploadQueue(files, processMode);
         });
 
         // Configurar botones de cierre
@@ -2141,18 +2139,50 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Máximo de archivos por subida en lote (UPLOAD_BATCH_MAX_FILES en el servidor)
+    const UPLOAD_BATCH_MAX_FILES = 20;
+    // Los archivos mayores se suben por partes reanudables (UPLOAD_CHUNK_SIZE_MB en el servidor)
+    const CHUNKED_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+    // crypto.subtle necesita el archivo entero en memoria para calcular el SHA-256
+    const CLIENT_HASH_MAX_BYTES = 256 * 1024 * 1024;
+    const CHUNK_MAX_RETRIES = 3;
+
+    // Función para añadir varios archivos a la cola: se suben juntos y el servidor
+    // los procesa en un solo trabajo (una pasada de embeddings y una escritura)
+    function addFilesToUploadQueue(files, processMode = 'full') {
+        // Los archivos grandes se suben por partes, cada uno por su cuenta
+        files.filter(file => file.size > CHUNKED_UPLOAD_THRESHOLD)
+            .forEach(file => addToUploadQueue(file, processMode));
+        files = files.filter(file => file.size <= CHUNKED_UPLOAD_THRESHOLD);
+        if (files.length <= 1) {
+            files.forEach(file => addToUploadQueue(file, processMode));
+            return;
+        }
+        for (let start = 0; start < files.length; start += UPLOAD_BATCH_MAX_FILES) {
+            const batchId = Date.now() + Math.random().toString(36).substr(2, 9);
+            files.slice(start, start + UPLOAD_BATCH_MAX_FILES).forEach(file => {
+                addToUploadQueue(file, processMode, { batchId, autoStart: false });
+            });
+        }
+        if (!isProcessing) {
+            processNextInQueue();
+        }
+    }
+
     // Función para añadir un archivo a la cola de procesamiento
-    function addToUploadQueue(file, processMode = 'full') {
+    function addToUploadQueue(file, processMode = 'full', { batchId = null, autoStart = true } = {}) {
         // Crear un elemento de cola
         const queueItem = {
             id: Date.now() + Math.random().toString(36).substr(2, 9),
             file: file,
             processMode: processMode,
+            batchId: batchId,
             status: 'pending',
             logs: [],
             progressId: null,
-            progressPoller: null,
             progressState: null,
+            jobId: null,
+            jobPoller: null,
             lastProgressMessage: null
         };
 
@@ -2174,7 +2204,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         // Iniciar procesamiento si no hay nada en proceso
-        if (!isProcessing) {
+        if (autoStart && !isProcessing) {
             processNextInQueue();
         }
     }
@@ -2198,6 +2228,18 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
 
+        if (queueItem.batchId) {
+            const batchItems = uploadQueue.filter(item => item.batchId === queueItem.batchId && item.status === 'pending');
+            batchItems.forEach(item => {
+                item.status = 'processing';
+                addProcessingLog(item, `Iniciando procesamiento del lote de ${batchItems.length} archivos...`);
+            });
+            updateQueueDisplay();
+            uploadStatus.textContent = `Procesando ${batchItems.length} archivos...`;
+            processAndUploadBatch(batchItems);
+            return;
+        }
+
         // Actualizar estado
         queueItem.status = 'processing';
         addProcessingLog(queueItem, `Iniciando procesamiento del archivo "${queueItem.file.name}"...`);
@@ -2210,45 +2252,136 @@ document.addEventListener('DOMContentLoaded', function() {
         processAndUploadFile(queueItem);
     }
 
+    // Subidas cuyo progreso se sigue; un único sondeo las consulta todas a la vez
+    const watchedProgressItems = new Set();
+    let progressPoller = null;
+
     function stopUploadProgressWatcher(queueItem) {
         if (!queueItem) return;
-        if (queueItem.progressPoller) {
-            clearInterval(queueItem.progressPoller);
-            queueItem.progressPoller = null;
+        watchedProgressItems.delete(queueItem);
+        if (watchedProgressItems.size === 0 && progressPoller) {
+            clearInterval(progressPoller);
+            progressPoller = null;
         }
     }
 
-    function fetchUploadProgressOnce(queueItem, { forceUpdate = false } = {}) {
-        if (!queueItem || !queueItem.progressId) {
+    function fetchUploadProgress(queueItems, { forceUpdate = false } = {}) {
+        const items = queueItems.filter(item => item && item.progressId);
+        if (items.length === 0) {
             return Promise.resolve();
         }
 
-        return fetch(`/api/upload/progress/${encodeURIComponent(queueItem.progressId)}`)
+        const ids = items.map(item => encodeURIComponent(item.progressId)).join(',');
+        return fetch(`/api/upload/progress?ids=${ids}`)
             .then(response => response.json())
             .then(data => {
-                if (!data || !data.found || !data.progress) {
-                    return;
-                }
-                handleUploadProgressUpdate(queueItem, data.progress, { forceUpdate });
+                const states = (data && data.progress) || {};
+                items.forEach(item => {
+                    const progress = states[item.progressId];
+                    if (progress) {
+                        handleUploadProgressUpdate(item, progress, { forceUpdate });
+                    }
+                });
             })
             .catch(error => {
                 console.debug('Upload progress poll error:', error);
             });
     }
 
+    function fetchUploadProgressOnce(queueItem, { forceUpdate = false } = {}) {
+        return fetchUploadProgress([queueItem], { forceUpdate });
+    }
+
+    function ensureUploadProgressPoller() {
+        if (!progressPoller) {
+            progressPoller = setInterval(() => {
+                fetchUploadProgress(Array.from(watchedProgressItems));
+            }, 3000);
+        }
+    }
+
     function startUploadProgressWatcher(queueItem) {
         if (!queueItem || !queueItem.progressId) {
             return;
         }
 
-        stopUploadProgressWatcher(queueItem);
+        watchedProgressItems.add(queueItem);
 
         // Obtener un estado inicial inmediatamente
         fetchUploadProgressOnce(queueItem);
 
-        queueItem.progressPoller = setInterval(() => {
-            fetchUploadProgressOnce(queueItem);
-        }, 5000);
+        // Con el flujo SSE el servidor envía los cambios; si no, se sondea
+        if (!openUploadEventStream()) {
+            ensureUploadProgressPoller();
+        }
+    }
+
+    // Flujo SSE con el progreso de todos los trabajos de subida del usuario. Si el
+    // navegador no lo soporta o el servidor lo rechaza, se vuelve al sondeo periódico
+    let uploadEvents = null;
+    let uploadEventsUnavailable = !window.EventSource;
+
+    function findQueueItemForEvent(data) {
+        // En un lote todos los archivos comparten el trabajo: primero se busca por progreso
+        return (data.progress_id && uploadQueue.find(item => item.progressId === data.progress_id)) ||
+            (data.job_id && uploadQueue.find(item => item.jobId === data.job_id));
+    }
+
+    function closeUploadEventStream() {
+        if (uploadEvents) {
+            uploadEvents.close();
+            uploadEvents = null;
+        }
+    }
+
+    function openUploadEventStream() {
+        if (uploadEvents || uploadEventsUnavailable) {
+            return Boolean(uploadEvents);
+        }
+
+        uploadEvents = new EventSource('/api/upload/events');
+
+        uploadEvents.addEventListener('open', () => {
+            // Un trabajo que terminó mientras no había conexión no generará eventos
+            uploadQueue
+                .filter(item => item.jobId && item.status === 'processing')
+                .forEach(item => fetchJobOnce(item));
+        });
+
+        uploadEvents.addEventListener('progress', event => {
+            const data = JSON.parse(event.data);
+            const queueItem = findQueueItemForEvent(data);
+            if (queueItem && data.progress) {
+                handleUploadProgressUpdate(queueItem, data.progress);
+            }
+        });
+
+        uploadEvents.addEventListener('job', event => {
+            const job = JSON.parse(event.data);
+            const queueItem = findQueueItemForEvent(job);
+            if (queueItem && ['completed', 'failed', 'cancelled'].includes(job.status)) {
+                // La consulta del trabajo también actualiza los archivos del chat en la sesión
+                fetchJobOnce(queueItem);
+            }
+        });
+
+        // Sin trabajos activos el servidor cierra el flujo; se reabre con la próxima subida
+        uploadEvents.addEventListener('idle', closeUploadEventStream);
+
+        uploadEvents.onerror = () => {
+            if (uploadEvents && uploadEvents.readyState === EventSource.CLOSED) {
+                uploadEvents = null;
+                uploadEventsUnavailable = true;
+                if (watchedProgressItems.size > 0) {
+                    ensureUploadProgressPoller();
+                }
+                uploadQueue
+                    .filter(item => item.jobId && item.status === 'processing')
+                    .forEach(item => startJobWatcher(item));
+            }
+        };
+
+        return true;
     }
 
     function getProgressMessage(progress, queueItem) {
@@ -2260,6 +2393,8 @@ document.addEventListener('DOMContentLoaded', function() {
         const wait = progress.waiting_seconds ? Number(progress.waiting_seconds) : 0;
         const fileName = queueItem?.file?.name || progress.filename || 'archivo';
         const attemptLabel = attempt && attempt > 0 ? ` (intento ${attempt})` : '';
+        const totalBatches = progress.total_batches ? Number(progress.total_batches) : 0;
+        const batchLabel = totalBatches > 1 ? ` (lote ${progress.batch}/${totalBatches})` : '';
 
         switch (progress.status) {
             case 'queued':
@@ -2268,22 +2403,26 @@ document.addEventListener('DOMContentLoaded', function() {
                 return `Contenido de "${fileName}" cargado. Analizando texto…`;
             case 'chunking':
                 return `Dividiendo "${fileName}" en fragmentos…`;
+            case 'reusing':
+                return `"${fileName}" ya se procesó antes. Reutilizando sus fragmentos y embeddings…`;
             case 'vectorizing':
             case 'starting':
                 return `Generando embeddings para "${fileName}"${attemptLabel}…`;
             case 'processing':
-                return `Generando embeddings para "${fileName}"${attemptLabel}…`;
+                return `Generando embeddings para "${fileName}"${batchLabel}${attemptLabel}…`;
             case 'rate_limited':
                 if (wait > 0) {
-                    return `Límite de peticiones alcanzado${attemptLabel}. Nuevo intento en ${wait} s…`;
+                    return `Límite de peticiones alcanzado${batchLabel}${attemptLabel}. Nuevo intento en ${wait} s…`;
                 }
-                return `Límite de peticiones alcanzado${attemptLabel}. Reintentando…`;
+                return `Límite de peticiones alcanzado${batchLabel}${attemptLabel}. Reintentando…`;
             case 'reintentando':
                 return `Reintentando generación de embeddings${attemptLabel}…`;
             case 'completed':
                 return `Embeddings generados correctamente para "${fileName}".`;
             case 'failed':
                 return `Error procesando "${fileName}": ${progress.error || 'revisa los registros.'}`;
+            case 'cancelled':
+                return `Procesamiento de "${fileName}" cancelado.`;
             default:
                 return '';
         }
@@ -2301,6 +2440,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 return 'Documento cargado';
             case 'chunking':
                 return 'Preparando fragmentos';
+            case 'reusing':
+                return 'Reutilizando embeddings';
             case 'vectorizing':
             case 'starting':
             case 'processing':
@@ -2313,6 +2454,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 return 'Completado';
             case 'failed':
                 return 'Error';
+            case 'cancelled':
+                return 'Cancelado';
             default:
                 return '';
         }
@@ -2354,80 +2497,250 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    function completeUploadItem(queueItem, data) {
+        const file = queueItem.file;
+        queueItem.status = 'completed';
+        addProcessingLog(queueItem, `Archivo "${file.name}" subido correctamente.`);
+
+        if (data.duplicate_of) {
+            addProcessingLog(queueItem, `Archivo repetido en el lote: ya se indexó como "${data.duplicate_of}".`);
+        } else if (!data.is_image) {
+            addProcessingLog(queueItem, `${data.chunks} fragmentos indexados para consulta.`);
+            if (data.reused) {
+                addProcessingLog(queueItem, 'Fragmentos y embeddings reutilizados de una subida anterior del mismo archivo.');
+            } else if (data.near_duplicate_of) {
+                const changedPct = Math.round((data.diff_ratio || 0) * 100);
+                addProcessingLog(queueItem, `Revisión de un documento ya subido: ${data.embeddings_reused} embeddings reutilizados, ${changedPct}% de fragmentos cambiados.`);
+            }
+            if (data.embeddings_saved) {
+                addProcessingLog(queueItem, `${data.embeddings_saved} fragmentos duplicados o sin contenido omitidos.`);
+            }
+            // Añadir mensaje informativo al chat (solo si sigue abierto el chat del archivo)
+            if (!data.chat_id || data.chat_id === currentChatId) {
+                addMessageToChat('assistant', `Archivo "${data.filename}" procesado correctamente. ${data.chunks} fragmentos indexados para consulta.`);
+            }
+        }
+
+        uploadStatus.textContent = data.message || `Archivo ${file.name} procesado correctamente`;
+        stopUploadProgressWatcher(queueItem);
+        fetchUploadProgressOnce(queueItem, { forceUpdate: true });
+        updateQueueDisplay();
+        loadFiles();
+    }
+
+    function failUploadItem(queueItem, errorMessage, status = 'error') {
+        const file = queueItem.file;
+        queueItem.status = status;
+        if (status === 'cancelled') {
+            addProcessingLog(queueItem, `Procesamiento de "${file.name}" cancelado.`);
+            uploadStatus.textContent = `Subida de ${file.name} cancelada`;
+        } else {
+            addProcessingLog(queueItem, `Error al procesar el archivo: ${errorMessage || 'Error desconocido'}`);
+            uploadStatus.textContent = `Error al subir ${file.name}: ${errorMessage}`;
+        }
+        stopUploadProgressWatcher(queueItem);
+        fetchUploadProgressOnce(queueItem, { forceUpdate: true });
+        updateQueueDisplay();
+    }
+
+    function stopJobWatcher(queueItem) {
+        if (queueItem && queueItem.jobPoller) {
+            clearInterval(queueItem.jobPoller);
+            queueItem.jobPoller = null;
+        }
+    }
+
+    function fetchJobOnce(queueItem) {
+        return fetch(`/api/jobs/${encodeURIComponent(queueItem.jobId)}`)
+            .then(response => response.json())
+            .then(job => {
+                // Los archivos de un lote comparten el trabajo y se resuelven juntos
+                const items = uploadQueue.filter(item => item.jobId === queueItem.jobId && item.status === 'processing');
+                if (!job || !job.status || items.length === 0) {
+                    return;
+                }
+                items.forEach(item => {
+                    if (job.status === 'completed') {
+                        stopJobWatcher(item);
+                        const result = job.result || {};
+                        const fileResult = result.files
+                            ? result.files.find(entry => entry.progress_id === item.progressId) || {}
+                            : result;
+                        if (fileResult.success === false) {
+                            failUploadItem(item, fileResult.error);
+                        } else {
+                            completeUploadItem(item, fileResult);
+                        }
+                    } else if (job.status === 'failed') {
+                        stopJobWatcher(item);
+                        failUploadItem(item, job.error);
+                    } else if (job.status === 'cancelled') {
+                        stopJobWatcher(item);
+                        failUploadItem(item, null, 'cancelled');
+                    }
+                });
+            })
+            .catch(error => {
+                console.debug('Upload job poll error:', error);
+            });
+    }
+
+    function startJobWatcher(queueItem) {
+        stopJobWatcher(queueItem);
+        if (openUploadEventStream()) {
+            // El flujo SSE avisa cuando el trabajo termina
+            return;
+        }
+        queueItem.jobPoller = setInterval(() => {
+            fetchJobOnce(queueItem);
+        }, 2000);
+    }
+
+    function cancelUploadJob(queueItem) {
+        if (!queueItem || !queueItem.jobId) {
+            return;
+        }
+        addProcessingLog(queueItem, 'Solicitando cancelación…');
+        fetch(`/api/jobs/${encodeURIComponent(queueItem.jobId)}/cancel`, { method: 'POST' })
+            .then(response => response.json())
+            .then(() => fetchJobOnce(queueItem))
+            .catch(error => {
+                console.error('Error cancelling upload job:', error);
+            });
+        updateQueueDisplay();
+    }
+
+    function computeFileSha256(file) {
+        if (!window.crypto || !window.crypto.subtle || file.size > CLIENT_HASH_MAX_BYTES) {
+            return Promise.resolve(null);
+        }
+        return file.arrayBuffer()
+            .then(buffer => window.crypto.subtle.digest('SHA-256', buffer))
+            .then(digest => Array.from(new Uint8Array(digest))
+                .map(byte => byte.toString(16).padStart(2, '0'))
+                .join(''))
+            .catch(() => null);
+    }
+
+    // Subida por partes: si el servidor ya tiene el archivo (mismo SHA-256) no se envía;
+    // si una parte falla se consulta cuánto llegó y se sigue desde ahí
+    async function uploadFileInParts(queueItem) {
+        const file = queueItem.file;
+        addProcessingLog(queueItem, `Calculando la huella de "${file.name}"…`);
+        const sha256 = await computeFileSha256(file);
+
+        const sessionResponse = await fetch('/api/upload/sessions', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                filename: file.name,
+                size: file.size,
+                sha256: sha256,
+                process_mode: queueItem.processMode || 'full',
+                upload_id: queueItem.progressId
+            })
+        });
+        const uploadSession = await sessionResponse.json();
+        if (uploadSession.known) {
+            addProcessingLog(queueItem, `"${file.name}" ya estaba subido: no es necesario volver a enviarlo.`);
+            return uploadSession;
+        }
+        if (!uploadSession.upload_id) {
+            return uploadSession;
+        }
+
+        const sessionUrl = `/api/upload/sessions/${encodeURIComponent(uploadSession.upload_id)}`;
+        let offset = uploadSession.offset || 0;
+        let failures = 0;
+        while (offset < file.size) {
+            const end = Math.min(offset + uploadSession.chunk_size, file.size);
+            try {
+                const response = await fetch(`${sessionUrl}?offset=${offset}`, {
+                    method: 'PUT',
+                    headers: { 'Content-Type': 'application/octet-stream' },
+                    body: file.slice(offset, end)
+                });
+                const data = await response.json();
+                if (!response.ok && response.status !== 409) {
+                    return data;
+                }
+                // Con 409 el servidor indica desde dónde seguir
+                offset = data.offset;
+                failures = 0;
+                uploadStatus.textContent = `Subiendo ${file.name}: ${Math.round(offset * 100 / file.size)}%`;
+            } catch (error) {
+                failures += 1;
+                if (failures > CHUNK_MAX_RETRIES) {
+                    throw error;
+                }
+                addProcessingLog(queueItem, `Subida interrumpida; reanudando (intento ${failures})…`);
+                await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+                try {
+                    const state = await fetch(sessionUrl).then(response => response.json());
+                    offset = typeof state.offset === 'number' ? state.offset : offset;
+                } catch (stateError) {
+                    console.debug('Upload session status error:', stateError);
+                }
+            }
+        }
+
+        const completeResponse = await fetch(`${sessionUrl}/complete`, { method: 'POST' });
+        return completeResponse.json();
+    }
+
     // Función para procesar y subir el archivo
     function processAndUploadFile(queueItem) {
         const file = queueItem.file;
         const processMode = queueItem.processMode || 'full';
 
-        const formData = new FormData();
-        formData.append('file', file);
-        formData.append('process_mode', processMode);
-        if (queueItem.progressId) {
-            formData.append('upload_id', queueItem.progressId);
-        }
-
         addProcessingLog(queueItem, `Subiendo archivo "${file.name}"...`);
         updateQueueDisplay();
 
         startUploadProgressWatcher(queueItem);
 
-        fetch('/api/upload', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => response.json())
+        let upload;
+        if (file.size > CHUNKED_UPLOAD_THRESHOLD) {
+            upload = uploadFileInParts(queueItem);
+        } else {
+            const formData = new FormData();
+            formData.append('file', file);
+            formData.append('process_mode', processMode);
+            if (queueItem.progressId) {
+                formData.append('upload_id', queueItem.progressId);
+            }
+            upload = fetch('/api/upload', {
+                method: 'POST',
+                body: formData
+            }).then(response => response.json());
+        }
+
+        upload
         .then(data => {
             if (data && data.progress_id && !queueItem.progressId) {
                 queueItem.progressId = data.progress_id;
             }
 
-            if (data.success) {
-                // Actualizar estado
-                queueItem.status = 'completed';
-                addProcessingLog(queueItem, `Archivo "${file.name}" subido correctamente.`);
-
-                if (!data.is_image) {
-                    addProcessingLog(queueItem, `${data.chunks} fragmentos indexados para consulta.`);
-                    // Añadir mensaje informativo al chat
-                    addMessageToChat('assistant', `Archivo "${data.filename}" procesado correctamente. ${data.chunks} fragmentos indexados para consulta.`);
-                }
-
-                uploadStatus.textContent = data.message || `Archivo ${file.name} procesado correctamente`;
-                stopUploadProgressWatcher(queueItem);
-                fetchUploadProgressOnce(queueItem, { forceUpdate: true });
+            if (data.success && data.job_id) {
+                // El servidor procesa el archivo en segundo plano: seguir el trabajo
+                queueItem.jobId = data.job_id;
+                addProcessingLog(queueItem, `Archivo "${file.name}" recibido. Procesando en segundo plano…`);
+                startJobWatcher(queueItem);
+                updateQueueDisplay();
+            } else if (data.success) {
+                completeUploadItem(queueItem, data);
             } else {
-                // Marcar como error
-                queueItem.status = 'error';
-                addProcessingLog(queueItem, `Error al procesar el archivo: ${data.error || 'Error desconocido'}`);
-                uploadStatus.textContent = `Error al subir ${file.name}: ${data.error}`;
-                stopUploadProgressWatcher(queueItem);
-                fetchUploadProgressOnce(queueItem, { forceUpdate: true });
+                failUploadItem(queueItem, data.error);
             }
 
-            // Actualizar la visualización
-            updateQueueDisplay();
-
-            // Actualizar la lista de archivos
-            loadFiles();
-
-            // Marcar como no procesando
+            // La subida ya terminó: el servidor gestiona la cola de procesamiento,
+            // así que se puede enviar el siguiente archivo
             isProcessing = false;
-
-            // Procesar el siguiente en la cola
             processNextInQueue();
         })
         .catch(error => {
             console.error(`Error uploading file ${file.name}:`, error);
 
-            // Marcar como error
-            queueItem.status = 'error';
-            addProcessingLog(queueItem, `Error al procesar el archivo: ${error.message || 'Error de conexión'}`);
-            uploadStatus.textContent = `Error al subir el archivo ${file.name}.`;
-            stopUploadProgressWatcher(queueItem);
-            fetchUploadProgressOnce(queueItem, { forceUpdate: true });
-
-            // Actualizar la visualización
-            updateQueueDisplay();
+            failUploadItem(queueItem, error.message || 'Error de conexión');
 
             // Marcar como no procesando
             isProcessing = false;
@@ -2437,6 +2750,47 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Función para subir varios archivos en un solo trabajo del servidor
+    function processAndUploadBatch(batchItems) {
+        const formData = new FormData();
+        formData.append('process_mode', batchItems[0].processMode || 'full');
+        batchItems.forEach(item => {
+            formData.append('files', item.file);
+            formData.append('upload_ids', item.progressId);
+            addProcessingLog(item, `Subiendo archivo "${item.file.name}"...`);
+            startUploadProgressWatcher(item);
+        });
+        updateQueueDisplay();
+
+        fetch('/api/upload/batch', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success && data.job_id) {
+                batchItems.forEach(item => {
+                    item.jobId = data.job_id;
+                    addProcessingLog(item, `Archivo "${item.file.name}" recibido. Procesando el lote en segundo plano…`);
+                });
+                // Basta con seguir el trabajo desde uno de los archivos
+                startJobWatcher(batchItems[0]);
+                updateQueueDisplay();
+            } else {
+                batchItems.forEach(item => failUploadItem(item, data.error));
+            }
+
+            isProcessing = false;
+            processNextInQueue();
+        })
+        .catch(error => {
+            console.error('Error uploading file batch:', error);
+            batchItems.forEach(item => failUploadItem(item, error.message || 'Error de conexión'));
+            isProcessing = false;
+            processNextInQueue();
+        });
+    }
+
     // Función para cargar la lista de archivos
     function loadFiles() {
         fetch('/api/files')
@@ -2733,6 +3087,8 @@ document.addEventListener('DOMContentLoaded', function() {
                 statusText = 'Completado';
             } else if (item.status === 'error') {
                 statusText = 'Error';
+            } else if (item.status === 'cancelled') {
+                statusText = 'Cancelado';
             } else if (item.status === 'pending') {
                 statusText = 'Pendiente';
             }
@@ -2782,6 +3138,13 @@ document.addEventListener('DOMContentLoaded', function() {
             });
 
             queueItemElement.appendChild(fileInfo);
+            if (item.jobId && item.status === 'processing') {
+                const cancelBtn = document.createElement('button');
+                cancelBtn.className = 'toggle-logs-btn';
+                cancelBtn.textContent = 'Cancelar';
+                cancelBtn.addEventListener('click', () => cancelUploadJob(item));
+                queueItemElement.appendChild(cancelBtn);
+            }
             queueItemElement.appendChild(toggleLogsBtn);
             queueItemElement.appendChild(logsContainer);
 
@@ -2856,7 +3219,7 @@ document.addEventListener('DOMContentLoaded', function() {
             imageFiles.forEach(file => attachImage(file));
 
             // Procesar otros archivos directamente
-            otherFiles.forEach(file => addToUploadQueue(file, 'full'));
+            addFilesToUploadQueue(otherFiles, 'full');
 
             // Si hay PDFs, mostrar el modal de opciones solo una vez
             if (pdfFiles.length > 0) {
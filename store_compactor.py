@@ -0,0 +1,151 @@
+"""Compactación en segundo plano de los segmentos delta de las bases vectoriales.
+
+Las subidas publican segmentos delta inmutables (ver ``faiss_storage``) en lugar
+de reescribir la base completa. Cuando una base acumula ``threshold`` segmentos
+se encola y un hilo en segundo plano la compacta.
+
+- Un bloqueo por base impide compactaciones (o borrados) concurrentes: un
+  ``Lock`` dentro del proceso y un fichero ``.compact.lock`` creado en exclusiva
+  para coordinar con otros procesos del servidor.
+- Tras compactar se invalida la base en la caché de bases cargadas.
+
+El mismo hilo ejecuta otras compactaciones encoladas con :meth:`StoreCompactor.schedule`
+(por ejemplo la de los índices por usuario de ``user_index``).
+"""
+from __future__ import annotations
+
+import os
+import queue
+import time
+from contextlib import contextmanager
+from threading import Lock, Thread, local
+from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple
+
+import logger
+from faiss_storage import compact_segments, segment_paths
+
+LOCK_FILE = ".compact.lock"
+# Un fichero de bloqueo más antiguo que esto se considera abandonado
+STALE_LOCK_SECONDS = 1800
+
+
+class StoreLockTimeout(RuntimeError):
+    """No se pudo obtener el bloqueo de una base vectorial a tiempo."""
+
+
+class StoreCompactor:
+    """Cola y hilo de compactación de bases vectoriales segmentadas."""
+
+    def __init__(self, embeddings: Any, threshold: int = 8,
+                 on_compacted: Optional[Callable[[str], None]] = None):
+        self.embeddings = embeddings
+        self.threshold = max(1, int(threshold))
+        self.on_compacted = on_compacted
+        self._locks: Dict[str, Lock] = {}
+        self._held = local()
+        self._locks_guard = Lock()
+        self._queue: "queue.Queue[Tuple[str, Callable[[], Any]]]" = queue.Queue()
+        self._pending: Set[str] = set()
+        self._pending_lock = Lock()
+        self._thread: Optional[Thread] = None
+
+    def _path_lock(self, key: str) -> Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, Lock())
+
+    @contextmanager
+    def locked(self, path: str, timeout: float = 120.0) -> Iterator[None]:
+        """Bloqueo exclusivo (reentrante por hilo) de la base ``path`` entre hilos y procesos."""
+        key = os.path.normcase(os.path.abspath(path))
+        held = self._held.__dict__.setdefault("paths", set())
+        if key in held:
+            yield
+            return
+
+        path_lock = self._path_lock(key)
+        if not path_lock.acquire(timeout=timeout):
+            raise StoreLockTimeout(f"Bloqueo de {path} no disponible")
+        lock_file = os.path.join(path, LOCK_FILE)
+        owns_file = False
+        try:
+            deadline = time.monotonic() + timeout
+            while not owns_file:
+                try:
+                    os.makedirs(path, exist_ok=True)
+                    fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    os.write(fd, str(os.getpid()).encode())
+                    os.close(fd)
+                    owns_file = True
+                except FileExistsError:
+                    try:
+                        if time.time() - os.path.getmtime(lock_file) > STALE_LOCK_SECONDS:
+                            os.remove(lock_file)
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    if time.monotonic() >= deadline:
+                        raise StoreLockTimeout(f"Bloqueo de {path} en uso por otro proceso")
+                    time.sleep(0.2)
+            held.add(key)
+            yield
+        finally:
+            held.discard(key)
+            if owns_file:
+                try:
+                    os.remove(lock_file)
+                except FileNotFoundError:
+                    pass
+            path_lock.release()
+
+    def compact(self, path: str) -> int:
+        """Compacta la base ``path`` en el hilo actual. Devuelve los segmentos fusionados."""
+        if not os.path.isdir(path):
+            return 0
+        with self.locked(path):
+            merged = compact_segments(path, self.embeddings)
+        if merged:
+            logger.info(f"Base vectorial {path} compactada: {merged} segmentos fusionados", "store_compactor.compact")
+            if self.on_compacted:
+                self.on_compacted(path)
+        return merged
+
+    def maybe_schedule(self, path: str) -> bool:
+        """Encola la base si alcanzó el umbral de segmentos. Devuelve True si se encoló."""
+        if len(segment_paths(path)) < self.threshold:
+            return False
+        return self.schedule(path, lambda: self.compact(path))
+
+    def schedule(self, key: str, task: Callable[[], Any]) -> bool:
+        """Encola ``task`` en el hilo de compactación salvo que ``key`` ya esté pendiente."""
+        with self._pending_lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._ensure_thread()
+        self._queue.put((key, task))
+        return True
+
+    def _ensure_thread(self) -> None:
+        with self._pending_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = Thread(target=self._run, name="vectorstore-compactor", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            path, task = self._queue.get()
+            try:
+                task()
+            except StoreLockTimeout as exc:
+                logger.debug(f"Compactación de {path} aplazada: {exc}", "store_compactor.run")
+            except Exception as exc:
+                logger.error(f"Error al compactar la base vectorial {path}: {exc}", "store_compactor.run")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(path)
+                self._queue.task_done()
+
+    def join(self) -> None:
+        """Espera a que terminen las compactaciones encoladas (pruebas y apagado)."""
+        self._queue.join()
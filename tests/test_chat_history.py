@@ -0,0 +1,83 @@
+"""Unit tests for the token-budgeted history window and rolling summaries."""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from chat_history import IMAGE_TOKENS, MESSAGE_OVERHEAD_TOKENS, build_history_window, count_message_tokens
+
+
+class _WordEncoding:
+    """Un token por palabra: cuentas fáciles de seguir en los tests."""
+
+    def encode(self, text: str, **_: Any) -> List[int]:
+        return list(range(len(text.split())))
+
+
+def _messages(count: int, words: int = 10) -> List[Dict[str, Any]]:
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": " ".join([f"m{i}"] * words)}
+            for i in range(count)]
+
+
+def test_window_keeps_the_newest_messages_within_budget() -> None:
+    encoding = _WordEncoding()
+    messages = _messages(10)
+    per_message = 10 + MESSAGE_OVERHEAD_TOKENS
+
+    window = build_history_window(messages, max_tokens=per_message * 3, encoding=encoding)
+    assert window.messages == messages[-3:]
+    assert window.tokens == per_message * 3
+    assert window.summary is None
+
+    # El límite de mensajes se aplica además del de tokens, y el último entra siempre
+    assert build_history_window(messages, max_tokens=10_000, encoding=encoding, max_messages=2).messages == messages[-2:]
+    assert build_history_window(messages, max_tokens=1, encoding=encoding).messages == messages[-1:]
+
+    image = {"role": "user", "content": [{"type": "text", "text": "mira"}, {"type": "image_url", "image_url": {}}]}
+    assert count_message_tokens(image, encoding) == MESSAGE_OVERHEAD_TOKENS + 1 + IMAGE_TOKENS
+
+
+def test_summary_is_extended_only_when_messages_fall_out_of_the_window() -> None:
+    encoding = _WordEncoding()
+    folded: List[List[Dict[str, Any]]] = []
+
+    def summarize(previous: Optional[str], messages: List[Dict[str, Any]]) -> str:
+        folded.append(messages)
+        return f"{previous or ''}+{len(messages)}"
+
+    budget = (10 + MESSAGE_OVERHEAD_TOKENS) * 5
+    messages = _messages(4)
+    window = build_history_window(messages, max_tokens=budget, encoding=encoding, summarize=summarize)
+    assert (window.summary, window.summary_changed, folded) == (None, False, [])
+
+    # Al no caber, se pliegan los antiguos hasta bajar a ``target_ratio`` del presupuesto
+    messages = _messages(8)
+    window = build_history_window(messages, max_tokens=budget, encoding=encoding, summarize=summarize)
+    assert window.summary_changed
+    assert folded[0] == messages[:window.summary_upto]
+    assert window.messages == messages[window.summary_upto:]
+    assert window.tokens <= budget
+
+    # El turno siguiente cabe con el resumen guardado: no se vuelve a resumir
+    messages = _messages(9)
+    again = build_history_window(messages, max_tokens=budget, encoding=encoding, summarize=summarize,
+                                 summary=window.summary, summary_upto=window.summary_upto)
+    assert not again.summary_changed and len(folded) == 1
+    assert again.summary == window.summary
+    assert again.messages == messages[window.summary_upto:]
+
+
+def test_failed_or_stale_summary_falls_back_to_plain_trimming() -> None:
+    encoding = _WordEncoding()
+    messages = _messages(8)
+    budget = (10 + MESSAGE_OVERHEAD_TOKENS) * 3
+
+    def failing(previous: Optional[str], folded: List[Dict[str, Any]]) -> str:
+        raise RuntimeError("sin servicio")
+
+    window = build_history_window(messages, max_tokens=budget, encoding=encoding, summarize=failing)
+    assert window.messages == messages[-3:] and not window.summary_changed
+
+    # Un resumen que cubre más mensajes de los que hay (historial recortado) se descarta
+    stale = build_history_window(messages[:2], max_tokens=budget, encoding=encoding, summary="viejo", summary_upto=5)
+    assert stale.summary is None and stale.messages == messages[:2]
@@ -0,0 +1,133 @@
+"""Unit tests for the SQLite-backed chat repository."""
+
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+from flask import Flask
+
+from chat_repository import BufferedChatRepository, ChatRepository
+from models import Message, db
+
+
+@pytest.fixture()
+def repository(tmp_path: Path) -> Iterator[ChatRepository]:
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'chats.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield ChatRepository()
+        db.session.remove()
+
+
+def test_save_and_get_keep_the_json_shape(repository: ChatRepository) -> None:
+    messages = [
+        {"role": "user", "content": "hola"},
+        {"role": "assistant", "content": [{"type": "text", "text": "respuesta"}]},
+    ]
+    repository.save(1, "c1", {"messages": messages, "system_message": "sys", "file_hashes": ["h1"],
+                              "rag_top_k": 5, "temperature": 0.2, "attached_bases": ["kb"]})
+
+    data = repository.get(1, "c1")
+    assert data["messages"] == messages
+    assert (data["system_message"], data["file_hashes"], data["rag_top_k"], data["attached_bases"]) == (
+        "sys", ["h1"], 5, ["kb"]
+    )
+    # Otro usuario no ve el chat
+    assert repository.get(2, "c1") is None
+
+    # Guardar de nuevo sustituye los mensajes y update_header no los toca
+    repository.save(1, "c1", {"messages": messages[:1]})
+    repository.update_header(1, "c1", file_hashes=["h1", "h2"])
+    data = repository.get(1, "c1")
+    assert data["messages"] == messages[:1]
+    assert data["file_hashes"] == ["h1", "h2"]
+    assert data["system_message"] == "sys"
+
+
+def test_list_chats_newest_first_with_previews(repository: ChatRepository) -> None:
+    repository.save(1, "old", {"messages": [{"role": "user", "content": "primera pregunta"}]},
+                    timestamp=datetime(2024, 1, 1))
+    repository.save(1, "new", {"messages": [], "title": "Con título"}, timestamp=datetime(2024, 2, 1))
+    repository.save(1, "empty", {"messages": []}, timestamp=datetime(2023, 1, 1))
+    repository.save(2, "other", {"messages": []})
+
+    chats = repository.list_chats(1)
+    assert [chat["id"] for chat in chats] == ["new", "old", "empty"]
+    assert [chat["preview"] for chat in chats] == ["Con título", "primera pregunta...", "Chat vacío"]
+
+    assert repository.delete(1, "old")
+    assert not repository.delete(1, "other")
+    assert Message.query.filter_by(chat_id="old").count() == 0
+    assert repository.delete_user_chats(1) == 2
+    assert repository.list_chats(1) == []
+
+
+def test_import_json_file_is_done_once(repository: ChatRepository, tmp_path: Path) -> None:
+    path = tmp_path / "7_legacy.json"
+    path.write_text(json.dumps({
+        "timestamp": "2024-03-04T05:06:07",
+        "messages": [{"role": "user", "content": "antiguo"}],
+        "title": "Legado",
+        "file_hashes": ["h"],
+    }), encoding="utf-8")
+
+    assert repository.import_json_file(str(path))
+    assert not repository.import_json_file(str(path))
+
+    data = repository.get(7, "legacy")
+    assert data["timestamp"] == "2024-03-04T05:06:07"
+    assert data["messages"] == [{"role": "user", "content": "antiguo"}]
+    assert data["attached_bases"] == []
+
+
+def test_save_appends_new_messages_and_rewrites_only_from_a_change(repository: ChatRepository) -> None:
+    messages = [{"role": "user", "content": "uno"}, {"role": "assistant", "content": "dos"}]
+    repository.save(1, "c1", {"messages": messages})
+    first_ids = [row.id for row in Message.query.filter_by(chat_id="c1").order_by(Message.id)]
+
+    # Un turno nuevo solo añade filas: las anteriores se conservan
+    messages += [{"role": "user", "content": "tres"}, {"role": "assistant", "content": "cuatro"}]
+    repository.save(1, "c1", {"messages": messages})
+    ids = [row.id for row in Message.query.filter_by(chat_id="c1").order_by(Message.id)]
+    assert ids[:2] == first_ids and len(ids) == 4
+
+    # Sin mensajes en ``data`` solo cambia la cabecera
+    repository.save(1, "c1", {"title": "Título"})
+    assert repository.message_count("c1") == 4
+
+    # Si el historial cambia, se reescribe desde el primer mensaje distinto
+    edited = messages[:2] + [{"role": "user", "content": "otra"}]
+    repository.save(1, "c1", {"messages": edited})
+    rows = Message.query.filter_by(chat_id="c1").order_by(Message.id).all()
+    assert [row.id for row in rows[:2]] == first_ids
+    assert repository.messages("c1") == edited
+
+
+def test_buffered_repository_reads_once_and_writes_only_changes(repository: ChatRepository) -> None:
+    repository.save(1, "c1", {"messages": [{"role": "user", "content": "hola"}], "title": "T"})
+
+    buffered = BufferedChatRepository()
+    messages = buffered.get(1, "c1")["messages"]
+    buffered.get(1, "c1")
+    assert buffered.stats()["chat_reads"] == 1
+    assert buffered.stats()["message_reads"] == 1
+
+    # Guardar lo mismo no deja nada pendiente
+    buffered.save(1, "c1", {"messages": messages, "title": "T"})
+    assert not buffered.flush()
+
+    # Los cambios se acumulan y se escriben juntos al final
+    messages.append({"role": "assistant", "content": "adiós"})
+    buffered.save(1, "c1", {"messages": messages})
+    buffered.update_header(1, "c1", title="Nuevo")
+    assert buffered.flush()
+    assert buffered.stats()["chat_writes"] == 1
+    assert buffered.stats()["message_writes"] == 1
+    assert ChatRepository().get(1, "c1")["messages"] == messages
+    assert ChatRepository().get(1, "c1")["title"] == "Nuevo"
@@ -0,0 +1,40 @@
+"""Unit tests for the pre-embedding chunk filter."""
+
+from __future__ import annotations
+
+from langchain_core.documents import Document
+
+from chunk_filter import filter_chunks
+
+BODY = "La regresión logística estima probabilidades a partir de variables explicativas."
+
+
+def test_filter_collapses_duplicates_and_drops_noise() -> None:
+    chunks = [
+        Document(page_content="Universidad Ejemplo - Informe anual de resultados", metadata={"page": 0}),
+        Document(page_content=BODY, metadata={"page": 0}),
+        Document(page_content="UNIVERSIDAD EJEMPLO  informe anual de resultados.", metadata={"page": 1}),
+        Document(page_content="| | |\n|---|---|\n| 1 | |", metadata={"page": 1}),
+        Document(page_content="[ERROR EN PROCESAMIENTO DE IMAGEN - Página 2, Imagen 1]: fallo", metadata={}),
+        Document(page_content="Universidad Ejemplo - Informe anual de resultados", metadata={"page": 2}),
+    ]
+
+    kept, stats = filter_chunks(chunks)
+
+    assert [chunk.page_content for chunk in kept] == [chunks[0].page_content, BODY]
+    assert kept[0].metadata["occurrences"] == 3
+    assert [ref["page"] for ref in kept[0].metadata["duplicate_refs"]] == [1, 2]
+    assert stats.as_dict() == {
+        "total": 6,
+        "kept": 2,
+        "duplicates": 2,
+        "low_information": 1,
+        "error_placeholders": 1,
+        "embeddings_saved": 4,
+    }
+
+
+def test_filter_keeps_short_documents() -> None:
+    kept, stats = filter_chunks([Document(page_content="Hola"), Document(page_content="hola")])
+    assert len(kept) == 1
+    assert stats.embeddings_saved == 1
@@ -0,0 +1,66 @@
+"""Unit tests for resumable chunked uploads and hashing while writing."""
+
+from __future__ import annotations
+
+import hashlib
+import io
+from pathlib import Path
+
+import pytest
+
+from chunked_uploads import ChunkedUploadStore, UploadOffsetError, UploadSessionError, write_stream
+
+
+def test_write_stream_hashes_while_writing(tmp_path: Path) -> None:
+    data = b"contenido del documento " * 100_000
+    result = write_stream(io.BytesIO(data), str(tmp_path / "doc.txt"), block_size=4096)
+
+    assert (tmp_path / "doc.txt").read_bytes() == data
+    assert (result.size, result.md5, result.sha256) == (
+        len(data), hashlib.md5(data).hexdigest(), hashlib.sha256(data).hexdigest()
+    )
+    with pytest.raises(UploadSessionError):
+        write_stream(io.BytesIO(data), str(tmp_path / "big.txt"), max_size=len(data) - 1)
+    # El archivo incompleto no se queda en disco
+    assert not (tmp_path / "big.txt").exists()
+
+
+def test_parts_resume_from_the_received_offset(tmp_path: Path) -> None:
+    data = bytes(range(256)) * 1000
+    store = ChunkedUploadStore(str(tmp_path / "sessions"), max_size=len(data))
+    session = store.create("u1", "doc.bin", len(data), sha256=hashlib.sha256(data).hexdigest())
+
+    store.append(session.upload_id, "u1", 0, io.BytesIO(data[:100_000]))
+    # Una parte repetida o adelantada indica dónde seguir
+    with pytest.raises(UploadOffsetError) as excinfo:
+        store.append(session.upload_id, "u1", 50_000, io.BytesIO(data[50_000:150_000]))
+    assert excinfo.value.offset == 100_000
+    with pytest.raises(UploadSessionError):
+        store.get(session.upload_id, "u2")
+
+    # Otro proceso (otra instancia sin hashes en memoria) recibe el resto
+    other = ChunkedUploadStore(str(tmp_path / "sessions"), max_size=len(data))
+    assert other.get(session.upload_id, "u1").received == 100_000
+    assert other.append(session.upload_id, "u1", 100_000, io.BytesIO(data[100_000:])).complete
+
+    result = other.finish(session.upload_id, "u1", str(tmp_path / "upload" / "doc.bin"))
+    assert result.md5 == hashlib.md5(data).hexdigest()
+    assert (tmp_path / "upload" / "doc.bin").read_bytes() == data
+    assert list((tmp_path / "sessions").iterdir()) == []
+
+
+def test_rejects_oversized_parts_and_hash_mismatch(tmp_path: Path) -> None:
+    store = ChunkedUploadStore(str(tmp_path / "sessions"), max_size=1000)
+    with pytest.raises(UploadSessionError):
+        store.create("u1", "big.bin", 1001)
+
+    session = store.create("u1", "doc.bin", 10, sha256=hashlib.sha256(b"0123456789").hexdigest())
+    with pytest.raises(UploadSessionError):
+        store.append(session.upload_id, "u1", 0, io.BytesIO(b"01234567890"))
+    # La parte rechazada no deja bytes a medias
+    assert store.get(session.upload_id, "u1").received == 0
+
+    store.append(session.upload_id, "u1", 0, io.BytesIO(b"9876543210"))
+    with pytest.raises(UploadSessionError):
+        store.finish(session.upload_id, "u1", str(tmp_path / "doc.bin"))
+    assert not (tmp_path / "doc.bin").exists()
@@ -0,0 +1,185 @@
+"""Unit tests for the pickle-free FAISS storage format."""
+
+from __future__ import annotations
+
+import shutil
+from pathlib import Path
+
+import pytest
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from faiss_storage import (
+    ANN_INDEX_FILE,
+    DOCSTORE_FILE,
+    INDEX_FILE,
+    LEGACY_DOCSTORE_FILE,
+    StoreMismatchError,
+    compact_segments,
+    convert_legacy_store,
+    load_store,
+    save_store,
+    segment_paths,
+    set_index_policy,
+    store_components,
+    write_segment,
+)
+from index_factory import IndexPolicy, RefinedIndex
+from store_compactor import StoreCompactor
+from vectorstore_cache import store_version
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=8)
+
+
+def _store(count: int = 12) -> FAISS:
+    documents = [
+        Document(page_content=f"fragmento {i}", metadata={"file_hash": f"h{i % 2}", "page": i})
+        for i in range(count)
+    ]
+    return FAISS.from_documents(documents, EMBEDDINGS)
+
+
+def test_read_only_store_matches_in_memory_results(tmp_path: Path) -> None:
+    original = _store()
+    save_store(original, str(tmp_path))
+
+    reopened = load_store(str(tmp_path), EMBEDDINGS)
+    query = EMBEDDINGS.embed_query("fragmento 3")
+
+    assert reopened.similarity_search_with_score_by_vector(query, k=3) == (
+        original.similarity_search_with_score_by_vector(query, k=3)
+    )
+    assert len(reopened.index_to_docstore_id) == 12
+
+
+def test_docstore_published_before_its_index_is_not_paired(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("faiss_storage.LOAD_RETRY_SECONDS", 0)
+    old, new = tmp_path / "old", tmp_path / "new"
+    save_store(_store(12), str(old))
+    save_store(_store(8), str(new))
+
+    # Entre los dos os.replace de save_store: docstore nuevo con el índice anterior
+    shutil.copy(new / DOCSTORE_FILE, old / DOCSTORE_FILE)
+    with pytest.raises(StoreMismatchError):
+        load_store(str(old), EMBEDDINGS)
+    with pytest.raises(StoreMismatchError):
+        load_store(str(old), EMBEDDINGS, writable=True)
+
+    shutil.copy(new / INDEX_FILE, old / INDEX_FILE)
+    assert len(load_store(str(old), EMBEDDINGS).index_to_docstore_id) == 8
+
+
+def test_writable_store_supports_delete_and_merge(tmp_path: Path) -> None:
+    save_store(_store(), str(tmp_path))
+    reader = load_store(str(tmp_path), EMBEDDINGS)
+
+    writable = load_store(str(tmp_path), EMBEDDINGS, writable=True)
+    stale = [
+        doc_id
+        for doc_id in writable.index_to_docstore_id.values()
+        if writable.docstore.search(doc_id).metadata["file_hash"] == "h0"
+    ]
+    writable.delete(stale)
+    writable.merge_from(FAISS.from_texts(["nuevo"], EMBEDDINGS))
+    save_store(writable, str(tmp_path))
+
+    updated = load_store(str(tmp_path), EMBEDDINGS)
+    assert updated.index.ntotal == 7
+    assert updated.similarity_search("nuevo", k=1)[0].page_content == "nuevo"
+    # Los lectores abiertos antes del guardado siguen viendo su versión
+    assert reader.index.ntotal == 12
+
+
+def test_legacy_store_is_converted(tmp_path: Path) -> None:
+    _store().save_local(str(tmp_path))
+    assert store_version(str(tmp_path))[1][0] == LEGACY_DOCSTORE_FILE
+
+    assert convert_legacy_store(str(tmp_path), EMBEDDINGS)
+    assert not (tmp_path / LEGACY_DOCSTORE_FILE).exists()
+    assert store_version(str(tmp_path))[1][0] == DOCSTORE_FILE
+    assert load_store(str(tmp_path), EMBEDDINGS).index.ntotal == 12
+
+
+def test_segments_are_searchable_and_compacted(tmp_path: Path) -> None:
+    save_store(_store(4), str(tmp_path))
+    write_segment(FAISS.from_texts(["delta uno"], EMBEDDINGS), str(tmp_path))
+    write_segment(FAISS.from_texts(["delta dos"], EMBEDDINGS), str(tmp_path))
+
+    assert len(store_components(str(tmp_path))) == 3
+    segment = load_store(segment_paths(str(tmp_path))[1], EMBEDDINGS)
+    assert segment.similarity_search("delta dos", k=1)[0].page_content == "delta dos"
+
+    assert compact_segments(str(tmp_path), EMBEDDINGS) == 2
+    assert segment_paths(str(tmp_path)) == []
+    base = load_store(str(tmp_path), EMBEDDINGS)
+    assert base.index.ntotal == 6
+    assert base.similarity_search("delta uno", k=1)[0].page_content == "delta uno"
+
+
+def test_compaction_resumes_after_an_interrupted_segment_removal(tmp_path: Path) -> None:
+    save_store(_store(4), str(tmp_path))
+    write_segment(FAISS.from_texts(["delta uno"], EMBEDDINGS), str(tmp_path))
+    write_segment(FAISS.from_texts(["delta dos"], EMBEDDINGS), str(tmp_path))
+    first, second = segment_paths(str(tmp_path))
+
+    # Base guardada con los segmentos fusionados, pero el proceso cae antes de borrarlos
+    merged = load_store(str(tmp_path), EMBEDDINGS, writable=True)
+    merged.merge_from(load_store(first, EMBEDDINGS, writable=True))
+    merged.merge_from(load_store(second, EMBEDDINGS, writable=True))
+    save_store(merged, str(tmp_path))
+    # El segundo quedó a medio borrar
+    (Path(second) / INDEX_FILE).unlink()
+    write_segment(FAISS.from_texts(["delta tres"], EMBEDDINGS), str(tmp_path))
+
+    assert compact_segments(str(tmp_path), EMBEDDINGS) == 2
+    assert not Path(second).exists() and segment_paths(str(tmp_path)) == []
+    base = load_store(str(tmp_path), EMBEDDINGS)
+    assert base.index.ntotal == 7
+    assert base.similarity_search("delta tres", k=1)[0].page_content == "delta tres"
+
+
+def test_compactor_runs_in_background_at_threshold(tmp_path: Path) -> None:
+    compacted: list[str] = []
+    compactor = StoreCompactor(EMBEDDINGS, threshold=2, on_compacted=compacted.append)
+    save_store(_store(2), str(tmp_path))
+
+    write_segment(FAISS.from_texts(["a"], EMBEDDINGS), str(tmp_path))
+    assert not compactor.maybe_schedule(str(tmp_path))
+    write_segment(FAISS.from_texts(["b"], EMBEDDINGS), str(tmp_path))
+    assert compactor.maybe_schedule(str(tmp_path))
+    compactor.join()
+
+    assert compacted == [str(tmp_path)]
+    assert store_components(str(tmp_path)) == [str(tmp_path)]
+    assert load_store(str(tmp_path), EMBEDDINGS).index.ntotal == 4
+
+
+def test_index_policy_selects_by_size() -> None:
+    policy = IndexPolicy(flat_max_vectors=100, ivf_min_vectors=10_000)
+    assert policy.spec_for(99, 1536) is None
+    assert policy.spec_for(100, 1536) == "HNSW32_SQ8"
+    assert policy.spec_for(10_000, 1536) == "IVF400,PQ96x8"
+    assert IndexPolicy(mode="flat", flat_max_vectors=1).spec_for(10**6, 8) is None
+
+
+def test_large_store_gets_refined_ann_index(tmp_path: Path) -> None:
+    set_index_policy(IndexPolicy(flat_max_vectors=10))
+    try:
+        original = _store(40)
+        save_store(original, str(tmp_path))
+        reopened = load_store(str(tmp_path), EMBEDDINGS)
+    finally:
+        set_index_policy(IndexPolicy())
+
+    assert (tmp_path / ANN_INDEX_FILE).exists()
+    assert isinstance(reopened.index, RefinedIndex)
+    query = EMBEDDINGS.embed_query("fragmento 7")
+    refined = reopened.similarity_search_with_score_by_vector(query, k=4)
+    exact = original.similarity_search_with_score_by_vector(query, k=4)
+    assert [doc.id for doc, _ in refined] == [doc.id for doc, _ in exact]
+    assert [score for _, score in refined] == pytest.approx([score for _, score in exact], rel=1e-5)
+
+    save_store(load_store(str(tmp_path), EMBEDDINGS, writable=True), str(tmp_path))
+    assert not (tmp_path / ANN_INDEX_FILE).exists()
@@ -0,0 +1,51 @@
+"""Unit tests for the per-file vector artifacts."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from chunk_filter import ChunkFilterStats
+from file_artifacts import FileArtifactStore
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=8)
+FINGERPRINT = {"embedding_deployment": "emb", "chunk_size": 1000}
+
+
+def _store() -> FAISS:
+    documents = [
+        Document(id=f"d{i}", page_content=f"fragmento {i}", metadata={"file_hash": "h1", "page": i})
+        for i in range(4)
+    ]
+    return FAISS.from_documents(documents, EMBEDDINGS, ids=[doc.id for doc in documents])
+
+
+def test_artifact_round_trip_keeps_ids_vectors_and_stats(tmp_path: Path) -> None:
+    artifacts = FileArtifactStore(str(tmp_path), EMBEDDINGS, FINGERPRINT)
+    stats = ChunkFilterStats(total=6, kept=4, duplicates=2)
+    artifacts.save("h1", "full", _store(), stats.as_dict())
+
+    artifact = artifacts.load("h1", "full")
+    assert artifact is not None
+    assert [chunk.id for chunk in artifact.chunks] == ["d0", "d1", "d2", "d3"]
+    assert artifact.chunks[2].metadata == {"file_hash": "h1", "page": 2}
+    np.testing.assert_allclose(artifact.vectors[1], EMBEDDINGS.embed_query("fragmento 1"), rtol=1e-6)
+    assert ChunkFilterStats.from_dict(artifact.meta["stats"]) == stats
+
+    assert artifacts.load("h1", "text_only") is None
+    assert artifacts.load("h2", "full") is None
+
+
+def test_artifact_of_another_pipeline_is_ignored_and_replaced(tmp_path: Path) -> None:
+    FileArtifactStore(str(tmp_path), EMBEDDINGS, FINGERPRINT).save("h1", "full", _store())
+
+    changed = FileArtifactStore(str(tmp_path), EMBEDDINGS, {**FINGERPRINT, "chunk_size": 500})
+    assert changed.load("h1", "full") is None
+
+    changed.save("h1", "full", FAISS.from_texts(["nuevo"], EMBEDDINGS))
+    assert [chunk.page_content for chunk in changed.load("h1", "full").chunks] == ["nuevo"]
+    assert sorted(p.name for p in (tmp_path / "h1").iterdir()) == ["full"]
@@ -0,0 +1,140 @@
+"""Unit tests for the persistent SQLite job queue."""
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from job_queue import (
+    JOB_CANCELLED,
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JobCancelled,
+    JobQueue,
+    bind_current_job,
+    check_cancelled,
+)
+
+
+def _queue(tmp_path: Path, **kwargs) -> JobQueue:
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), workers=0, **kwargs)
+
+
+def test_claim_honours_priority_and_per_user_limit(tmp_path: Path) -> None:
+    queue = _queue(tmp_path, per_user_limit=1)
+    first = queue.submit("upload", "u1", {"n": 1})
+    urgent = queue.submit("upload", "u1", {"n": 2}, priority=5)
+    other = queue.submit("upload", "u2", {"n": 3})
+
+    claimed = queue.claim()
+    assert claimed.id == urgent.id
+    # u1 ya tiene un trabajo en curso: pasa el de u2 aunque sea posterior
+    assert queue.claim().id == other.id
+    assert queue.claim() is None
+
+    queue.register("upload", lambda job: {"n": job.payload["n"]})
+    assert queue.run(claimed).result == {"n": 2}
+    assert queue.claim().id == first.id
+
+
+def test_results_failures_and_cancellation(tmp_path: Path) -> None:
+    queue = _queue(tmp_path)
+    seen = []
+
+    def handler(job):
+        if job.payload.get("boom"):
+            raise ValueError("formato no soportado")
+        queue.cancel(job.id)
+        seen.append("antes")
+        check_cancelled()
+        seen.append("después")
+
+    queue.register("upload", handler)
+    failing = queue.submit("upload", "u1", {"boom": True})
+    cancelled_running = queue.submit("upload", "u2", {})
+    cancelled_queued = queue.submit("upload", "u3", {})
+    assert queue.cancel(cancelled_queued.id).status == JOB_CANCELLED
+
+    assert queue.run_pending() == 2
+    assert queue.get(failing.id).status == JOB_FAILED
+    assert queue.get(failing.id).error == "formato no soportado"
+    assert queue.get(cancelled_running.id).status == JOB_CANCELLED
+    assert seen == ["antes"]
+    # Fuera de un trabajo no hace nada
+    check_cancelled()
+
+
+def test_interrupted_jobs_are_requeued_after_restart(tmp_path: Path) -> None:
+    crashed = _queue(tmp_path, max_attempts=2)
+    job = crashed.submit("upload", "u1", {})
+    assert crashed.claim().id == job.id
+
+    # Un proceso nuevo (mismo PID, otro identificador) recupera el trabajo
+    restarted = _queue(tmp_path, max_attempts=2)
+    assert restarted.recover() == 1
+    assert restarted.get(job.id).status == JOB_QUEUED
+
+    # Segundo intento interrumpido: se alcanza max_attempts y se marca fallido
+    assert restarted.claim().attempts == 2
+    assert _queue(tmp_path, max_attempts=2).recover() == 1
+    assert restarted.get(job.id).status == JOB_FAILED
+
+
+def test_late_result_does_not_overwrite_a_reclaimed_job(tmp_path: Path) -> None:
+    stalled = _queue(tmp_path)
+    stalled.register("upload", lambda job: {"by": "stalled"})
+    job = stalled.submit("upload", "u1", {})
+    claimed = stalled.claim()
+
+    # Otro proceso (mismo PID, otro identificador) lo recupera y lo vuelve a reclamar
+    other = _queue(tmp_path)
+    other.register("upload", lambda job: {"by": "other"})
+    assert other.recover() == 1
+    assert other.claim().id == job.id
+
+    # El primer proceso termina tarde: su resultado se descarta
+    reclaimed = other.get(job.id)
+    assert stalled.run(claimed).status == JOB_RUNNING
+    finished = other.run(reclaimed)
+    assert (finished.status, finished.result) == (JOB_COMPLETED, {"by": "other"})
+
+
+def test_worker_threads_process_submitted_jobs(tmp_path: Path) -> None:
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=2, poll_interval=0.05)
+    queue.register("upload", lambda job: {"doubled": job.payload["n"] * 2})
+    queue.start()
+    try:
+        jobs = [queue.submit("upload", f"u{i}", {"n": i}) for i in range(4)]
+        deadline = time.time() + 5
+        while time.time() < deadline and not all(queue.get(job.id).finished for job in jobs):
+            time.sleep(0.02)
+    finally:
+        queue.stop()
+    assert [queue.get(job.id).status for job in jobs] == [JOB_COMPLETED] * 4
+    assert [queue.get(job.id).result["doubled"] for job in jobs] == [0, 2, 4, 6]
+
+
+def test_cancellation_is_seen_from_helper_threads(tmp_path: Path) -> None:
+    queue = _queue(tmp_path)
+    outcomes = []
+
+    def handler(job):
+        queue.cancel(job.id)
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(bind_current_job(check_cancelled)), pool.submit(check_cancelled)]
+        for future in futures:
+            try:
+                future.result()
+                outcomes.append("sigue")
+            except JobCancelled:
+                outcomes.append("cancelado")
+
+    queue.register("upload", handler)
+    job = queue.submit("upload", "u1", {})
+    queue.run_pending()
+    # Sin bind_current_job el hilo del pool no sabe qué trabajo ejecuta
+    assert outcomes == ["cancelado", "sigue"]
+    assert queue.get(job.id).status == JOB_COMPLETED
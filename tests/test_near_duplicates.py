@@ -0,0 +1,43 @@
+"""Unit tests for MinHash near-duplicate detection and chunk diffs."""
+
+from __future__ import annotations
+
+import numpy as np
+from langchain_core.documents import Document
+
+from near_duplicates import MinHasher, diff_chunks, signature_similarity
+
+
+def _pages(count: int, topic: str) -> list[str]:
+    return [
+        f"Página {i}. El {topic} establece en su artículo {i} las obligaciones de cada parte y los plazos aplicables."
+        for i in range(count)
+    ]
+
+
+def test_signature_similarity_separates_revisions_from_other_documents() -> None:
+    hasher = MinHasher()
+    original = _pages(40, "reglamento")
+    revised = list(original)
+    revised[5] = "Página 5. Texto nuevo sobre sanciones, recursos y auditorías externas."
+    unrelated = [f"Paso {i}: conecte el cable {i} al puerto trasero y reinicie el router." for i in range(40)]
+
+    signature = hasher.signature(original)
+    assert signature_similarity(signature, hasher.signature(original)) == 1.0
+    assert signature_similarity(signature, hasher.signature(revised)) > 0.8
+    assert signature_similarity(signature, hasher.signature(unrelated)) < 0.1
+    # Mayúsculas y puntuación no cuentan
+    assert hasher.signature([text.upper() for text in original]) == signature
+
+
+def test_diff_chunks_reuses_vectors_of_unchanged_text() -> None:
+    old = [Document(page_content=text) for text in ("Uno dos tres.", "Cuatro cinco.", "Seis siete.")]
+    old_vectors = np.arange(6, dtype=np.float32).reshape(3, 2)
+    new = [Document(page_content=text) for text in ("uno dos tres", "Algo distinto.", "Seis siete.", "Final nuevo.")]
+
+    diff = diff_chunks(new, old, old_vectors)
+    assert diff.changed_positions == [1, 3]
+    assert diff.diff_ratio == 0.5
+
+    vectors = diff.assemble([[10, 10], [20, 20]])
+    np.testing.assert_array_equal(vectors, [[0, 1], [10, 10], [4, 5], [20, 20]])
@@ -0,0 +1,63 @@
+"""Unit tests for the cross-process upload progress store."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from progress_store import ProgressStore
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_updates_are_merged_and_visible_to_other_processes(tmp_path: Path) -> None:
+    path = str(tmp_path / "progress.sqlite3")
+    writer = ProgressStore(path)
+    writer.update("p1", status="queued", filename="a.pdf", attempt=0)
+    writer.update("p1", status="processing", batch=2)
+
+    # Otra instancia sobre el mismo fichero hace de otro worker
+    reader = ProgressStore(path)
+    state = reader.get("p1")
+    assert state["status"] == "processing"
+    assert state["filename"] == "a.pdf"
+    assert state["batch"] == 2
+    assert {"created_at", "updated_at"} <= set(state)
+    assert reader.get("otro") is None
+
+
+def test_get_many_reads_several_ids(tmp_path: Path) -> None:
+    store = ProgressStore(str(tmp_path / "progress.sqlite3"))
+    for i in range(700):
+        store.update(f"p{i}", status="queued")
+
+    states = store.get_many([f"p{i}" for i in range(0, 700, 2)] + ["falta", "p0"])
+    assert len(states) == 350
+    assert states["p698"]["status"] == "queued"
+
+    # Una misma actualización para varias subidas (lotes)
+    store.update_many(["p1", "p2"], status="vectorizing", batch=1)
+    assert [store.get(pid)["status"] for pid in ("p0", "p1", "p2")] == ["queued", "vectorizing", "vectorizing"]
+
+
+def test_finished_entries_expire_before_active_ones(tmp_path: Path) -> None:
+    clock = _Clock()
+    store = ProgressStore(str(tmp_path / "progress.sqlite3"), ttl=60, active_ttl=600, clock=clock)
+    store.update("done", status="completed", completed=True)
+    store.update("running", status="processing", completed=False)
+
+    clock.now += 61
+    assert store.get("done") is None
+    assert store.get("running") is not None
+    assert store.evict_expired() == 1
+
+    clock.now += 600
+    # La purga también se hace de paso al escribir
+    store.update("nuevo", status="queued")
+    assert store.get_many(["done", "running", "nuevo"]).keys() == {"nuevo"}
+    assert store.evict_expired() == 0
@@ -2,11 +2,15 @@
 
 from __future__ import annotations
 
+import random
+import threading
+import time
 from pathlib import Path
 from typing import Iterable, List, Sequence
 
 import pytest
 
+from rag_pipeline.batching import TokenBatcher
 from rag_pipeline.config import (
     EmbeddingConfig,
     PipelineConfig,
@@ -15,11 +19,14 @@ from rag_pipeline.config import (
     SegmenterConfig,
     VectorStoreConfig,
 )
+from rag_pipeline.embedding_cache import CachedEmbeddings, EmbeddingCache
+from rag_pipeline.embeddings import EmbeddingGenerator
 from rag_pipeline.ingestion import load_document
 from rag_pipeline.llm import build_pipeline_response
 from rag_pipeline.pipeline import RAGPipeline
 from rag_pipeline.preprocess import preprocess_document
 from rag_pipeline.prompt import build_prompt
+from rag_pipeline.rate_limit import AdaptiveRateLimiter, retry_after_seconds
 from rag_pipeline.schemas import RetrievedChunk, Segment
 from rag_pipeline.segment import DocumentSegmenter
 from rag_pipeline.vector_store import AcademicVectorStore
@@ -46,6 +53,20 @@ class DummyEmbeddingGenerator:
         return self._embed_text(query)
 
 
+class CountingEmbeddings:
+    """LangChain-style embeddings client that records every request."""
+
+    def __init__(self) -> None:
+        self.requests: List[List[str]] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.requests.append(list(texts))
+        return [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
 class DummyLLMClient:
     """LLM stub that mirrors the prompt and chunk count."""
 
@@ -168,3 +189,151 @@ def test_build_pipeline_response() -> None:
     response = build_pipeline_response("respuesta", "prompt", chunks)
     assert response.answer == "respuesta"
     assert response.references[0]["label"] == "Fuente 1"
+
+
+def test_cached_embeddings_reuse_vectors_across_instances(tmp_path: Path) -> None:
+    cache_path = tmp_path / "cache.sqlite3"
+    client = CountingEmbeddings()
+    first = CachedEmbeddings(client, EmbeddingCache(str(cache_path)), namespace="modelo")
+    vectors = first.embed_documents(["uno", "dos", "uno"])
+
+    second = CachedEmbeddings(client, EmbeddingCache(str(cache_path)), namespace="modelo")
+    assert second.embed_documents(["dos", "uno"]) == [vectors[1], vectors[0]]
+    assert client.requests == [["uno", "dos"]]
+    assert second.cache.stats()["hit_rate"] == 1.0
+
+    other_model = CachedEmbeddings(client, EmbeddingCache(str(cache_path)), namespace="otro")
+    other_model.embed_documents(["uno"])
+    assert client.requests[-1] == ["uno"]
+
+
+def test_embedding_cache_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=3 * 12)
+    cache.put_many("m", {"a": [1.0, 2.0, 3.0], "b": [1.0, 2.0, 3.0], "c": [1.0, 2.0, 3.0]})
+    cache.get_many("m", ["a"])
+    cache.put_many("m", {"d": [1.0, 2.0, 3.0]})
+
+    stats = cache.stats()
+    assert stats["current_bytes"] <= 3 * 12
+    assert stats["evictions"] >= 1
+    assert "a" in cache.get_many("m", ["a"])
+
+
+def test_embedding_generator_uses_configured_cache(tmp_path: Path) -> None:
+    config = EmbeddingConfig(cache_path=str(tmp_path / "cache.sqlite3"))
+    client = CountingEmbeddings()
+    generator = EmbeddingGenerator(config, embeddings=client)  # type: ignore[arg-type]
+    segments = [Segment(segment_id=str(i), text=f"texto {i}", metadata={}, source_document_id="d") for i in range(3)]
+
+    generator.embed_segments(segments)
+    generator.embed_segments(segments)
+    assert len(client.requests) == 1
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+    def __init__(self, headers: dict[str, str]) -> None:
+        super().__init__("rate limit")
+        self.response = type("Response", (), {"headers": headers})()
+
+
+class FlakyConcurrentEmbeddings(CountingEmbeddings):
+    """Client with random latency that answers the first call with a 429."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.lock = threading.Lock()
+        self.failed = False
+        self.active = 0
+        self.peak = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.lock:
+            if not self.failed:
+                self.failed = True
+                raise RateLimitError({"retry-after-ms": "10"})
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(random.uniform(0, 0.01))
+            return super().embed_documents(texts)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def test_embedding_generator_concurrent_order_is_deterministic() -> None:
+    config = EmbeddingConfig(batch_size=2, max_concurrency=4)
+    client = FlakyConcurrentEmbeddings()
+    generator = EmbeddingGenerator(config, embeddings=client)  # type: ignore[arg-type]
+    segments = [Segment(segment_id=str(i), text=f"texto {i}", metadata={}, source_document_id="d") for i in range(20)]
+
+    result = generator.embed_segments(segments)
+
+    assert [segment.segment_id for segment, _ in result] == [segment.segment_id for segment in segments]
+    expected = CountingEmbeddings().embed_documents([segment.text for segment in segments])
+    assert [vector for _, vector in result] == expected
+    assert client.peak <= 4
+    assert client.failed and len(client.requests) == 10
+
+
+def test_rate_limiter_adapts_window() -> None:
+    limiter = AdaptiveRateLimiter(max_concurrency=8, recovery_successes=2)
+    assert limiter.on_rate_limited(retry_after_seconds(RateLimitError({"retry-after": "0"}))) == 0.0
+    assert limiter.concurrency_limit == 4
+    limiter.on_success()
+    limiter.on_success()
+    assert limiter.concurrency_limit == 5
+
+    for _ in range(3):
+        limiter.acquire()
+    limiter.observe_headers({"x-ratelimit-remaining-requests": "1"})
+    assert limiter.concurrency_limit == 1
+    for _ in range(3):
+        limiter.release()
+
+
+class WordEncoding:
+    """Whitespace tokenizer standing in for a tiktoken encoding."""
+
+    def encode(self, text: str) -> List[str]:  # type: ignore[override]
+        return text.split()
+
+    def decode(self, tokens: List[str]) -> str:  # type: ignore[override]
+        return " ".join(tokens)
+
+
+def test_token_batcher_packs_by_tokens_and_splits_long_inputs() -> None:
+    batcher = TokenBatcher(max_batch_tokens=6, max_input_tokens=4, max_batch_size=10, encoding=WordEncoding())
+    texts = ["a b", "c d e", "f", "g h i j k l m n o"]
+
+    plan = batcher.plan(texts)
+
+    assert [plan.batch_texts(index) for index in range(len(plan.batches))] == [
+        ["a b", "c d e", "f"],
+        ["g h i j"],
+        ["k l m n", "o"],
+    ]
+    assert plan.inputs_before(1) == 3
+    vectors = plan.assemble([[[1.0, 0.0]] * 3, [[1.0, 0.0]], [[0.0, 1.0], [0.0, 1.0]]])
+    assert len(vectors) == 4
+    assert vectors[0] == [1.0, 0.0]
+    assert vectors[3][1] > vectors[3][0]
+    assert sum(value * value for value in vectors[3]) == pytest.approx(1.0)
+
+    truncating = TokenBatcher(max_batch_tokens=6, max_input_tokens=4, oversize="truncate", encoding=WordEncoding())
+    assert truncating.plan(texts).pieces[-1] == "g h i j"
+
+
+def test_embedding_generator_respects_token_ceiling() -> None:
+    config = EmbeddingConfig(batch_size=100, max_batch_tokens=10, max_input_tokens=5)
+    client = CountingEmbeddings()
+    generator = EmbeddingGenerator(config, embeddings=client)  # type: ignore[arg-type]
+    generator.batcher.encoding = WordEncoding()
+    segments = [Segment(segment_id=str(i), text="uno dos tres", metadata={}, source_document_id="d") for i in range(5)]
+
+    result = generator.embed_segments(segments)
+
+    assert len(result) == 5
+    assert [len(request) for request in client.requests] == [3, 2]
@@ -0,0 +1,115 @@
+"""Unit tests for the server-sent upload progress stream."""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from job_queue import JobQueue
+from progress_store import ProgressStore
+from upload_events import StreamLimiter, job_progress_ids, upload_event_stream
+
+
+def _parse(chunk: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in chunk.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_pushes_progress_and_job_transitions(tmp_path: Path) -> None:
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=0)
+    progress = ProgressStore(str(tmp_path / "progress.sqlite3"))
+    queue.register("upload", lambda job: {"chunks": 3})
+    job = queue.submit("upload", "u1", {"progress_id": "p1"})
+    queue.submit("upload", "u2", {"progress_id": "p2"})
+    progress.update("p1", status="queued")
+    progress.update("p2", status="queued")
+
+    # Cada "espera" del flujo avanza el trabajo un paso
+    steps = iter([
+        lambda: progress.update("p1", status="chunking"),
+        lambda: None,
+        lambda: (progress.update("p1", status="completed", completed=True), queue.run(queue.claim())),
+    ])
+    clock = {"now": 0.0}
+
+    def sleep(seconds: float) -> None:
+        clock["now"] += seconds
+        next(steps, lambda: None)()
+
+    stream = upload_event_stream(queue, progress, "u1", interval=1, idle_seconds=2, keepalive_seconds=100,
+                                 sleep=sleep, clock=lambda: clock["now"])
+    assert next(stream).startswith("retry:")
+    events = [event for chunk in stream for event in _parse(chunk)]
+
+    names = [name for name, _data in events]
+    statuses = [data.get("status") or data.get("progress", {}).get("status") for _name, data in events]
+    assert list(zip(names, statuses)) == [
+        ("progress", "queued"),
+        ("job", "queued"),
+        ("progress", "chunking"),
+        ("progress", "completed"),
+        ("job", "completed"),
+        ("idle", None),
+    ]
+    assert events[4][1]["job_id"] == job.id
+    assert events[4][1]["result"] == {"chunks": 3}
+    # Los trabajos de otros usuarios no aparecen
+    assert all(data.get("progress_id") != "p2" for _name, data in events)
+
+
+def test_stream_sends_keepalives_and_ends_after_max_seconds(tmp_path: Path) -> None:
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=0)
+    progress = ProgressStore(str(tmp_path / "progress.sqlite3"))
+    queue.submit("upload", "u1", {"progress_id": "p1"})
+    clock = {"now": 0.0}
+
+    def sleep(seconds: float) -> None:
+        clock["now"] += seconds
+
+    chunks = list(upload_event_stream(queue, progress, "u1", interval=5, max_seconds=60, keepalive_seconds=20,
+                                      sleep=sleep, clock=lambda: clock["now"]))
+    assert chunks[0].startswith("retry:")
+    assert [name for chunk in chunks[1:] for name, _data in _parse(chunk)] == ["job"]
+    assert chunks.count(": keep-alive\n\n") == 3
+
+
+def test_stream_reports_every_file_of_a_batch_job(tmp_path: Path) -> None:
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=0)
+    progress = ProgressStore(str(tmp_path / "progress.sqlite3"))
+    job = queue.submit("upload_batch", "u1", {"files": [{"progress_id": "a"}, {"progress_id": "b"}]})
+    progress.update_many(["a", "b"], status="queued")
+    assert job_progress_ids(job) == ["a", "b"]
+    clock = {"now": 0.0}
+
+    def sleep(seconds: float) -> None:
+        clock["now"] += seconds
+
+    chunks = list(upload_event_stream(queue, progress, "u1", interval=5, max_seconds=5,
+                                      sleep=sleep, clock=lambda: clock["now"]))
+    events = [event for chunk in chunks[1:] for event in _parse(chunk)]
+    assert sorted(data["progress_id"] for name, data in events if name == "progress") == ["a", "b"]
+    # El evento del trabajo lleva los ids de todos sus archivos
+    assert [data["progress_ids"] for name, data in events if name == "job"] == [["a", "b"]]
+
+
+def test_stream_limiter_frees_slots_when_streams_end_or_close() -> None:
+    limiter = StreamLimiter(2)
+    first = limiter.open(lambda: iter(["a", "b"]))
+    second = limiter.open(lambda: iter(["c"]))
+    assert first is not None and second is not None
+    # Sin plazas libres no se crea el flujo
+    assert limiter.open(lambda: iter(["d"])) is None
+
+    assert list(first) == ["a", "b"]
+    third = limiter.open(lambda: iter(["e"]))
+    assert third is not None
+
+    # Cerrar sin haber empezado (cliente desconectado) también libera la plaza, una sola vez
+    second.close()
+    second.close()
+    assert limiter.open(lambda: iter(["f"])) is not None
+    assert limiter.open(lambda: iter(["g"])) is None
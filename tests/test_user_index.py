@@ -0,0 +1,118 @@
+"""Unit tests for the per-user vector index with chat and knowledge-base tags."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from store_compactor import StoreCompactor
+from user_index import CHAT_SCOPE, KB_SCOPE, UserVectorIndex
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=8)
+
+
+def _chunks(prefix: str, file_hash: str, count: int = 3) -> list[Document]:
+    return [
+        Document(page_content=f"{prefix} {i}", metadata={"file_hash": file_hash, "page": i})
+        for i in range(count)
+    ]
+
+
+def _add(index: UserVectorIndex, chunks: list[Document], *scopes: tuple[str, str]) -> list[int]:
+    vectors = EMBEDDINGS.embed_documents([chunk.page_content for chunk in chunks])
+    return index.add(chunks, vectors, scopes)
+
+
+def _texts(results) -> set[str]:
+    return {doc.page_content for doc, _distance in results}
+
+
+def test_search_is_limited_to_requested_scopes(tmp_path: Path) -> None:
+    index = UserVectorIndex(str(tmp_path))
+    _add(index, _chunks("alfa", "h1"), (CHAT_SCOPE, "c1"))
+    _add(index, _chunks("beta", "h2"), (CHAT_SCOPE, "c2"))
+
+    query = EMBEDDINGS.embed_query("beta 1")
+    assert _texts(index.search(query, 10, [(CHAT_SCOPE, "c1")])) == {"alfa 0", "alfa 1", "alfa 2"}
+
+    both = index.search(query, 2, [(CHAT_SCOPE, "c1"), (CHAT_SCOPE, "c2")])
+    assert both[0][0].page_content == "beta 1"
+    assert both[0][1] == 0.0
+    assert index.search(query, 3, [(CHAT_SCOPE, "otro")]) == []
+
+
+def test_knowledge_base_is_saved_as_tags(tmp_path: Path) -> None:
+    index = UserVectorIndex(str(tmp_path))
+    _add(index, _chunks("alfa", "h1") + _chunks("beta", "h2"), (CHAT_SCOPE, "c1"))
+    files_before = sorted(p.name for p in (tmp_path / "segments").iterdir())
+
+    assert index.copy_scope((CHAT_SCOPE, "c1"), (KB_SCOPE, "kb1")) == 6
+    assert sorted(p.name for p in (tmp_path / "segments").iterdir()) == files_before
+
+    # Borrar el chat no afecta a la base guardada
+    index.remove_scope(CHAT_SCOPE, "c1")
+    query = EMBEDDINGS.embed_query("alfa 0")
+    assert len(index.search(query, 10, [(KB_SCOPE, "kb1")])) == 6
+    assert index.search(query, 10, [(CHAT_SCOPE, "c1")]) == []
+
+    # Solo se amplía con los archivos indicados
+    _add(index, _chunks("gamma", "h3"), (CHAT_SCOPE, "c2"))
+    assert index.copy_scope((CHAT_SCOPE, "c2"), (KB_SCOPE, "kb1"), file_hashes=["h9"]) == 0
+    assert index.copy_scope((CHAT_SCOPE, "c2"), (KB_SCOPE, "kb1"), file_hashes=["h3"]) == 3
+    assert sorted(index.scope_file_hashes(KB_SCOPE, "kb1")) == ["h1", "h2", "h3"]
+
+
+def test_untagged_vectors_are_purged_on_compaction(tmp_path: Path) -> None:
+    index = UserVectorIndex(str(tmp_path), segment_threshold=100)
+    _add(index, _chunks("alfa", "h1"), (CHAT_SCOPE, "c1"))
+    _add(index, _chunks("beta", "h2"), (CHAT_SCOPE, "c1"), (KB_SCOPE, "kb1"))
+    _add(index, _chunks("gamma", "h3"), (CHAT_SCOPE, "c1"))
+    assert len(index.component_files()) == 3
+
+    assert index.retain_files(CHAT_SCOPE, "c1", ["h3"]) == 6
+    assert index.compact() == 3
+
+    files = index.component_files()
+    assert [Path(path).name for path in files] == ["vectors.faiss"]
+    # beta sigue en la base RAG; alfa ya no tiene etiquetas
+    assert index._load_component(files[0]).ntotal == 6
+    query = EMBEDDINGS.embed_query("alfa 0")
+    assert _texts(index.search(query, 10, [(CHAT_SCOPE, "c1"), (KB_SCOPE, "kb1")])) == {
+        "beta 0", "beta 1", "beta 2", "gamma 0", "gamma 1", "gamma 2",
+    }
+
+
+def test_import_reuses_vectors_of_known_documents(tmp_path: Path) -> None:
+    store = FAISS.from_documents(_chunks("alfa", "h1"), EMBEDDINGS)
+    index = UserVectorIndex(str(tmp_path), segment_threshold=2)
+
+    assert index.import_vectorstore(store, [(CHAT_SCOPE, "c1")]) == 3
+    # La copia guardada como base RAG tiene los mismos ids: solo se añaden etiquetas
+    assert index.import_vectorstore(store, [(KB_SCOPE, "kb1")]) == 3
+    assert len(index.component_files()) == 1
+
+    query = EMBEDDINGS.embed_query("alfa 2")
+    assert index.search(query, 1, [(KB_SCOPE, "kb1")])[0][0].page_content == "alfa 2"
+
+
+def test_compaction_is_scheduled_after_the_write_commits(tmp_path: Path) -> None:
+    compactor = StoreCompactor(EMBEDDINGS)
+    scheduled = []
+
+    def schedule(user_index: UserVectorIndex) -> None:
+        # El catálogo ya no está bloqueado: otra escritura puede entrar
+        user_index.tag([], CHAT_SCOPE, "c1")
+        scheduled.append(compactor.schedule(user_index.path, user_index.compact))
+
+    index = UserVectorIndex(str(tmp_path), segment_threshold=2, busy_timeout=0.5, schedule_compaction=schedule)
+    _add(index, _chunks("alfa", "h1"), (CHAT_SCOPE, "c1"))
+    _add(index, _chunks("beta", "h2"), (CHAT_SCOPE, "c1"))
+    compactor.join()
+
+    assert scheduled == [True]
+    assert [Path(path).name for path in index.component_files()] == ["vectors.faiss"]
+    query = EMBEDDINGS.embed_query("beta 1")
+    assert index.search(query, 1, [(CHAT_SCOPE, "c1")])[0][0].page_content == "beta 1"
@@ -0,0 +1,60 @@
+"""Unit tests for the in-process FAISS store cache."""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+from vectorstore_cache import VectorStoreCache
+
+
+def _write_store(path: Path, payload: bytes) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "index.faiss").write_bytes(payload)
+    (path / "index.pkl").write_bytes(payload)
+
+
+def test_cache_hits_until_store_changes(tmp_path: Path) -> None:
+    store = tmp_path / "chat"
+    _write_store(store, b"a" * 10)
+    loads: list[str] = []
+    cache = VectorStoreCache(max_bytes=1000)
+
+    def loader(path: str) -> object:
+        loads.append(path)
+        return object()
+
+    first = cache.get(str(store), loader)
+    assert cache.get(str(store), loader) is first
+    assert cache.stats()["hits"] == 1
+
+    _write_store(store, b"b" * 12)
+    assert cache.get(str(store), loader) is not first
+    assert len(loads) == 2
+    assert cache.stats()["misses"] == 2
+
+
+def test_cache_evicts_least_recently_used(tmp_path: Path) -> None:
+    cache = VectorStoreCache(max_bytes=50)
+    for name in ("a", "b", "c"):
+        _write_store(tmp_path / name, b"x" * 10)
+
+    cache.get(str(tmp_path / "a"), lambda _: "a")
+    cache.get(str(tmp_path / "b"), lambda _: "b")
+    cache.get(str(tmp_path / "a"), lambda _: "a")
+    cache.get(str(tmp_path / "c"), lambda _: "c")
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["current_bytes"] <= 50
+    reloaded: list[str] = []
+    cache.get(str(tmp_path / "a"), lambda _: reloaded.append("a") or "a")
+    assert not reloaded
+
+
+def test_invalidate_drops_entry(tmp_path: Path) -> None:
+    store = tmp_path / "kb"
+    _write_store(store, b"z" * 4)
+    cache = VectorStoreCache(max_bytes=100)
+    cache.get(str(store), lambda _: "kb")
+    cache.invalidate(str(store))
+    assert cache.stats()["entries"] == 0
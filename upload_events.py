@@ -0,0 +1,153 @@
+"""Eventos de progreso de las subidas por Server-Sent Events.
+
+El navegador consultaba el progreso de cada archivo con un sondeo periódico;
+con muchos usuarios subiendo lotes, esas consultas eran buena parte de las
+peticiones. :func:`upload_event_stream` genera un flujo SSE por usuario que
+cubre todos sus trabajos activos de la cola de subidas:
+
+- ``event: progress`` cada vez que cambia el estado de progreso de un trabajo
+  (``document_loaded``, ``chunking``, ``vectorizing``, ``rate_limited``...).
+- ``event: job`` cuando cambia el estado del trabajo en la cola (en cola, en
+  curso, completado, fallido, cancelado).
+- Un comentario de keep-alive si no hay eventos en ``keepalive_seconds``.
+- ``event: idle`` y fin del flujo si el usuario no tiene trabajos durante
+  ``idle_seconds``; el flujo también termina a los ``max_seconds`` y el
+  navegador vuelve a conectarse (``EventSource`` reconecta solo).
+
+Las comprobaciones se hacen en el servidor leyendo la cola y el almacén de
+progreso (SQLite, compartidos entre procesos), sin peticiones del cliente.
+
+Cada flujo abierto ocupa un hilo del servidor WSGI durante toda la conexión.
+:class:`StreamLimiter` limita los flujos simultáneos por proceso; por encima
+del límite la petición se rechaza y el navegador vuelve al sondeo.
+"""
+from __future__ import annotations
+
+import json
+import time
+from threading import BoundedSemaphore
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from job_queue import Job, JobQueue
+from progress_store import ProgressStore
+
+# Milisegundos que espera el navegador antes de reconectar
+RETRY_MS = 3000
+
+
+class _LimitedStream:
+    """Iterable WSGI que libera su plaza al agotarse o al cerrarse (aunque no haya empezado)."""
+
+    def __init__(self, stream: Iterator[str], release: Callable[[], None]):
+        self._stream = stream
+        self._release: Optional[Callable[[], None]] = release
+
+    def __iter__(self) -> "_LimitedStream":
+        return self
+
+    def __next__(self) -> str:
+        try:
+            return next(self._stream)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        release, self._release = self._release, None
+        if release is not None:
+            try:
+                close = getattr(self._stream, "close", None)
+                if close is not None:
+                    close()
+            finally:
+                release()
+
+
+class StreamLimiter:
+    """Número máximo de flujos SSE abiertos a la vez en el proceso."""
+
+    def __init__(self, max_streams: int):
+        self.max_streams = max(1, int(max_streams))
+        self._slots = BoundedSemaphore(self.max_streams)
+
+    def open(self, factory: Callable[[], Iterator[str]]) -> Optional[Iterator[str]]:
+        """Crea el flujo con ``factory`` si queda una plaza libre; si no, devuelve None."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            stream = factory()
+        except BaseException:
+            self._slots.release()
+            raise
+        return _LimitedStream(stream, self._slots.release)
+
+
+def format_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def job_progress_ids(job: Job) -> List[str]:
+    """Ids de progreso de un trabajo: uno por subida o uno por archivo de un lote."""
+    if "files" in job.payload:
+        return [entry["progress_id"] for entry in job.payload["files"] if entry.get("progress_id")]
+    progress_id = job.payload.get("progress_id")
+    return [progress_id] if progress_id else []
+
+
+def upload_event_stream(queue: JobQueue, progress: ProgressStore, user_id: Any, *, interval: float = 0.5,
+                        max_seconds: float = 300.0, idle_seconds: float = 15.0, keepalive_seconds: float = 15.0,
+                        sleep: Callable[[float], None] = time.sleep,
+                        clock: Callable[[], float] = time.monotonic) -> Iterator[str]:
+    """Genera los eventos SSE de los trabajos de subida de ``user_id``."""
+    started = last_sent = last_active = clock()
+    job_status: Dict[str, str] = {}
+    progress_ids: Dict[str, List[str]] = {}
+    progress_seen: Dict[str, Any] = {}
+    yield f"retry: {RETRY_MS}\n\n"
+
+    while True:
+        now = clock()
+        jobs = {job.id: job for job in queue.list_jobs(user_id, active_only=True)}
+        # Los trabajos que dejan de estar activos se leen una vez más para enviar su estado final
+        for job_id in job_status.keys() - jobs.keys():
+            job = queue.get(job_id)
+            if job is not None:
+                jobs[job_id] = job
+        for job in jobs.values():
+            progress_ids.setdefault(job.id, job_progress_ids(job))
+
+        events = []
+        states = progress.get_many([pid for pids in progress_ids.values() for pid in pids])
+        for job_id, pids in progress_ids.items():
+            for progress_id in pids:
+                state = states.get(progress_id)
+                if state is not None and progress_seen.get(progress_id) != state.get("updated_at"):
+                    progress_seen[progress_id] = state.get("updated_at")
+                    events.append(format_event("progress", {"job_id": job_id, "progress_id": progress_id,
+                                                            "progress": state}))
+        for job in jobs.values():
+            pids = progress_ids.get(job.id, [])
+            if job_status.get(job.id) != job.status:
+                job_status[job.id] = job.status
+                events.append(format_event("job", {**job.as_dict(), "progress_id": pids[0] if len(pids) == 1 else None,
+                                                   "progress_ids": pids}))
+            if job.finished:
+                job_status.pop(job.id, None)
+                for progress_id in progress_ids.pop(job.id, []):
+                    progress_seen.pop(progress_id, None)
+
+        if events:
+            yield "".join(events)
+            last_sent = now
+        elif now - last_sent >= keepalive_seconds:
+            yield ": keep-alive\n\n"
+            last_sent = now
+
+        if job_status:
+            last_active = now
+        elif now - last_active >= idle_seconds:
+            yield format_event("idle", {})
+            return
+        if now - started >= max_seconds:
+            return
+        sleep(interval)
@@ -0,0 +1,436 @@
+"""Índice vectorial único por usuario con etiquetas de chat y de base RAG.
+
+En el modo por chat cada chat tiene su carpeta FAISS y guardar una base RAG
+copia la carpeta completa. En este modo cada usuario tiene un solo índice:
+
+- ``vectors.faiss``: ``IndexIDMap2`` sobre un índice plano L2; cada vector se
+  identifica por un ``vector_id`` entero estable.
+- ``segments/*.faiss``: segmentos delta inmutables con los vectores añadidos
+  desde la última compactación (mismo formato).
+- ``catalog.sqlite3`` (WAL):
+    - ``chunks``: texto, metadatos y ``file_hash`` de cada vector;
+    - ``tags``: pertenencia de cada vector a un chat (``scope='chat'``) o a una
+      base RAG (``scope='kb'``).
+
+Las búsquedas leen de ``tags`` los ids del chat y de sus bases anexadas y se
+restringen a ellos con un ``IDSelector`` de FAISS. Guardar o ampliar una base
+RAG solo inserta filas de etiquetas. Los vectores que se quedan sin etiquetas
+dejan de ser seleccionables y se eliminan del índice en la siguiente
+compactación.
+
+Las escrituras se serializan entre hilos y procesos con la transacción
+``BEGIN IMMEDIATE`` del catálogo; las lecturas no se bloquean (WAL y ficheros
+de índice sustituidos con ``os.replace``). La compactación que dispara
+:meth:`UserVectorIndex.add` se hace después de confirmar las filas, en segundo
+plano si se pasa ``schedule_compaction``.
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from index_factory import flat_vectors
+
+INDEX_FILE = "vectors.faiss"
+CATALOG_FILE = "catalog.sqlite3"
+SEGMENTS_DIR = "segments"
+SEGMENT_SUFFIX = ".faiss"
+
+CHAT_SCOPE = "chat"
+KB_SCOPE = "kb"
+
+Scope = Tuple[str, str]
+
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    vector_id INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL UNIQUE,
+    file_hash TEXT,
+    page_content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_chunks_file_hash ON chunks (file_hash);
+CREATE TABLE IF NOT EXISTS tags (
+    scope TEXT NOT NULL,
+    scope_id TEXT NOT NULL,
+    vector_id INTEGER NOT NULL,
+    PRIMARY KEY (scope, scope_id, vector_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_tags_vector_id ON tags (vector_id);
+"""
+
+
+def _component_key(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _new_vector_id() -> int:
+    # Ids aleatorios de 62 bits en lugar de correlativos: un id nunca se reutiliza,
+    # ni siquiera el de un segmento huérfano de una escritura interrumpida
+    return uuid.uuid4().int & ((1 << 62) - 1)
+
+
+def _index_ids(index: Any) -> np.ndarray:
+    return faiss.vector_to_array(index.id_map).astype(np.int64)
+
+
+class UserVectorIndex:
+    """Índice vectorial de un usuario (carpeta ``path``)."""
+
+    def __init__(self, path: str, segment_threshold: int = 8, busy_timeout: float = 60.0,
+                 schedule_compaction: Optional[Callable[["UserVectorIndex"], Any]] = None):
+        self.path = path
+        self.segment_threshold = max(1, int(segment_threshold))
+        self.busy_timeout = busy_timeout
+        # Sin planificador, add compacta en el hilo que escribe (tras confirmar)
+        self.schedule_compaction = schedule_compaction
+        self._components: Dict[str, Tuple[Tuple[int, int, int], Any]] = {}
+        self._components_lock = Lock()
+        self._schema_ready = False
+
+    # -- Catálogo -----------------------------------------------------------------
+
+    @property
+    def catalog_path(self) -> str:
+        return os.path.join(self.path, CATALOG_FILE)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        os.makedirs(self.path, exist_ok=True)
+        connection = sqlite3.connect(self.catalog_path, timeout=self.busy_timeout, isolation_level=None)
+        try:
+            if not self._schema_ready:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(_SCHEMA)
+                self._schema_ready = True
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Connection]:
+        """Transacción de escritura exclusiva entre hilos y procesos."""
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.catalog_path)
+
+    def has_scope(self, scope: str, scope_id: str) -> bool:
+        if not self.exists():
+            return False
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT 1 FROM tags WHERE scope = ? AND scope_id = ? LIMIT 1", (scope, str(scope_id))
+            ).fetchone()
+        return row is not None
+
+    def scope_file_hashes(self, scope: str, scope_id: str) -> List[str]:
+        """``file_hash`` de los fragmentos etiquetados con ``scope``."""
+        if not self.exists():
+            return []
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT DISTINCT c.file_hash FROM tags t JOIN chunks c ON c.vector_id = t.vector_id "
+                "WHERE t.scope = ? AND t.scope_id = ? AND c.file_hash IS NOT NULL",
+                (scope, str(scope_id)),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def _scope_vector_ids(self, connection: sqlite3.Connection, scopes: Sequence[Scope]) -> np.ndarray:
+        clauses = " OR ".join("(scope = ? AND scope_id = ?)" for _ in scopes)
+        params = [value for scope, scope_id in scopes for value in (scope, str(scope_id))]
+        rows = connection.execute(f"SELECT DISTINCT vector_id FROM tags WHERE {clauses}", params).fetchall()
+        return np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+
+    # -- Escritura ----------------------------------------------------------------
+
+    def add(self, chunks: Sequence[Any], vectors: Sequence[Sequence[float]], scopes: Iterable[Scope]) -> List[int]:
+        """Añade fragmentos con sus vectores y los etiqueta con ``scopes``.
+
+        Los fragmentos cuyo id ya existe en el índice reutilizan su vector y
+        solo reciben las etiquetas. Devuelve los ``vector_id`` en el orden de
+        ``chunks``.
+        """
+        if len(chunks) != len(vectors):
+            raise ValueError("Número de fragmentos y de vectores distinto")
+        scopes = [(scope, str(scope_id)) for scope, scope_id in scopes]
+        if not chunks:
+            return []
+
+        with self._write() as connection:
+            vector_ids: List[int] = []
+            new_rows = []
+            new_positions = []
+            for position, chunk in enumerate(chunks):
+                doc_id = str(getattr(chunk, "id", None) or uuid.uuid4())
+                existing = connection.execute("SELECT vector_id FROM chunks WHERE doc_id = ?", (doc_id,)).fetchone()
+                if existing:
+                    vector_ids.append(existing[0])
+                    continue
+                metadata = dict(chunk.metadata or {})
+                vector_id = _new_vector_id()
+                new_rows.append((
+                    vector_id,
+                    doc_id,
+                    metadata.get("file_hash"),
+                    chunk.page_content,
+                    json.dumps(metadata, ensure_ascii=False, default=str),
+                ))
+                new_positions.append(position)
+                vector_ids.append(vector_id)
+
+            if new_rows:
+                matrix = np.ascontiguousarray([vectors[position] for position in new_positions], dtype=np.float32)
+                # El segmento se publica antes de confirmar las filas: si el proceso
+                # se interrumpe, sus vectores quedan sin etiquetas y nunca se seleccionan
+                self._write_segment(matrix, np.array([row[0] for row in new_rows], dtype=np.int64))
+                connection.executemany(
+                    "INSERT INTO chunks (vector_id, doc_id, file_hash, page_content, metadata) VALUES (?, ?, ?, ?, ?)",
+                    new_rows,
+                )
+            self._insert_tags(connection, vector_ids, scopes)
+        # Fuera de la transacción: compactar no retiene el bloqueo de escritura del catálogo
+        if len(self._segment_files()) >= self.segment_threshold:
+            if self.schedule_compaction is not None:
+                self.schedule_compaction(self)
+            else:
+                self.compact()
+        return vector_ids
+
+    def import_vectorstore(self, vectorstore: Any, scopes: Iterable[Scope]) -> int:
+        """Incorpora una base FAISS de LangChain (modo por chat) sin volver a generar embeddings."""
+        positions = sorted(vectorstore.index_to_docstore_id)
+        if not positions:
+            return 0
+        vectors = flat_vectors(vectorstore.index)
+        chunks = []
+        for position in positions:
+            doc_id = vectorstore.index_to_docstore_id[position]
+            document = vectorstore.docstore.search(doc_id)
+            if not isinstance(document, Document):
+                raise ValueError(f"El docstore no contiene el documento {doc_id}")
+            chunks.append(Document(id=str(doc_id), page_content=document.page_content, metadata=document.metadata))
+        return len(self.add(chunks, vectors[positions], scopes))
+
+    def tag(self, vector_ids: Iterable[int], scope: str, scope_id: str) -> None:
+        with self._write() as connection:
+            self._insert_tags(connection, vector_ids, [(scope, str(scope_id))])
+
+    def copy_scope(self, source: Scope, target: Scope, file_hashes: Optional[Iterable[str]] = None) -> int:
+        """Etiqueta con ``target`` los vectores de ``source`` (opcionalmente solo de ``file_hashes``).
+
+        Es lo que hace guardar una base RAG desde un chat: no se copia ningún vector.
+        """
+        if not self.exists():
+            return 0
+        query = "INSERT OR IGNORE INTO tags (scope, scope_id, vector_id) SELECT ?, ?, t.vector_id FROM tags t"
+        params: List[Any] = [target[0], str(target[1])]
+        where = " WHERE t.scope = ? AND t.scope_id = ?"
+        params += [source[0], str(source[1])]
+        if file_hashes is not None:
+            hashes = list(file_hashes)
+            if not hashes:
+                return 0
+            query += " JOIN chunks c ON c.vector_id = t.vector_id"
+            where += f" AND c.file_hash IN ({', '.join('?' for _ in hashes)})"
+            params += hashes
+        with self._write() as connection:
+            return connection.execute(query + where, params).rowcount
+
+    def retain_files(self, scope: str, scope_id: str, file_hashes: Iterable[str]) -> int:
+        """Quita de ``scope`` las etiquetas de los fragmentos cuyo archivo no está en ``file_hashes``."""
+        if not self.exists():
+            return 0
+        keep = list(file_hashes)
+        condition = f"c.file_hash IS NULL OR c.file_hash NOT IN ({', '.join('?' for _ in keep)})" if keep else "1"
+        with self._write() as connection:
+            removed = connection.execute(
+                "DELETE FROM tags WHERE scope = ? AND scope_id = ? AND vector_id IN "
+                f"(SELECT c.vector_id FROM chunks c WHERE {condition})",
+                [scope, str(scope_id), *keep],
+            ).rowcount
+            self._delete_untagged(connection)
+        return removed
+
+    def remove_scope(self, scope: str, scope_id: str) -> int:
+        """Elimina todas las etiquetas de ``scope`` (chat o base borrada)."""
+        if not self.exists():
+            return 0
+        with self._write() as connection:
+            removed = connection.execute(
+                "DELETE FROM tags WHERE scope = ? AND scope_id = ?", (scope, str(scope_id))
+            ).rowcount
+            self._delete_untagged(connection)
+        return removed
+
+    @staticmethod
+    def _insert_tags(connection: sqlite3.Connection, vector_ids: Iterable[int], scopes: Sequence[Scope]) -> None:
+        connection.executemany(
+            "INSERT OR IGNORE INTO tags (scope, scope_id, vector_id) VALUES (?, ?, ?)",
+            [(scope, scope_id, int(vector_id)) for vector_id in vector_ids for scope, scope_id in scopes],
+        )
+
+    @staticmethod
+    def _delete_untagged(connection: sqlite3.Connection) -> None:
+        # Los vectores quedan en el índice hasta la siguiente compactación
+        connection.execute("DELETE FROM chunks WHERE vector_id NOT IN (SELECT vector_id FROM tags)")
+
+    # -- Ficheros de índice -------------------------------------------------------
+
+    def _segment_files(self) -> List[str]:
+        root = os.path.join(self.path, SEGMENTS_DIR)
+        try:
+            names = sorted(os.listdir(root))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(root, name) for name in names if name.endswith(SEGMENT_SUFFIX) and not name.startswith(".")]
+
+    def component_files(self) -> List[str]:
+        base = os.path.join(self.path, INDEX_FILE)
+        return ([base] if os.path.exists(base) else []) + self._segment_files()
+
+    @staticmethod
+    def _write_index(index: Any, target: str) -> None:
+        tmp_path = os.path.join(os.path.dirname(target), f".{os.path.basename(target)}.tmp")
+        try:
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _write_segment(self, vectors: np.ndarray, vector_ids: np.ndarray) -> str:
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(vectors.shape[1]))
+        index.add_with_ids(vectors, vector_ids)
+        root = os.path.join(self.path, SEGMENTS_DIR)
+        os.makedirs(root, exist_ok=True)
+        target = os.path.join(root, f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}")
+        self._write_index(index, target)
+        return target
+
+    def compact(self) -> int:
+        """Fusiona los segmentos con el índice principal y purga los vectores sin etiquetas."""
+        if not self.exists():
+            return 0
+        with self._write() as connection:
+            return self._compact(connection)
+
+    def _compact(self, connection: sqlite3.Connection) -> int:
+        components = self.component_files()
+        if not components:
+            return 0
+        segments = self._segment_files()
+        live = np.fromiter((row[0] for row in connection.execute("SELECT vector_id FROM chunks")), dtype=np.int64)
+        merged = None
+        for path in components:
+            index = faiss.read_index(path)
+            ids = _index_ids(index)
+            if merged is None:
+                merged = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+            # Solo vectores con fragmento vivo y sin repetir (base y segmento tras una compactación interrumpida)
+            mask = np.isin(ids, live) & ~np.isin(ids, _index_ids(merged))
+            if mask.any():
+                merged.add_with_ids(flat_vectors(faiss.downcast_index(index.index))[mask], ids[mask])
+        self._write_index(merged, os.path.join(self.path, INDEX_FILE))
+        for segment in segments:
+            try:
+                os.remove(segment)
+            except FileNotFoundError:
+                pass
+        return len(segments)
+
+    def _load_component(self, path: str) -> Any:
+        key = _component_key(path)
+        if key is None:
+            raise FileNotFoundError(path)
+        with self._components_lock:
+            cached = self._components.get(path)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        try:
+            index = faiss.read_index(path, _MMAP_FLAGS)
+        except RuntimeError as exc:
+            # faiss no distingue un fichero borrado entre el stat y la lectura
+            if _component_key(path) is None:
+                raise FileNotFoundError(path) from exc
+            raise
+        with self._components_lock:
+            self._components[path] = (key, index)
+        return index
+
+    def _forget_missing_components(self, current: Sequence[str]) -> None:
+        with self._components_lock:
+            for path in list(self._components):
+                if path not in current:
+                    del self._components[path]
+
+    # -- Búsqueda -----------------------------------------------------------------
+
+    def search(self, query_vector: Sequence[float], k: int, scopes: Sequence[Scope]) -> List[Tuple[Document, float]]:
+        """Los ``k`` fragmentos más cercanos entre los etiquetados con alguno de ``scopes``.
+
+        Devuelve pares (documento, distancia L2) como ``similarity_search_with_score_by_vector``.
+        """
+        if not scopes or not self.exists():
+            return []
+        with self._connect() as connection:
+            vector_ids = self._scope_vector_ids(connection, scopes)
+            if not len(vector_ids):
+                return []
+
+            query = np.ascontiguousarray([query_vector], dtype=np.float32)
+            params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(vector_ids))
+            for attempt in range(2):
+                try:
+                    components = self.component_files()
+                    found: Dict[int, float] = {}
+                    for path in components:
+                        index = self._load_component(path)
+                        distances, ids = index.search(query, min(k, index.ntotal) or 1, params=params)
+                        for distance, vector_id in zip(distances[0].tolist(), ids[0].tolist()):
+                            if vector_id >= 0 and distance < found.get(vector_id, float("inf")):
+                                found[vector_id] = distance
+                    break
+                except (FileNotFoundError, RuntimeError):
+                    # Compactación concurrente (segmento borrado o índice sustituido
+                    # durante la lectura): se repite con la lista nueva de ficheros
+                    if attempt:
+                        raise
+            self._forget_missing_components(components)
+
+            best = sorted(found.items(), key=lambda item: item[1])[:k]
+            if not best:
+                return []
+            rows = connection.execute(
+                f"SELECT vector_id, doc_id, page_content, metadata FROM chunks "
+                f"WHERE vector_id IN ({', '.join('?' for _ in best)})",
+                [vector_id for vector_id, _distance in best],
+            ).fetchall()
+        documents = {
+            row[0]: Document(id=row[1], page_content=row[2], metadata=json.loads(row[3]))
+            for row in rows
+        }
+        return [(documents[vector_id], distance) for vector_id, distance in best if vector_id in documents]
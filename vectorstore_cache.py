@@ -0,0 +1,143 @@
+"""Caché en proceso de bases vectoriales FAISS ya cargadas.
+
+Cada consulta RAG necesitaba ``FAISS.load_local`` (lectura de ``index.faiss`` y
+deserialización de ``index.pkl``) para el chat y para cada base anexada. Esta
+caché conserva las bases cargadas entre peticiones del mismo proceso.
+
+- Clave: ruta absoluta de la carpeta de la base + sello de versión en disco
+  (``mtime_ns`` y tamaño de los ficheros de la base, en el formato que tenga:
+  ``index.faiss`` + ``docstore.sqlite3`` o el antiguo ``index.pkl``). Si otro
+  proceso reescribe la base, el sello cambia y la entrada se recarga.
+- Expulsión LRU con presupuesto en bytes (tamaño en disco de los ficheros).
+- Contadores de aciertos, fallos, expulsiones e invalidaciones.
+
+Las entradas se comparten entre hilos: solo deben usarse para lectura. Las
+rutas de escritura cargan su propia copia e invalidan la entrada al guardar.
+"""
+from __future__ import annotations
+
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import logger
+from faiss_storage import store_layout
+
+VersionStamp = Tuple[Tuple[str, int, int], ...]
+
+
+def _normalize_path(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+
+def store_version(path: str, filenames: Optional[Tuple[str, ...]] = None) -> Optional[VersionStamp]:
+    """Devuelve el sello de versión de una base en disco o None si está incompleta."""
+    filenames = filenames or store_layout(path)
+    if not filenames:
+        return None
+    stamp = []
+    for name in filenames:
+        try:
+            stat = os.stat(os.path.join(path, name))
+        except OSError:
+            return None
+        stamp.append((name, stat.st_mtime_ns, stat.st_size))
+    return tuple(stamp)
+
+
+def _stamp_bytes(stamp: VersionStamp) -> int:
+    return sum(size for _name, _mtime, size in stamp)
+
+
+class VectorStoreCache:
+    """Caché LRU de bases vectoriales con presupuesto en bytes."""
+
+    def __init__(self, max_bytes: int, filenames: Optional[Tuple[str, ...]] = None):
+        self.max_bytes = max(0, int(max_bytes))
+        self.filenames = filenames
+        self._entries: "OrderedDict[str, Tuple[VersionStamp, Any, int]]" = OrderedDict()
+        self._lock = Lock()
+        self._current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, path: str, loader: Callable[[str], Any]) -> Any:
+        """Obtiene la base de ``path`` desde la caché o la carga con ``loader``."""
+        key = _normalize_path(path)
+        stamp = store_version(path, self.filenames)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and stamp is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                # Versión obsoleta en disco: se descarta antes de recargar
+                self._drop(key)
+                self.invalidations += 1
+            self.misses += 1
+
+        store = loader(path)
+
+        if stamp is None:
+            return store
+
+        size = _stamp_bytes(stamp)
+        if size > self.max_bytes:
+            logger.debug(
+                f"Base vectorial {path} ({size} bytes) excede el presupuesto de caché ({self.max_bytes} bytes); no se almacena",
+                "vectorstore_cache.get",
+            )
+            return store
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (stamp, store, size)
+            self._current_bytes += size
+            while self._current_bytes > self.max_bytes and self._entries:
+                evicted_key = next(iter(self._entries))
+                self._drop(evicted_key)
+                self.evictions += 1
+                logger.debug(f"Base vectorial expulsada de la caché: {evicted_key}", "vectorstore_cache.get")
+        return store
+
+    def invalidate(self, path: str) -> None:
+        """Elimina de la caché la base de ``path`` y cualquier base anidada bajo ella."""
+        key = _normalize_path(path)
+        prefix = key.rstrip(os.sep) + os.sep
+        with self._lock:
+            stale = [cached for cached in self._entries if cached == key or cached.startswith(prefix)]
+            for cached in stale:
+                self._drop(cached)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Vacía la caché sin reiniciar los contadores."""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Devuelve los contadores y la ocupación actual de la caché."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "current_bytes": self._current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._current_bytes -= entry[2]